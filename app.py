@@ -1,9 +1,14 @@
-from scripts import create_app
 import os
 
+if __name__ == '__main__':
+    os.environ.setdefault('FLASK_DEBUG', '1')  # the dev server; also lets create_app use a dev SECRET_KEY
+
+from scripts import create_app
+
 app = create_app()
 
 if __name__ == '__main__':
+    # Development server only; production runs `gunicorn -c gunicorn.conf.py app:app`
     ssl_context = None
     cert_path = 'cert/cert.pem'
     key_path = 'cert/key.pem'
@@ -13,4 +18,11 @@ if __name__ == '__main__':
     else:
         print("Running without SSL (dev).")
 
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    debug = os.environ.get('FLASK_DEBUG', '1') == '1'
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':  # only in the serving child of the reloader
+        app.extensions['training_jobs'].recover()
+        port = app.config['METRICS_PORT']
+        if port:
+            from scripts.metrics import REGISTRY, start_metrics_server
+            start_metrics_server(port, REGISTRY.render, app.config['METRICS_HOST'])
+    app.run(host='0.0.0.0', port=5000, debug=debug, ssl_context=ssl_context)
@@ -0,0 +1 @@
+"""Micro-benchmarks and load tools. Run modules with ``python -m benchmarks.<name>``."""
@@ -0,0 +1,104 @@
+"""Shared helpers: latency summaries and JSON reports that can be diffed across commits."""
+import json
+import math
+import os
+import platform
+import subprocess
+import time
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, elapsed=None, errors=0):
+    """Latencies in seconds -> counts, throughput and percentiles in ms"""
+    values = sorted(latencies)
+    summary = {
+        'requests': len(values),
+        'errors': errors,
+        'mean_ms': round(sum(values) / len(values) * 1e3, 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1e3, 3),
+        'p95_ms': round(percentile(values, 95) * 1e3, 3),
+        'p99_ms': round(percentile(values, 99) * 1e3, 3),
+        'max_ms': round(values[-1] * 1e3, 3) if values else 0.0,
+    }
+    if elapsed:
+        summary['throughput_rps'] = round(len(values) / elapsed, 1)
+    return summary
+
+
+def timed_calls(fn, args_list, repeat=1, warmup=10):
+    """Per-call latencies of fn(*args) over args_list, repeated"""
+    for args in args_list[:warmup]:
+        fn(*args)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for args in args_list:
+            t = time.perf_counter()
+            fn(*args)
+            latencies.append(time.perf_counter() - t)
+    return latencies, time.perf_counter() - start
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(name, params, results, output=None, baseline=None):
+    """
+    Print (and optionally write) a benchmark report. With a baseline
+    report from an earlier commit, each numeric result also gets the
+    relative change.
+    """
+    data = {
+        'benchmark': name,
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'results': results,
+    }
+    if baseline:
+        with open(baseline) as f:
+            data['changes'] = compare(json.load(f).get('results', {}), results)
+    text = json.dumps(data, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return data
+
+
+def compare(before, after):
+    """{path: percent change} for numeric leaves present in both result trees"""
+    changes = {}
+
+    def walk(a, b, path):
+        if isinstance(a, dict) and isinstance(b, dict):
+            for key in a.keys() & b.keys():
+                walk(a[key], b[key], f"{path}.{key}" if path else key)
+        elif isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(a, bool):
+            if a:
+                changes[path] = round((b - a) / a * 100, 1)
+
+    walk(before, after, '')
+    return dict(sorted(changes.items()))
+
+
+def add_report_arguments(parser):
+    parser.add_argument('--output', help='Also write the JSON report to this file.')
+    parser.add_argument('--baseline', help='Earlier JSON report to compare against.')
@@ -0,0 +1,102 @@
+"""
+Dashboard cost with the seed_agents.py data set multiplied.
+
+    python -m benchmarks.dashboard_bench --copies 1000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from scripts import create_app, db
+from scripts.log_writer import persist_interactions
+from scripts.models import Chatbot, User
+from scripts.nlp import SimpleNLPEngine
+from seed_agents import PERSONALITIES, TEMPLATES
+
+SAMPLE_MESSAGES = [
+    "hello",
+    "hi",
+    "can you help me?",
+    "i want to buy something",
+    "i have a health question",
+    "bye",
+]
+
+
+def seed(copies):
+    bots = [
+        {
+            'name': f"{template.capitalize()} - {personality.capitalize()} Bot #{copy}",
+            'template': template,
+            'personality': personality,
+            'config_file': f"{template}_{personality}.yml",
+        }
+        for copy in range(copies)
+        for template in TEMPLATES
+        for personality in PERSONALITIES
+    ]
+    db.session.execute(Chatbot.__table__.insert(), bots)
+    db.session.commit()
+
+    logs = []
+    for bot_id, personality in db.session.query(Chatbot.id, Chatbot.personality):
+        for msg in SAMPLE_MESSAGES:
+            intent, response = SimpleNLPEngine.predict_intent(msg, personality)
+            logs.append({'bot_id': bot_id, 'user_message': msg, 'bot_response': response, 'intent': intent})
+        if len(logs) >= 10000:
+            persist_interactions(logs)
+            logs = []
+    persist_interactions(logs)
+    return len(bots)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--copies', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'bench.db')})
+        with app.app_context():
+            start = time.perf_counter()
+            bots = seed(args.copies)
+            seed_s = time.perf_counter() - start
+            user = User(username='bench', role='admin')
+            user.set_password('bench')
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+            engine = db.engine
+
+        statements = []
+        event.listen(engine, 'before_cursor_execute', lambda *a, **k: statements.append(1))
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+            session['role'] = 'admin'
+
+        timings = []
+        for _ in range(args.requests):
+            statements.clear()
+            start = time.perf_counter()
+            response = client.get('/')
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200
+
+        print(json.dumps({
+            'bots': bots,
+            'seed_seconds': round(seed_s, 2),
+            'dashboard_queries': len(statements),
+            'dashboard_ms_min': round(min(timings) * 1e3, 1),
+            'dashboard_ms_max': round(max(timings) * 1e3, 1),
+        }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+NLP engine micro-benchmarks against a local stub Rasa server.
+
+    python -m benchmarks.engine_bench --messages 2000 --latency-ms 0
+
+Covers the keyword engine, the local classifier (single and batched) and
+RasaNLPEngine with cache misses, cache hits, batched parses and an open
+circuit breaker. Messages come from a fixed seed, so runs are comparable.
+"""
+import argparse
+import os
+import random
+import time
+
+from .common import add_report_arguments, report, summarize, timed_calls
+from .seed import MESSAGES
+from .stub_rasa import start_stub_rasa
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Delay added by the stub Rasa server.')
+    parser.add_argument('--seed', type=int, default=0)
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
+    server, url = start_stub_rasa(latency_ms=args.latency_ms)
+    # rasa_client reads the URL at import time
+    os.environ['RASA_SERVER_URL'] = url
+    from scripts.nlp import SimpleNLPEngine
+    from scripts.rasa_integration import RasaNLPEngine, prediction_cache, rasa_client
+
+    rng = random.Random(args.seed)
+    messages = [rng.choice(MESSAGES) + f" {rng.randint(0, 10 ** 9)}" for _ in range(args.messages)]
+    personalities = ['friendly', 'professional', 'casual']
+    calls = [(m, rng.choice(personalities)) for m in messages]
+    results = {}
+
+    latencies, elapsed = timed_calls(SimpleNLPEngine.predict_intent, calls, args.repeat)
+    results['simple_engine'] = summarize(latencies, elapsed)
+
+    classifier = RasaNLPEngine.local_classifier()
+    if classifier is not None:
+        latencies, elapsed = timed_calls(classifier.predict, [(m,) for m in messages], args.repeat)
+        results['local_classifier'] = summarize(latencies, elapsed)
+        batches = [(messages[i:i + args.batch_size],) for i in range(0, len(messages), args.batch_size)]
+        latencies, elapsed = timed_calls(classifier.predict_batch, batches, args.repeat)
+        results['local_classifier_batch'] = summarize(latencies, elapsed)
+        results['local_classifier_batch']['per_message_us'] = round(
+            elapsed / (args.repeat * len(messages)) * 1e6, 2)
+
+    # every message is unique, so the first pass misses the cache and the second hits it
+    prediction_cache.clear()
+    latencies, elapsed = timed_calls(RasaNLPEngine.predict_intent, calls, 1, warmup=0)
+    results['rasa_engine_miss'] = summarize(latencies, elapsed)
+    latencies, elapsed = timed_calls(RasaNLPEngine.predict_intent, calls, args.repeat, warmup=0)
+    results['rasa_engine_hit'] = summarize(latencies, elapsed)
+
+    prediction_cache.clear()
+    batches = [
+        ([m for m, _ in calls[i:i + args.batch_size]], 'friendly')
+        for i in range(0, len(calls), args.batch_size)
+    ]
+    latencies, elapsed = timed_calls(RasaNLPEngine.predict_intents, batches, 1, warmup=0)
+    results['rasa_engine_batch'] = summarize(latencies, elapsed)
+
+    # breaker open: requests are answered by the fallback without touching the network
+    prediction_cache.clear()
+    breakers = [backend.breaker for backend in rasa_client.backends]
+    for breaker in breakers:
+        breaker.state, breaker.opened_at, breaker.reset_timeout = breaker.OPEN, time.monotonic(), 3600
+    latencies, elapsed = timed_calls(RasaNLPEngine.predict_intent, calls, 1)
+    results['rasa_engine_breaker_open'] = summarize(latencies, elapsed)
+    for breaker in breakers:
+        breaker.record_success()
+
+    results['rasa'] = rasa_client.stats()['pools']
+    server.shutdown()
+
+    params = {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')}
+    report('engine', params, results, args.output, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
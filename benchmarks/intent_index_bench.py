@@ -0,0 +1,75 @@
+"""
+Keyword intent matching latency with a synthetic, large intent set.
+
+    python -m benchmarks.intent_index_bench --intents 500 --phrases 20
+"""
+import argparse
+import json
+import random
+import string
+import time
+
+from scripts.nlp import INTENT_INDEX, KeywordIntentIndex, SimpleNLPEngine
+
+
+def synthetic_phrases(n_intents, phrases_per_intent, seed=0):
+    rng = random.Random(seed)
+    vocab = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(5000)]
+    phrases = []
+    for i in range(n_intents):
+        for _ in range(phrases_per_intent):
+            phrases.append((f"intent_{i}", ' '.join(rng.choices(vocab, k=rng.randint(1, 4)))))
+    return phrases, vocab
+
+
+def linear_match(phrases, message):
+    """The pre-index approach: substring test every keyword in order"""
+    message = message.lower()
+    for intent, phrase in phrases:
+        if phrase in message:
+            return intent
+    return None
+
+
+def time_per_call(fn, messages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for m in messages:
+            fn(m)
+    return (time.perf_counter() - start) / (repeat * len(messages)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--intents', type=int, default=500)
+    parser.add_argument('--phrases', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    phrases, vocab = synthetic_phrases(args.intents, args.phrases)
+    rng = random.Random(1)
+    messages = [' '.join(rng.choices(vocab, k=rng.randint(3, 15))) for _ in range(args.messages)]
+
+    start = time.perf_counter()
+    index = KeywordIntentIndex(phrases)
+    build_ms = (time.perf_counter() - start) * 1e3
+
+    results = {
+        'intents': args.intents,
+        'phrases': len(phrases),
+        'index_build_ms': round(build_ms, 2),
+        'indexed_match_us': round(time_per_call(index.match, messages, args.repeat), 3),
+        'linear_match_us': round(time_per_call(lambda m: linear_match(phrases, m), messages, 1), 3),
+        'project_index_phrases': INTENT_INDEX.size,
+        'simple_engine_us': round(time_per_call(
+            SimpleNLPEngine.predict_intent,
+            ['hello there', 'i want to buy something', 'what is this', 'bye'] * 250,
+            args.repeat,
+        ), 3),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
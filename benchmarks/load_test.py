@@ -0,0 +1,175 @@
+"""
+HTTP load test of the chat, dashboard, analytics and export endpoints.
+
+    python -m benchmarks.load_test --database sqlite:///bench.db --concurrency 16
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --bot-ids 1,2,3
+
+Without --url the app is served in-process (threaded werkzeug server) on
+--database, seeded first if it has no bots, with a stub Rasa server
+behind it; --shared-state stub also puts the shared state on a stub
+Redis-protocol server (benchmarks/stub_kv.py). With --url an already running deployment is tested instead;
+log in as the benchmark user created by ``python -m benchmarks.seed``.
+Each scenario reports throughput and p50/p95/p99 latency as JSON.
+"""
+import argparse
+import os
+import random
+import threading
+import time
+
+import requests
+
+from .common import add_report_arguments, report, summarize
+from .seed import BENCH_USER, MESSAGES
+from .stub_kv import start_stub_kv
+from .stub_rasa import start_stub_rasa
+
+
+def serve_locally(args):
+    """Start stub Rasa and the app in this process; returns (base_url, bot_ids, stop)"""
+    stub, rasa_url = start_stub_rasa(latency_ms=args.rasa_latency_ms)
+    os.environ['RASA_SERVER_URL'] = rasa_url  # read when scripts.rasa_integration is imported
+    kv = None
+    if args.shared_state == 'stub':
+        kv, os.environ['SHARED_STATE_URL'] = start_stub_kv()
+    from werkzeug.serving import make_server
+    from scripts import db
+    from scripts.models import Chatbot
+    from .seed import bench_app, seed
+
+    app = bench_app(args.database)
+    with app.app_context():
+        if Chatbot.query.count() == 0:
+            print(f"Seeding {args.seed_bots} bots and {args.seed_logs} logs...")
+            seed(args.seed_bots, args.seed_logs)
+        # the busiest bots, which is where real traffic concentrates
+        bot_ids = [bot_id for (bot_id,) in db.session.query(Chatbot.id).order_by(Chatbot.id).limit(20)]
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-http', daemon=True).start()
+
+    def stop():
+        server.shutdown()
+        stub.shutdown()
+        if kv is not None:
+            kv.shutdown()
+        app.extensions['log_writer'].close()
+
+    return f"http://127.0.0.1:{server.server_port}", bot_ids, stop
+
+
+def logged_in_session(base_url, username, password):
+    session = requests.Session()
+    response = session.post(f"{base_url}/login", data={'username': username, 'password': password},
+                            allow_redirects=False)
+    if 'session' not in session.cookies:
+        raise SystemExit(f"Login as {username!r} failed ({response.status_code})")
+    return session
+
+
+def run_scenario(base_url, credentials, make_request, total, concurrency):
+    """total requests over concurrency threads, each with its own logged-in session"""
+    latencies = []
+    errors = [0]
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        session = logged_in_session(base_url, *credentials)
+        rng = random.Random(worker_id)
+        local = []
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    break
+            start = time.perf_counter()
+            try:
+                ok = make_request(session, rng)
+            except requests.RequestException:
+                ok = False
+            local.append(time.perf_counter() - start)
+            if not ok:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - start, errors[0])
+
+
+def scenarios(base_url, bot_ids, export_format):
+    def chat(session, rng):
+        response = session.post(f"{base_url}/chat_response", json={
+            'bot_id': rng.choice(bot_ids),
+            'message': rng.choice(MESSAGES),
+        })
+        return response.status_code == 200
+
+    def dashboard(session, rng):
+        return session.get(f"{base_url}/").status_code == 200
+
+    def analytics(session, rng):
+        return session.get(f"{base_url}/analytics/{rng.choice(bot_ids)}").status_code == 200
+
+    def export(session, rng):
+        response = session.get(f"{base_url}/train/export/{rng.choice(bot_ids)}",
+                               params={'format': export_format}, stream=True)
+        for _ in response.iter_content(64 * 1024):
+            pass
+        return response.status_code == 200
+
+    return {'chat_response': chat, 'dashboard': dashboard, 'analytics': analytics, 'export': export}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help='Test a running deployment instead of an in-process server.')
+    parser.add_argument('--database', default='sqlite:///bench.db')
+    parser.add_argument('--seed-bots', type=int, default=1000)
+    parser.add_argument('--seed-logs', type=int, default=200000)
+    parser.add_argument('--rasa-latency-ms', type=float, default=5.0)
+    parser.add_argument('--shared-state', default='local', choices=['local', 'stub'],
+                        help='In-process shared state, or a stub Redis-protocol server.')
+    parser.add_argument('--bot-ids', help='Comma separated bot ids to use with --url (default 1-10).')
+    parser.add_argument('--username', default=BENCH_USER[0])
+    parser.add_argument('--password', default=BENCH_USER[1])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per scenario.')
+    parser.add_argument('--export-requests', type=int, default=20)
+    parser.add_argument('--export-format', default='ndjson', choices=['json', 'ndjson', 'csv'])
+    parser.add_argument('--only', help='Comma separated scenarios to run.')
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
+    stop = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+        bot_ids = [int(b) for b in args.bot_ids.split(',')] if args.bot_ids else list(range(1, 11))
+    else:
+        base_url, bot_ids, stop = serve_locally(args)
+
+    selected = set(args.only.split(',')) if args.only else None
+    results = {}
+    try:
+        for name, make_request in scenarios(base_url, bot_ids, args.export_format).items():
+            if selected and name not in selected:
+                continue
+            total = args.export_requests if name == 'export' else args.requests
+            results[name] = run_scenario(
+                base_url, (args.username, args.password), make_request, total, args.concurrency)
+    finally:
+        if stop is not None:
+            stop()
+
+    params = {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'password')}
+    report('load', params, results, args.output, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
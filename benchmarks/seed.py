@@ -0,0 +1,149 @@
+"""
+Bulk-seed a database with synthetic bots and millions of interaction logs.
+
+    python -m benchmarks.seed --database sqlite:///bench.db --bots 1000 --logs 2000000
+
+Logs are generated in timestamp order over --days and written with core
+executemany inserts in --batch sized transactions; BotStats and the intent
+rollups are then rebuilt once from the logs instead of per insert. The
+same --seed always produces the same data.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from scripts import create_app, db
+from scripts.aggregates import rebuild_bot_stats, rebuild_rollups
+from scripts.database import DEFAULT_SQLITE_PRAGMAS
+from scripts.models import Chatbot, InteractionLog, User
+from scripts.nlp import SimpleNLPEngine
+from seed_agents import PERSONALITIES, TEMPLATES
+
+from .common import add_report_arguments, report
+
+MESSAGES = [
+    "hello", "hi there", "hey", "good morning",
+    "can you help me?", "what can you do", "i need some info",
+    "i want to buy something", "how much does it cost", "place an order",
+    "i have a health question", "i feel sick", "where is the doctor",
+    "bye", "see you later", "goodbye",
+    "asdf qwerty", "tell me a joke", "what is the weather like",
+]
+
+BENCH_USER = ('bench', 'bench')
+
+
+def bench_app(database_url, bulk_load=False):
+    config = {'SQLALCHEMY_DATABASE_URI': database_url}
+    if bulk_load and database_url.startswith('sqlite'):
+        # durability does not matter for a throwaway benchmark database
+        config['SQLITE_PRAGMAS'] = dict(DEFAULT_SQLITE_PRAGMAS, synchronous='OFF')
+    return create_app(config)
+
+
+def seed_bots(n_bots):
+    rows = []
+    for i in range(n_bots):
+        template = TEMPLATES[i % len(TEMPLATES)]
+        personality = PERSONALITIES[(i // len(TEMPLATES)) % len(PERSONALITIES)]
+        rows.append({
+            'name': f"{template.capitalize()} - {personality.capitalize()} Bot #{i}",
+            'template': template,
+            'personality': personality,
+            'config_file': f"{template}_{personality}.yml",
+        })
+    db.session.execute(Chatbot.__table__.insert(), rows)
+    db.session.commit()
+    return db.session.query(Chatbot.id, Chatbot.personality).order_by(Chatbot.id).all()
+
+
+def ensure_bench_user():
+    username, password = BENCH_USER
+    if User.query.filter_by(username=username).first() is None:
+        user = User(username=username, role='admin')
+        user.set_password(password)
+        db.session.add(user)
+        db.session.commit()
+
+
+def seed_logs(bots, n_logs, days, batch_size, rng, hot_fraction=0.1):
+    """
+    n_logs rows spread evenly over the last `days` days. 80% of traffic
+    goes to the first hot_fraction of bots, like a few popular deployments.
+    """
+    predictions = {
+        personality: [(m,) + SimpleNLPEngine.predict_intent(m, personality) for m in MESSAGES]
+        for personality in PERSONALITIES
+    }
+    hot = bots[:max(1, int(len(bots) * hot_fraction))]
+    table = InteractionLog.__table__
+    start = datetime.utcnow() - timedelta(days=days)
+    step = timedelta(days=days) / max(n_logs, 1)
+
+    written = 0
+    while written < n_logs:
+        rows = []
+        for i in range(written, min(n_logs, written + batch_size)):
+            bot_id, personality = rng.choice(hot) if rng.random() < 0.8 else rng.choice(bots)
+            message, intent, response = rng.choice(predictions.get(personality) or predictions['friendly'])
+            rows.append({
+                'bot_id': bot_id,
+                'user_message': message,
+                'bot_response': response,
+                'intent': intent,
+                'timestamp': start + step * i,
+            })
+        db.session.execute(table.insert(), rows)
+        db.session.commit()
+        written += len(rows)
+    return written
+
+
+def seed(n_bots, n_logs, days=90, batch_size=20000, seed=0, aggregates=True):
+    """Seed the current app's database; returns timings"""
+    rng = random.Random(seed)
+    timings = {}
+
+    t = time.perf_counter()
+    bots = seed_bots(n_bots)
+    ensure_bench_user()
+    timings['bots_seconds'] = round(time.perf_counter() - t, 2)
+
+    t = time.perf_counter()
+    written = seed_logs(bots, n_logs, days, batch_size, rng)
+    elapsed = time.perf_counter() - t
+    timings['logs_seconds'] = round(elapsed, 2)
+    timings['logs_per_second'] = round(written / elapsed) if elapsed else None
+
+    if aggregates:
+        t = time.perf_counter()
+        rebuild_bot_stats()
+        timings['bot_stats_seconds'] = round(time.perf_counter() - t, 2)
+        t = time.perf_counter()
+        timings['rollup_rows'] = rebuild_rollups()
+        timings['rollups_seconds'] = round(time.perf_counter() - t, 2)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', default='sqlite:///bench.db',
+                        help='SQLAlchemy URL; relative SQLite paths land in instance/.')
+    parser.add_argument('--bots', type=int, default=1000)
+    parser.add_argument('--logs', type=int, default=1000000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--batch', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-aggregates', action='store_true')
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
+    app = bench_app(args.database, bulk_load=True)
+    with app.app_context():
+        timings = seed(args.bots, args.logs, args.days, args.batch, args.seed, not args.skip_aggregates)
+    report('seed', vars(args), timings, args.output, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""
+Minimal in-memory server speaking the Redis protocol (RESP2), enough for
+scripts/shared_state.py: strings with expiry, counters, hashes,
+pipelines and MULTI/EXEC. Lets SHARED_STATE_URL=redis://... be run and
+benchmarked without a Redis install.
+
+    python -m benchmarks.stub_kv --port 6379
+"""
+import argparse
+import socket
+import socketserver
+import threading
+import time
+
+
+class KVStore:
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+
+    def _live(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            del self.expires[key]
+        return self.data.get(key)
+
+    def _expire(self, key, seconds):
+        if seconds is None:
+            self.expires.pop(key, None)
+        else:
+            self.expires[key] = time.monotonic() + seconds
+
+    def execute(self, command, args):
+        """Run one command under the store lock; returns a RESP value or raises ValueError"""
+        handler = getattr(self, f"cmd_{command}", None)
+        if handler is None:
+            raise ValueError(f"unknown command '{command}'")
+        return handler(*args)
+
+    def cmd_ping(self, *args):
+        return args[0] if args else Simple('PONG')
+
+    def cmd_select(self, db):
+        return Simple('OK')
+
+    def cmd_client(self, *args):
+        return Simple('OK')
+
+    def cmd_dbsize(self):
+        return len([k for k in list(self.data) if self._live(k) is not None])
+
+    def cmd_flushdb(self, *args):
+        self.data.clear()
+        self.expires.clear()
+        return Simple('OK')
+
+    def cmd_get(self, key):
+        value = self._live(key)
+        if isinstance(value, dict):
+            raise ValueError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    def cmd_mget(self, *keys):
+        return [v if isinstance(v, bytes) else None for v in (self._live(k) for k in keys)]
+
+    def cmd_set(self, key, value, *options):
+        options = [o.lower() if isinstance(o, bytes) else o for o in options]
+        ttl = None
+        nx = b'nx' in options
+        for flag, scale in ((b'ex', 1.0), (b'px', 0.001)):
+            if flag in options:
+                ttl = int(options[options.index(flag) + 1]) * scale
+        if nx and self._live(key) is not None:
+            return None
+        self.data[key] = value
+        self._expire(key, ttl)
+        return Simple('OK')
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._live(key) is not None:
+                removed += 1
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return removed
+
+    def cmd_incrby(self, key, amount):
+        value = int(self._live(key) or 0) + int(amount)
+        self.data[key] = str(value).encode()
+        return value
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, b'1')
+
+    def cmd_expire(self, key, seconds):
+        if self._live(key) is None:
+            return 0
+        self._expire(key, int(seconds))
+        return 1
+
+    def cmd_ttl(self, key):
+        if self._live(key) is None:
+            return -2
+        expires_at = self.expires.get(key)
+        return -1 if expires_at is None else int(expires_at - time.monotonic())
+
+    def _hash(self, key):
+        table = self._live(key)
+        if table is None:
+            table = self.data[key] = {}
+        elif not isinstance(table, dict):
+            raise ValueError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return table
+
+    def cmd_hincrby(self, key, field, amount):
+        table = self._hash(key)
+        value = int(table.get(field, 0)) + int(amount)
+        table[field] = str(value).encode()
+        return value
+
+    def cmd_hset(self, key, *pairs):
+        table = self._hash(key)
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in table
+            table[field] = value
+        return added
+
+    def cmd_hgetall(self, key):
+        table = self._live(key) or {}
+        return [item for pair in table.items() for item in pair]
+
+
+class Simple(str):
+    """A RESP simple string (+OK) rather than a bulk string"""
+
+
+def encode(value):
+    if isinstance(value, Simple):
+        return b'+' + value.encode() + b'\r\n'
+    if isinstance(value, Exception):
+        message = str(value)
+        return b'-' + (message if message.startswith('WRONGTYPE') else 'ERR ' + message).encode() + b'\r\n'
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, bool) or isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    return b'*%d\r\n' % len(value) + b''.join(encode(v) for v in value)
+
+
+def parse_command(buffer):
+    """(args, consumed) for the first complete command in buffer, or (None, 0)"""
+    if not buffer.startswith(b'*'):
+        end = buffer.find(b'\r\n')  # inline command, e.g. from telnet
+        if end < 0:
+            return None, 0
+        return buffer[:end].split(), end + 2
+    end = buffer.find(b'\r\n')
+    if end < 0:
+        return None, 0
+    count = int(buffer[1:end])
+    pos = end + 2
+    args = []
+    for _ in range(count):
+        end = buffer.find(b'\r\n', pos)
+        if end < 0:
+            return None, 0
+        length = int(buffer[pos + 1:end])
+        start = end + 2
+        if len(buffer) < start + length + 2:
+            return None, 0
+        args.append(bytes(buffer[start:start + length]))
+        pos = start + length + 2
+    return args, pos
+
+
+class KVHandler(socketserver.BaseRequestHandler):
+    store = None
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buffer = bytearray()
+        queued = None  # commands between MULTI and EXEC
+        while True:
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return
+            buffer += chunk
+            replies = []
+            # answer every complete command received so far in one write (pipelining)
+            while True:
+                args, consumed = parse_command(buffer)
+                if args is None:
+                    break
+                del buffer[:consumed]
+                if not args:
+                    continue
+                command = args[0].decode().lower()
+                if command == 'quit':
+                    self.request.sendall(b''.join(replies) + encode(Simple('OK')))
+                    return
+                if command == 'multi':
+                    queued = []
+                    replies.append(encode(Simple('OK')))
+                elif command == 'discard':
+                    queued = None
+                    replies.append(encode(Simple('OK')))
+                elif command == 'exec':
+                    results = []
+                    with self.store.lock:
+                        for cmd, cmd_args in queued or []:
+                            try:
+                                results.append(self.store.execute(cmd, cmd_args))
+                            except (ValueError, TypeError, IndexError) as e:
+                                results.append(ValueError(str(e)))
+                    queued = None
+                    replies.append(encode(results))
+                elif queued is not None:
+                    queued.append((command, args[1:]))
+                    replies.append(encode(Simple('QUEUED')))
+                else:
+                    try:
+                        with self.store.lock:
+                            replies.append(encode(self.store.execute(command, args[1:])))
+                    except (ValueError, TypeError, IndexError) as e:
+                        replies.append(encode(ValueError(str(e))))
+            if replies:
+                self.request.sendall(b''.join(replies))
+
+
+class StubKVServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def start_stub_kv(port=0):
+    """Serve in a daemon thread; returns (server, redis:// url)"""
+    handler = type('Handler', (KVHandler,), {'store': KVStore()})
+    server = StubKVServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, name='stub-kv', daemon=True).start()
+    return server, f"redis://127.0.0.1:{server.server_address[1]}/0"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+    server, url = start_stub_kv(args.port)
+    print(f"Stub key-value server listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Minimal stand-in for ``rasa run --enable-api``: answers /status and
+/model/parse with keyword intents after an optional fixed delay.
+
+    python -m benchmarks.stub_rasa --port 5005 --latency-ms 20
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+KEYWORDS = [
+    ('greet', ('hello', 'hi', 'hey')),
+    ('goodbye', ('bye', 'goodbye', 'see you')),
+    ('purchase', ('buy', 'order', 'price')),
+    ('health', ('health', 'doctor', 'sick')),
+    ('info', ('help', 'info', 'what')),
+]
+
+
+def classify(text):
+    words = text.lower()
+    for intent, keywords in KEYWORDS:
+        if any(keyword in words for keyword in keywords):
+            return intent, 0.9
+    return 'unknown', 0.3
+
+
+class StubRasaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like Rasa's sanic server
+    # headers and body go out in separate writes; without this, Nagle plus
+    # delayed ACKs add ~40 ms to every keep-alive response
+    disable_nagle_algorithm = True
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith('/status'):
+            self._send_json({'model_file': 'models/stub.tar.gz', 'num_active_training_jobs': 0})
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            text = json.loads(self.rfile.read(length) or b'{}').get('text', '')
+        except ValueError:
+            self._send_json({'error': 'bad json'}, 400)
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        intent, confidence = classify(text)
+        self._send_json({
+            'text': text,
+            'intent': {'name': intent, 'confidence': confidence},
+            'entities': [],
+        })
+
+
+def start_stub_rasa(port=0, latency_ms=0.0):
+    """Serve in a daemon thread; returns (server, base_url)"""
+    handler = type('Handler', (StubRasaHandler,), {'latency': latency_ms / 1000.0})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='stub-rasa', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=5005)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    args = parser.parse_args()
+    server, url = start_stub_rasa(args.port, args.latency_ms)
+    print(f"Stub Rasa listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+from scripts import create_app
+from scripts.chat_gateway import run_gateway
+
+app = create_app()
+
+if __name__ == '__main__':
+    run_gateway(app)
@@ -0,0 +1,46 @@
+# Production server settings: gunicorn -c gunicorn.conf.py app:app
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+# Build the app, NLP tables and DB engine once in the master, then fork.
+# `kill -HUP <master>` replaces workers gracefully; code changes need
+# USR2 (new master) followed by WINCH/QUIT on the old one.
+preload_app = True
+
+cert_path = os.environ.get('SSL_CERT', 'cert/cert.pem')
+key_path = os.environ.get('SSL_KEY', 'cert/key.pem')
+if os.path.exists(cert_path) and os.path.exists(key_path):
+    certfile = cert_path
+    keyfile = key_path
+
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    from app import app
+    from scripts.serving import serve_metrics, warm_up
+    warm_up(app)
+    serve_metrics(app)
+
+
+def post_fork(server, worker):
+    from app import app
+    from scripts.serving import after_fork
+    after_fork(app)
+
+
+def worker_exit(server, worker):
+    from app import app
+    from scripts.serving import before_exit
+    before_exit(app)
@@ -0,0 +1,5 @@
+from scripts.rasa_supervisor import run_supervisor
+
+if __name__ == "__main__":
+    print("Starting Rasa worker pool (RASA_WORKERS, default: 1)")
+    run_supervisor()
@@ -1,28 +1,136 @@
 import os
+import secrets
+import tempfile
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 db = SQLAlchemy()
 
-def create_app():
+def _fallback_secret_key():
+    """
+    Key used when SECRET_KEY is unset: a fixed one for the debug server, so
+    the reloader keeps sessions, otherwise a random one (never a key that
+    is published with the source)
+    """
+    if os.environ.get('FLASK_DEBUG') == '1':
+        return 'dev-only-insecure-key'
+    print("WARNING: SECRET_KEY is not set, using a random key. Sessions and chat tokens will not "
+          "survive a restart and are not accepted by other replicas; set SECRET_KEY.")
+    return secrets.token_hex(32)
+
+def create_app(config_overrides=None):
     BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
     templates_dir = os.path.join(BASE_DIR, 'templates')
     static_dir = os.path.join(BASE_DIR, 'static')
 
     app = Flask(__name__, template_folder=templates_dir, static_folder=static_dir)
-    app.config['SECRET_KEY'] = 'mini_project_key'
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chatbots.db'
+    # every replica must sign sessions and chat tokens with the same key
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or _fallback_secret_key()
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['NLP_MICRO_BATCH'] = os.environ.get('NLP_MICRO_BATCH', '0') == '1'
+    app.config['NLP_MICRO_BATCH_WAIT_MS'] = float(os.environ.get('NLP_MICRO_BATCH_WAIT_MS', '5'))
+    app.config['NLP_MICRO_BATCH_MAX'] = int(os.environ.get('NLP_MICRO_BATCH_MAX', '32'))
+    app.config['CHAT_BATCH_LIMIT'] = 1000
+    app.config['CHAT_GATEWAY_URL'] = os.environ.get('CHAT_GATEWAY_URL', '')  # e.g. ws://localhost:5001/ws/chat
+    app.config['CHAT_TOKEN_MAX_AGE'] = int(os.environ.get('CHAT_TOKEN_MAX_AGE', str(30 * 24 * 3600)))
+    app.config['INTERACTION_LOG_WRITE_BEHIND'] = os.environ.get('INTERACTION_LOG_WRITE_BEHIND', '0') == '1'
+    app.config['INTERACTION_LOG_QUEUE_SIZE'] = int(os.environ.get('INTERACTION_LOG_QUEUE_SIZE', '10000'))
+    app.config['INTERACTION_LOG_BATCH_SIZE'] = int(os.environ.get('INTERACTION_LOG_BATCH_SIZE', '500'))
+    app.config['INTERACTION_LOG_FLUSH_INTERVAL'] = float(os.environ.get('INTERACTION_LOG_FLUSH_INTERVAL', '0.5'))
+    app.config['TRAINING_WORKERS'] = int(os.environ.get('TRAINING_WORKERS', '1'))
+    app.config['TRAINING_MAX_PENDING'] = int(os.environ.get('TRAINING_MAX_PENDING', '10'))
+    app.config['TRAINING_JOB_STALE'] = int(os.environ.get('TRAINING_JOB_STALE', '3600'))
+    app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('UPLOAD_MAX_MB', '1024')) * 1024 * 1024
+    app.config['SLOW_REQUEST_PROFILE_MS'] = float(os.environ.get('SLOW_REQUEST_PROFILE_MS', '0'))  # 0 = off
+    app.config['SLOW_REQUEST_SAMPLE_MS'] = float(os.environ.get('SLOW_REQUEST_SAMPLE_MS', '5'))
+    app.config['SLOW_REQUEST_PROFILE_DIR'] = os.environ.get(
+        'SLOW_REQUEST_PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+    app.config['METRICS_PORT'] = int(os.environ.get('METRICS_PORT', '9100'))  # 0 = off
+    app.config['METRICS_HOST'] = os.environ.get('METRICS_HOST', '0.0.0.0')
+    app.config['METRICS_MULTIPROC_DIR'] = os.environ.get(
+        'METRICS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), f"ai-chatbot-metrics-{os.getpid()}"))
+    app.config['METRICS_WRITE_INTERVAL'] = float(os.environ.get('METRICS_WRITE_INTERVAL', '5'))
+    # proxies in front of the app (ingress, load balancer) whose X-Forwarded-For is trusted; 0 = none
+    app.config['PROXY_FIX_HOPS'] = int(os.environ.get('PROXY_FIX_HOPS', '0'))
+    app.config['CHAT_RATE_LIMIT_PER_MINUTE'] = int(os.environ.get('CHAT_RATE_LIMIT_PER_MINUTE', '0'))  # 0 = off
+    app.config['CHAT_DAILY_LIMIT_PER_BOT'] = int(os.environ.get('CHAT_DAILY_LIMIT_PER_BOT', '0'))  # 0 = off
+    app.config['AGGREGATE_FLUSH_INTERVAL'] = float(os.environ.get('AGGREGATE_FLUSH_INTERVAL', '0'))  # 0 = per insert
+    app.config['LOG_RETENTION_DAYS'] = int(os.environ.get('LOG_RETENTION_DAYS', '90'))
+    app.config['LOG_ARCHIVE_DIR'] = os.environ.get('LOG_ARCHIVE_DIR', os.path.join(app.instance_path, 'archive'))
+    if config_overrides:
+        app.config.update(config_overrides)
 
+    from .database import configure_database, install_sqlite_pragmas, upgrade_schema, upgrade_db_command
+    configure_database(app)
     db.init_app(app)
+    if app.config['PROXY_FIX_HOPS'] > 0:
+        # request.remote_addr becomes the client the trusted proxies saw, not the last proxy
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_HOPS'])
 
     from . import models  # register models
+    from . import metrics, http_cache
+    metrics.init_app(app)
+    http_cache.init_app(app)
+    from .aggregates import backfill_if_empty, rebuild_stats_command, backfill_rollups_command
     with app.app_context():
-        db.create_all()
+        install_sqlite_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])
+        upgrade_schema()
+        backfill_if_empty()
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(rebuild_stats_command)
+    app.cli.add_command(backfill_rollups_command)
+    from .archive import archive_logs_command
+    app.cli.add_command(archive_logs_command)
+
+    try:
+        from .local_classifier import train_local_nlu_command
+        app.cli.add_command(train_local_nlu_command)
+    except ImportError:  # numpy not installed
+        pass
+
+    from .shared_state import ChatRateLimiter, shared_state
+    app.extensions['chat_rate_limiter'] = ChatRateLimiter(
+        shared_state,
+        per_minute=app.config['CHAT_RATE_LIMIT_PER_MINUTE'],
+        per_bot_day=app.config['CHAT_DAILY_LIMIT_PER_BOT'],
+    )
+    if app.config['AGGREGATE_FLUSH_INTERVAL'] > 0:
+        from .aggregates import AggregateBuffer
+        app.extensions['aggregate_buffer'] = AggregateBuffer(
+            app, shared_state, app.config['AGGREGATE_FLUSH_INTERVAL'])  # closed after the log writer at exit
+
+    from .log_writer import InteractionLogWriter
+    app.extensions['log_writer'] = InteractionLogWriter(
+        app,
+        write_behind=app.config['INTERACTION_LOG_WRITE_BEHIND'],
+        max_queue=app.config['INTERACTION_LOG_QUEUE_SIZE'],
+        batch_size=app.config['INTERACTION_LOG_BATCH_SIZE'],
+        flush_interval=app.config['INTERACTION_LOG_FLUSH_INTERVAL'],
+    )
+
+    from .training_jobs import TrainingJobRunner
+    app.extensions['training_jobs'] = TrainingJobRunner(
+        app,
+        max_workers=app.config['TRAINING_WORKERS'],
+        max_pending=app.config['TRAINING_MAX_PENDING'],
+        stale_after=app.config['TRAINING_JOB_STALE'],
+    )
+
+    if app.config['NLP_MICRO_BATCH']:
+        from .batching import MicroBatcher
+        from .rasa_integration import RasaNLPEngine
+        app.extensions['nlp_batcher'] = MicroBatcher(
+            RasaNLPEngine,
+            max_batch=app.config['NLP_MICRO_BATCH_MAX'],
+            max_wait_ms=app.config['NLP_MICRO_BATCH_WAIT_MS'],
+        )
 
     from .auth_routes import auth_bp
     from .bot_routes import bot_bp
+    from .health_routes import health_bp
     app.register_blueprint(auth_bp)
     app.register_blueprint(bot_bp)
+    app.register_blueprint(health_bp)
 
     return app
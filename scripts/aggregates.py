@@ -0,0 +1,345 @@
+import atexit
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import and_, case, func
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .archive import archive_counts, archived_bot_ids, iter_archived
+from .models import BotStats, Chatbot, InteractionLog, IntentRollup
+
+
+ROLLUP_GRANULARITIES = ('hour', 'day')
+# longest span intent_series returns: 168 hourly or 366 daily buckets
+SERIES_WINDOW = {'hour': timedelta(days=7), 'day': timedelta(days=366)}
+
+
+def bucket_start(timestamp, granularity):
+    if granularity == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def update_aggregates(records):
+    """
+    Fold a batch of interaction dicts into the aggregate tables.
+    Runs inside the caller's transaction, before its commit.
+    """
+    apply_deltas(*aggregate_deltas(records))
+
+
+def aggregate_deltas(records):
+    """({bot_id: (count, latest timestamp)}, Counter of rollup buckets) for a batch"""
+    per_bot = {}
+    buckets = Counter()
+    for record in records:
+        count, latest = per_bot.get(record['bot_id'], (0, None))
+        timestamp = record['timestamp']
+        per_bot[record['bot_id']] = (count + 1, timestamp if latest is None else max(latest, timestamp))
+        intent = record.get('intent') or 'unknown'
+        for granularity in ROLLUP_GRANULARITIES:
+            buckets[(record['bot_id'], granularity, bucket_start(timestamp, granularity), intent)] += 1
+    return per_bot, buckets
+
+
+def apply_deltas(per_bot, buckets):
+    for bot_id, (count, latest) in per_bot.items():
+        _increment(
+            BotStats.__table__, {'bot_id': bot_id}, 'interaction_count', count,
+            {'last_interaction_at': latest} if latest is not None else None,
+        )
+    for (bot_id, granularity, start, intent), count in buckets.items():
+        _increment(
+            IntentRollup.__table__,
+            {'bot_id': bot_id, 'granularity': granularity, 'bucket_start': start, 'intent': intent},
+            'count', count,
+        )
+
+
+def _increment(table, key, column, count, extra=None):
+    """
+    UPDATE ... SET column = column + count, inserting the row if missing.
+    Columns in extra only move forward (kept at their maximum), since
+    write-behind batches and replicas can commit out of order.
+    """
+    extra = extra or {}
+    latest = {
+        name: case((table.c[name].is_(None) | (table.c[name] < value), value), else_=table.c[name])
+        for name, value in extra.items()
+    }
+    increment = (
+        table.update()
+        .where(and_(*[table.c[name] == value for name, value in key.items()]))
+        .values({column: table.c[column] + count, **latest})
+    )
+    if db.session.execute(increment).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert().values({**key, column: count, **extra}))
+    except IntegrityError:
+        # another writer created the row first
+        db.session.execute(increment)
+
+
+class AggregateBuffer:
+    """
+    Collects BotStats/IntentRollup increments in the shared state instead
+    of updating the tables with every insert. Every `interval` seconds the
+    process that takes the flush lock folds everything collected by all
+    replicas into the tables in one transaction, so replicas no longer
+    queue on the same counter rows; dashboards lag by up to interval.
+    Increments taken for a flush that fails are put back.
+
+    Each bot's latest interaction time is collected as a set of
+    `<bot id>|<time>` fields and reduced to the maximum at flush time, so
+    the order in which replicas report does not matter.
+    """
+
+    COUNTS = 'aggregates:counts'
+    LATEST = 'aggregates:latest'
+    ROLLUPS = 'aggregates:rollups'
+    LOCK = 'aggregates:flush-lock'
+
+    def __init__(self, app, state, interval):
+        self.app = app
+        self.state = state
+        self.interval = interval
+        self.added = 0
+        self.flushes = 0
+        self.failed = 0
+        self.unavailable = 0
+        self._stopped = threading.Event()
+        self._thread = None
+        self.start()
+        atexit.register(self.close)
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='aggregate-flusher', daemon=True)
+        self._thread.start()
+
+    def after_fork(self):
+        self._thread = None
+        self.start()
+
+    def close(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush(force=True)
+
+    def add(self, records):
+        """
+        Count interactions about to be committed; one round trip per batch.
+        False when the shared state is unreachable, and nothing was counted
+        """
+        if not self.state.update_hashes(self._encode(*aggregate_deltas(records))):
+            self.unavailable += 1
+            return False
+        self.added += len(records)
+        return True
+
+    def discard(self, records):
+        """Take back an add() whose transaction did not commit"""
+        if self.state.update_hashes(self._encode(*aggregate_deltas(records), sign=-1)):
+            self.added -= len(records)
+
+    def flush(self, force=False):
+        """Apply the collected increments unless another process flushed this interval"""
+        if not force and not self.state.add(self.LOCK, str(os.getpid()), self.interval):
+            return 0
+        counts, latest, rollups = self.state.take_hashes(self.COUNTS, self.LATEST, self.ROLLUPS)
+        if not counts and not rollups:
+            return 0
+        latest_per_bot = {}
+        for field, seen in latest.items():
+            if int(seen) <= 0:
+                continue  # reported only by discarded batches
+            bot_id, at = field.split('|', 1)
+            at = datetime.fromisoformat(at)
+            if bot_id not in latest_per_bot or at > latest_per_bot[bot_id]:
+                latest_per_bot[bot_id] = at
+        per_bot = {
+            int(bot_id): (int(count), latest_per_bot.get(bot_id)) for bot_id, count in counts.items()
+        }
+        buckets = Counter()
+        for field, count in rollups.items():
+            bot_id, granularity, start, intent = field.split('|', 3)
+            buckets[(int(bot_id), granularity, datetime.fromisoformat(start), intent)] = int(count)
+        with self.app.app_context():
+            try:
+                apply_deltas(per_bot, buckets)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                self.failed += 1
+                if self.state.update_hashes(self._encode(per_bot, buckets)):
+                    print(f"Aggregate flush failed, {len(per_bot)} bots' increments kept for the next one: {e}")
+                else:
+                    print(f"Aggregate flush failed and the shared state is unreachable, "
+                          f"{len(per_bot)} bots' increments lost (rebuild-stats and backfill-rollups recover them): {e}")
+                return 0
+        self.flushes += 1
+        return sum(count for count, _ in per_bot.values())
+
+    def stats(self):
+        return {'interval': self.interval, 'added': self.added, 'flushes': self.flushes, 'failed': self.failed,
+                'unavailable': self.unavailable}
+
+    def _encode(self, per_bot, buckets, sign=1):
+        return {
+            self.COUNTS: {str(bot_id): sign * count for bot_id, (count, _) in per_bot.items()},
+            self.LATEST: {
+                f"{bot_id}|{latest.isoformat()}": sign for bot_id, (_, latest) in per_bot.items() if latest is not None
+            },
+            self.ROLLUPS: {
+                f"{bot_id}|{granularity}|{start.isoformat()}|{intent}": sign * count
+                for (bot_id, granularity, start, intent), count in buckets.items()
+            },
+        }
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Aggregate flush error: {e}")
+
+
+def rebuild_bot_stats():
+    """Recompute BotStats from InteractionLog with one grouped query, plus the archive indexes"""
+    rows = (
+        db.session.query(
+            InteractionLog.bot_id,
+            func.count(InteractionLog.id),
+            func.max(InteractionLog.timestamp),
+        )
+        .group_by(InteractionLog.bot_id)
+        .all()
+    )
+    totals = {bot_id: (count, latest) for bot_id, count, latest in rows}
+    for bot_id, (count, latest) in archive_counts().items():
+        hot_count, hot_latest = totals.get(bot_id, (0, None))
+        latest = max((t for t in (hot_latest, latest) if t is not None), default=None)
+        totals[bot_id] = (hot_count + count, latest)
+    db.session.query(BotStats).delete()
+    if totals:
+        db.session.execute(BotStats.__table__.insert(), [
+            {'bot_id': bot_id, 'interaction_count': count, 'last_interaction_at': latest}
+            for bot_id, (count, latest) in totals.items()
+        ])
+    db.session.commit()
+    return len(totals)
+
+
+def rebuild_rollups(bot_id=None, batch_size=10000):
+    """
+    Recompute IntentRollup rows by streaming InteractionLog and the
+    archived segments once. Only the bucket counters are held in memory,
+    not the log rows.
+    """
+    query = db.session.query(InteractionLog.bot_id, InteractionLog.intent, InteractionLog.timestamp)
+    rollups = IntentRollup.query
+    bots = Chatbot.query
+    if bot_id is not None:
+        query = query.filter(InteractionLog.bot_id == bot_id)
+        rollups = rollups.filter(IntentRollup.bot_id == bot_id)
+        bots = bots.filter(Chatbot.id == bot_id)
+
+    buckets = Counter()
+
+    def add(log_bot_id, intent, timestamp):
+        if timestamp is None:
+            return
+        for granularity in ROLLUP_GRANULARITIES:
+            buckets[(log_bot_id, granularity, bucket_start(timestamp, granularity), intent or 'unknown')] += 1
+
+    for log_bot_id, intent, timestamp in query.yield_per(batch_size):
+        add(log_bot_id, intent, timestamp)
+    for archived in ([bot_id] if bot_id is not None else archived_bot_ids()):
+        for row in iter_archived(archived, columns=('intent', 'timestamp')):
+            add(archived, row.intent, row.timestamp)
+
+    rollups.delete(synchronize_session=False)
+    rows = [
+        {'bot_id': b, 'granularity': g, 'bucket_start': start, 'intent': intent, 'count': count}
+        for (b, g, start, intent), count in buckets.items()
+    ]
+    for i in range(0, len(rows), batch_size):
+        db.session.execute(IntentRollup.__table__.insert(), rows[i:i + batch_size])
+    # bot_stats may not change, so this is what tells cached analytics pages apart
+    bots.update({Chatbot.rollups_rebuilt_at: datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return len(rows)
+
+
+def intent_totals(bot_id, start=None, end=None):
+    """{intent: count} for a bot, optionally limited to [start, end) days"""
+    query = db.session.query(IntentRollup.intent, func.sum(IntentRollup.count)).filter(
+        IntentRollup.bot_id == bot_id, IntentRollup.granularity == 'day'
+    )
+    if start is not None:
+        query = query.filter(IntentRollup.bucket_start >= start)
+    if end is not None:
+        query = query.filter(IntentRollup.bucket_start < end)
+    return {intent: int(count) for intent, count in query.group_by(IntentRollup.intent)}
+
+
+def intent_series(bot_id, granularity='day', start=None, end=None):
+    """
+    [(bucket_start, {intent: count}), ...] in time order, covering at most
+    SERIES_WINDOW[granularity] back from end (or from the bot's newest bucket)
+    """
+    in_bot = (IntentRollup.bot_id == bot_id, IntentRollup.granularity == granularity)
+    newest = db.session.query(func.max(IntentRollup.bucket_start)).filter(*in_bot).scalar()
+    if newest is None:
+        return []
+    upper = newest + timedelta(seconds=1)
+    if end is not None:
+        upper = min(upper, end)
+    floor = upper - SERIES_WINDOW[granularity]
+    start = floor if start is None else max(start, floor)
+
+    query = db.session.query(
+        IntentRollup.bucket_start, IntentRollup.intent, IntentRollup.count
+    ).filter(*in_bot, IntentRollup.bucket_start >= start)
+    if end is not None:
+        query = query.filter(IntentRollup.bucket_start < end)
+
+    series = []
+    for bucket, intent, count in query.order_by(IntentRollup.bucket_start):
+        if not series or series[-1][0] != bucket:
+            series.append((bucket, {}))
+        series[-1][1][intent] = count
+    return series
+
+
+def backfill_if_empty():
+    """Populate the aggregate tables the first time an existing database is opened"""
+    if db.session.query(InteractionLog.id).first() is None:
+        return
+    if db.session.query(BotStats.bot_id).first() is None:
+        rebuild_bot_stats()
+    if db.session.query(IntentRollup.id).first() is None:
+        rebuild_rollups()
+
+
+@click.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute per-bot interaction counters from InteractionLog."""
+    bots = rebuild_bot_stats()
+    click.echo(f"Rebuilt stats for {bots} bots.")
+
+
+@click.command('backfill-rollups')
+@click.option('--bot-id', type=int, default=None, help='Only rebuild this bot.')
+def backfill_rollups_command(bot_id):
+    """Rebuild hourly/daily intent rollups from InteractionLog."""
+    buckets = rebuild_rollups(bot_id)
+    click.echo(f"Wrote {buckets} rollup buckets.")
@@ -0,0 +1,480 @@
+"""
+Tiered retention for InteractionLog: rows older than a cut-off move out
+of the database into per-bot, per-month segment files under
+LOG_ARCHIVE_DIR, so the hot table only holds recent traffic.
+
+A segment stores its rows in blocks of BLOCK_ROWS. Inside a block each
+column (id, timestamp, intent, user_message, bot_response) is encoded
+separately and zlib-compressed. A JSON footer indexes the blocks with
+their id and time ranges. Readers mmap the file and decompress one
+block of only the columns they need at a time, so memory stays flat.
+Segments are immutable; bot-<id>/index.json lists them.
+"""
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import click
+
+from . import db
+from .models import InteractionLog
+
+MAGIC = b'CBLOGSG1'
+TRAILER = struct.Struct('<Q8s')  # footer length, magic
+FORMAT_VERSION = 1
+BLOCK_ROWS = 4096
+SEGMENT_ROWS = 200000  # a month with more rows is split into several parts
+COLUMNS = ('id', 'timestamp', 'intent', 'user_message', 'bot_response')
+EPOCH = datetime(1970, 1, 1)
+NULL_TS = -(2 ** 63)
+NULL_CODE = 0xFFFF
+
+ArchivedRow = namedtuple('ArchivedRow', ['id', 'user_message', 'bot_response', 'intent', 'timestamp'])
+
+
+def archive_root():
+    from flask import current_app
+    return current_app.config['LOG_ARCHIVE_DIR']
+
+
+def _micros(timestamp):
+    return NULL_TS if timestamp is None else (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def _encode_strings(values):
+    lengths = array('i')
+    parts = []
+    for value in values:
+        if value is None:
+            lengths.append(-1)
+        else:
+            data = value.encode('utf-8')
+            lengths.append(len(data))
+            parts.append(data)
+    return lengths.tobytes() + b''.join(parts)
+
+
+def _decode_strings(raw, n, swap):
+    lengths = array('i')
+    lengths.frombytes(raw[:4 * n])
+    if swap:
+        lengths.byteswap()
+    values = []
+    pos = 4 * n
+    for length in lengths:
+        if length < 0:
+            values.append(None)
+        else:
+            values.append(raw[pos:pos + length].decode('utf-8'))
+            pos += length
+    return values
+
+
+def write_segment(path, rows, block_rows=BLOCK_ROWS, level=6):
+    """
+    Write rows (ArchivedRow-like, sorted by id) to path atomically and
+    return its index entry
+    """
+    intents = sorted({row.intent for row in rows if row.intent is not None})
+    if len(intents) >= NULL_CODE:
+        raise ValueError(f"too many distinct intents for one segment ({len(intents)})")
+    codes = {intent: i for i, intent in enumerate(intents)}
+
+    blocks = []
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        for start in range(0, len(rows), block_rows):
+            chunk = rows[start:start + block_rows]
+            stamps = [_micros(row.timestamp) for row in chunk]
+            present = [s for s in stamps if s != NULL_TS]
+            payloads = {
+                'id': array('q', (row.id for row in chunk)).tobytes(),
+                'timestamp': array('q', stamps).tobytes(),
+                'intent': array('H', (codes.get(row.intent, NULL_CODE) for row in chunk)).tobytes(),
+                'user_message': _encode_strings(row.user_message for row in chunk),
+                'bot_response': _encode_strings(row.bot_response for row in chunk),
+            }
+            columns = {}
+            for name in COLUMNS:
+                data = zlib.compress(payloads[name], level)
+                columns[name] = [f.tell(), len(data)]
+                f.write(data)
+            blocks.append({
+                'rows': len(chunk),
+                'min_id': chunk[0].id,
+                'max_id': chunk[-1].id,
+                'min_ts': min(present) if present else None,
+                'max_ts': max(present) if present else None,
+                'columns': columns,
+            })
+        footer = json.dumps({
+            'version': FORMAT_VERSION,
+            'byteorder': sys.byteorder,
+            'rows': len(rows),
+            'intents': intents,
+            'blocks': blocks,
+        }).encode('utf-8')
+        f.write(footer)
+        f.write(TRAILER.pack(len(footer), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    stamps = [b[k] for b in blocks for k in ('min_ts', 'max_ts') if b[k] is not None]
+    return {
+        'file': os.path.basename(path),
+        'rows': len(rows),
+        'bytes': os.path.getsize(path),
+        'min_id': blocks[0]['min_id'] if blocks else None,
+        'max_id': max(b['max_id'] for b in blocks) if blocks else None,
+        'min_ts': min(stamps) if stamps else None,
+        'max_ts': max(stamps) if stamps else None,
+    }
+
+
+class SegmentReader:
+    """Memory-mapped, block-at-a-time reader for one segment file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise
+        self._view = memoryview(self._mm)
+        footer_length, magic = TRAILER.unpack(self._mm[-TRAILER.size:])
+        if magic != MAGIC or self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an interaction log segment")
+        end = len(self._mm) - TRAILER.size
+        self.footer = json.loads(bytes(self._view[end - footer_length:end]))
+        self.intents = self.footer['intents']
+        self._swap = self.footer['byteorder'] != sys.byteorder
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._mm is not None:
+            self._view.release()
+            self._mm.close()
+            self._file.close()
+            self._mm = None
+
+    @property
+    def rows(self):
+        return self.footer['rows']
+
+    def _column(self, block, name):
+        offset, length = block['columns'][name]
+        raw = zlib.decompress(self._view[offset:offset + length])
+        n = block['rows']
+        if name in ('user_message', 'bot_response'):
+            return _decode_strings(raw, n, self._swap)
+        values = array('H' if name == 'intent' else 'q')
+        values.frombytes(raw)
+        if self._swap:
+            values.byteswap()
+        if name == 'intent':
+            intents = self.intents
+            return [None if code == NULL_CODE else intents[code] for code in values]
+        if name == 'timestamp':
+            return [None if v == NULL_TS else EPOCH + timedelta(microseconds=v) for v in values]
+        return values
+
+    def iter_rows(self, after_id=0, columns=COLUMNS):
+        """ArchivedRow per row with id > after_id, in id order; unread columns are None"""
+        wanted = [name for name in COLUMNS if name in columns or name == 'id']
+        for block in self.footer['blocks']:
+            if block['max_id'] <= after_id:
+                continue
+            values = {name: self._column(block, name) for name in wanted}
+            empty = [None] * block['rows']
+            ids = values['id']
+            for i, row in enumerate(zip(
+                ids,
+                values.get('user_message', empty),
+                values.get('bot_response', empty),
+                values.get('intent', empty),
+                values.get('timestamp', empty),
+            )):
+                if ids[i] > after_id:
+                    yield ArchivedRow(*row)
+
+
+def _bot_dir(root, bot_id):
+    return os.path.join(root, f"bot-{bot_id}")
+
+
+def read_index(bot_id, root=None):
+    root = root or archive_root()
+    try:
+        with open(os.path.join(_bot_dir(root, bot_id), 'index.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'bot_id': bot_id, 'segments': [], 'pending': None, 'retired': []}
+
+
+def _write_index(bot_id, index, root):
+    path = os.path.join(_bot_dir(root, bot_id), 'index.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def archived_bot_ids(root=None):
+    root = root or archive_root()
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[4:]) for name in names if name.startswith('bot-') and name[4:].isdigit())
+
+
+def iter_archived(bot_id, after_id=0, columns=COLUMNS, root=None):
+    """A bot's archived rows with id > after_id, in id order across all its segments"""
+    root = root or archive_root()
+    segments = [s for s in read_index(bot_id, root)['segments'] if s['max_id'] > after_id]
+    if not segments:
+        return
+    paths = [os.path.join(_bot_dir(root, bot_id), s['file']) for s in sorted(segments, key=lambda s: s['min_id'])]
+
+    def stream(path):
+        with SegmentReader(path) as reader:
+            yield from reader.iter_rows(after_id, columns)
+
+    if len(paths) == 1:
+        yield from stream(paths[0])
+    else:
+        # month partitions are written in time order, so their id ranges can touch
+        yield from heapq.merge(*(stream(p) for p in paths), key=lambda row: row.id)
+
+
+def archive_counts(root=None):
+    """{bot_id: (rows, latest timestamp)} from the archive indexes, no segment reads"""
+    root = root or archive_root()
+    counts = {}
+    for bot_id in archived_bot_ids(root):
+        segments = read_index(bot_id, root)['segments']
+        if segments:
+            latest = max((s['max_ts'] for s in segments if s['max_ts'] is not None), default=None)
+            counts[bot_id] = (
+                sum(s['rows'] for s in segments),
+                None if latest is None else EPOCH + timedelta(microseconds=latest),
+            )
+    return counts
+
+
+class _PendingDeletes:
+    """
+    Deletes hot rows whose index journals them as archived. Deletes of
+    several bots share a transaction, committed every batch_size rows, and
+    a bot's journal entry is cleared only after its deletes committed.
+    """
+
+    def __init__(self, root, batch_size):
+        self.root = root
+        self.batch_size = batch_size
+        self.uncommitted = 0
+        self.waiting = []
+
+    def delete(self, bot_id, index):
+        pending = index.get('pending')
+        if not pending:
+            return
+        cutoff = datetime.fromisoformat(pending['cutoff'])
+        while True:
+            ids = [
+                row_id for (row_id,) in db.session.query(InteractionLog.id)
+                .filter(InteractionLog.bot_id == bot_id, InteractionLog.timestamp < cutoff,
+                        InteractionLog.id <= pending['max_id'])
+                .limit(self.batch_size)
+            ]
+            if ids:
+                db.session.query(InteractionLog).filter(InteractionLog.id.in_(ids)).delete(
+                    synchronize_session=False)
+                self.uncommitted += len(ids)
+            if self.uncommitted >= self.batch_size:
+                self.commit()
+            if len(ids) < self.batch_size:
+                break
+        self.waiting.append((bot_id, index))
+
+    def commit(self):
+        db.session.commit()
+        for bot_id, index in self.waiting:
+            index['pending'] = None
+            _write_index(bot_id, index, self.root)
+        self.waiting = []
+        self.uncommitted = 0
+
+
+def _remove_retired(bot_id, index, root):
+    """Delete parts an earlier run folded into a newer one"""
+    if not index.get('retired'):
+        return
+    for name in index['retired']:
+        try:
+            os.remove(os.path.join(_bot_dir(root, bot_id), name))
+        except FileNotFoundError:
+            pass
+    index['retired'] = []
+    _write_index(bot_id, index, root)
+
+
+def archive_bot(bot_id, cutoff, root, deletes, segment_rows=SEGMENT_ROWS, batch_size=10000):
+    """
+    Move one bot's rows older than cutoff into monthly segments; returns
+    (rows, segments, bytes). The hot rows are removed through deletes
+    (a _PendingDeletes), which the caller commits.
+    """
+    bot_dir = _bot_dir(root, bot_id)
+    os.makedirs(bot_dir, exist_ok=True)
+    index = read_index(bot_id, root)
+    if index.get('pending'):
+        deletes.delete(bot_id, index)
+        deletes.commit()
+    _remove_retired(bot_id, index, root)
+
+    query = (
+        db.session.query(
+            InteractionLog.id,
+            InteractionLog.user_message,
+            InteractionLog.bot_response,
+            InteractionLog.intent,
+            InteractionLog.timestamp,
+        )
+        .filter(InteractionLog.bot_id == bot_id, InteractionLog.timestamp < cutoff)
+        .order_by(InteractionLog.timestamp, InteractionLog.id)  # uses ix_interaction_log_bot_id_timestamp
+    )
+    taken = {s['file'] for s in index['segments']} | set(index.get('retired') or ())
+    written = []
+    replaced = []
+    buffer = []
+    month = month_key = None
+    moved = 0
+    max_id = 0
+
+    def flush():
+        if not buffer:
+            return
+        # fold into the month's last part from an earlier run while it has room,
+        # so a daily job does not leave thirty small parts per month
+        parts = [s for s in index['segments'] if s.get('month') == month and s['file'] not in replaced]
+        last = max(parts, key=lambda s: s['max_id'], default=None)
+        if last is not None and last['rows'] + len(buffer) <= segment_rows:
+            with SegmentReader(os.path.join(bot_dir, last['file'])) as reader:
+                buffer.extend(reader.iter_rows())
+            replaced.append(last['file'])
+        part = 0
+        while f"{month}.{part}.seg" in taken:
+            part += 1
+        name = f"{month}.{part}.seg"
+        taken.add(name)
+        buffer.sort(key=lambda row: row.id)
+        entry = write_segment(os.path.join(bot_dir, name), buffer)
+        entry['month'] = month
+        written.append(entry)
+        buffer.clear()
+
+    for row in query.yield_per(batch_size):
+        stamp = row.timestamp
+        if month is None or (stamp.year, stamp.month) != month_key or len(buffer) >= segment_rows:
+            flush()
+            month_key = (stamp.year, stamp.month)
+            month = f"{stamp.year:04d}-{stamp.month:02d}"
+        buffer.append(ArchivedRow(*row))
+        moved += 1
+        max_id = max(max_id, row.id)
+    flush()
+    if not written:
+        return 0, 0, 0
+
+    # journal first: a crash after this point is finished by the next run.
+    # Replaced parts stay on disk until then for readers that listed them.
+    index['segments'] = [s for s in index['segments'] if s['file'] not in replaced] + written
+    index['retired'] = replaced
+    index['pending'] = {'cutoff': cutoff.isoformat(), 'max_id': max_id}
+    _write_index(bot_id, index, root)
+    deletes.delete(bot_id, index)
+    return moved, len(written), sum(s['bytes'] for s in written)
+
+
+def archive_logs(older_than_days, bot_id=None, root=None, segment_rows=SEGMENT_ROWS,
+                 batch_size=10000, dry_run=False):
+    """Archive every bot's (or one bot's) logs older than older_than_days"""
+    root = root or archive_root()
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    query = db.session.query(InteractionLog.bot_id, db.func.count()).filter(InteractionLog.timestamp < cutoff)
+    if bot_id is not None:
+        query = query.filter(InteractionLog.bot_id == bot_id)
+    candidates = dict(query.group_by(InteractionLog.bot_id).all())
+    summary = {'cutoff': cutoff.isoformat(timespec='seconds'), 'bots': len(candidates),
+               'rows': sum(candidates.values()), 'segments': 0, 'bytes': 0}
+    if dry_run:
+        return summary
+
+    # interrupted runs of bots that have nothing new to archive
+    deletes = _PendingDeletes(root, batch_size)
+    for archived in archived_bot_ids(root):
+        if archived not in candidates and (bot_id is None or archived == bot_id):
+            index = read_index(archived, root)
+            deletes.delete(archived, index)
+            deletes.commit()
+            _remove_retired(archived, index, root)
+
+    summary['rows'] = 0
+    for candidate in sorted(candidates):
+        rows, segments, size = archive_bot(candidate, cutoff, root, deletes, segment_rows, batch_size)
+        summary['rows'] += rows
+        summary['segments'] += segments
+        summary['bytes'] += size
+    deletes.commit()
+    return summary
+
+
+def archive_stats(root=None):
+    root = root or archive_root()
+    bots = archived_bot_ids(root)
+    segments = [s for b in bots for s in read_index(b, root)['segments']]
+    return {
+        'root': root,
+        'bots': len(bots),
+        'segments': len(segments),
+        'rows': sum(s['rows'] for s in segments),
+        'bytes': sum(s['bytes'] for s in segments),
+    }
+
+
+@click.command('archive-logs')
+@click.option('--older-than-days', type=int, default=None,
+              help='Archive logs older than this (default LOG_RETENTION_DAYS).')
+@click.option('--bot-id', type=int, default=None, help='Only archive this bot.')
+@click.option('--dry-run', is_flag=True, help='Only count what would be archived.')
+@click.option('--vacuum', is_flag=True, help='Compact the SQLite file afterwards (locks the database).')
+def archive_logs_command(older_than_days, bot_id, dry_run, vacuum):
+    """Move old InteractionLog rows into compressed per-bot monthly segments."""
+    from flask import current_app
+    days = older_than_days if older_than_days is not None else current_app.config['LOG_RETENTION_DAYS']
+    summary = archive_logs(days, bot_id, dry_run=dry_run)
+    verb = 'Would archive' if dry_run else 'Archived'
+    click.echo(f"{verb} {summary['rows']} logs of {summary['bots']} bots older than {summary['cutoff']}"
+               + ('' if dry_run else f" into {summary['segments']} segments ({summary['bytes'] / 1e6:.1f} MB)"))
+    if vacuum and not dry_run and db.engine.dialect.name == 'sqlite':
+        db.session.execute(db.text('VACUUM'))
+        click.echo("Vacuumed the database.")
@@ -1,23 +1,92 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, g, jsonify, current_app
 from functools import wraps
+from collections import namedtuple
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 from .models import User
+from .metrics import stage
 from . import db
 
 auth_bp = Blueprint('auth', __name__)
 
+# what views and templates need about the logged-in user, kept in the session
+SessionUser = namedtuple('SessionUser', ['id', 'username', 'role'])
+
 def current_user():
-    if 'user_id' in session:
-        return User.query.get(session['user_id'])
+    """The logged-in User row, loaded at most once per request"""
+    if 'user_id' not in session:
+        return None
+    if 'current_user' not in g:
+        with stage('auth'):
+            g.current_user = User.query.get(session['user_id'])
+    return g.current_user
+
+def current_identity():
+    """
+    Identity snapshot stored in the session at login, so views that only
+    need id/username/role skip the database. Sessions created before the
+    snapshot existed fall back to current_user().
+    """
+    if 'user_id' not in session:
+        return None
+    if 'username' in session:
+        return SessionUser(session['user_id'], session['username'], session.get('role', 'user'))
+    return current_user()
+
+def _chat_token_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='chat-api')
+
+def issue_chat_token(bot):
+    """Signed, stateless token that lets an embed widget talk to one bot"""
+    return _chat_token_serializer().dumps(
+        {'bot_id': bot.id, 'personality': bot.personality, 'template': bot.template}
+    )
+
+def verify_chat_token(token):
+    try:
+        return _chat_token_serializer().loads(token, max_age=current_app.config['CHAT_TOKEN_MAX_AGE'])
+    except BadSignature:
+        return None
+
+def request_chat_token():
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return header[len('Bearer '):].strip()
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        return data.get('token')
     return None
 
 def login_required(view_func):
     @wraps(view_func)
     def wrapped(*args, **kwargs):
-        if 'user_id' not in session:
+        with stage('auth'):
+            logged_in = 'user_id' in session
+        if not logged_in:
             return redirect(url_for('auth.login'))
         return view_func(*args, **kwargs)
     return wrapped
 
+def chat_auth_required(view_func):
+    """
+    Accept either a logged-in session or a signed chat token. A valid
+    token's payload is left on g.chat_token; no database read is made.
+    """
+    @wraps(view_func)
+    def wrapped(*args, **kwargs):
+        with stage('auth'):
+            logged_in = 'user_id' in session
+            payload = None
+            if not logged_in:
+                token = request_chat_token()
+                payload = verify_chat_token(token) if token else None
+        if logged_in:
+            return view_func(*args, **kwargs)
+        if payload is None:
+            return jsonify({'error': 'login or a valid chat token is required'}), 401
+        g.chat_token = payload
+        return view_func(*args, **kwargs)
+    return wrapped
+
 @auth_bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -51,6 +120,7 @@ def login():
 
         if user and user.check_password(password):
             session['user_id'] = user.id
+            session['username'] = user.username
             session['role'] = user.role
             flash(f'Welcome back, {user.username}!')
             return redirect(url_for('bot.dashboard'))
@@ -0,0 +1,78 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Groups predict_intent calls that arrive within max_wait_ms of each other
+    into a single engine.predict_intents call per (personality, model).
+    """
+
+    def __init__(self, engine, max_batch=32, max_wait_ms=5):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.items = 0
+        self._start()
+
+    def _start(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='nlp-micro-batcher', daemon=True)
+        self._thread.start()
+
+    def after_fork(self):
+        """Threads do not survive fork(); give a new worker its own"""
+        self._start()
+
+    def submit(self, message, personality='friendly', model_key=None):
+        future = Future()
+        self._queue.put((message, personality, model_key, future))
+        return future
+
+    def predict_intent(self, message, personality='friendly', model_key=None, timeout=10):
+        return self.submit(message, personality, model_key).result(timeout)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'avg_batch_size': round(self.items / self.batches, 2) if self.batches else 0,
+            'pending': self._queue.qsize(),
+        }
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self.batches += 1
+            self.items += len(batch)
+
+            groups = defaultdict(list)
+            for message, personality, model_key, future in batch:
+                groups[personality, model_key].append((message, future))
+
+            for (personality, model_key), entries in groups.items():
+                try:
+                    results = self.engine.predict_intents([m for m, _ in entries], personality, model_key)
+                except Exception as e:
+                    for _, future in entries:
+                        future.set_exception(e)
+                    continue
+                for (_, future), result in zip(entries, results):
+                    future.set_result(result)
@@ -6,38 +6,84 @@ from flask import (
     url_for,
     flash,
     jsonify,
+    current_app,
+    Response,
+    stream_with_context,
+    g,
+    session,
+    abort,
 )
 from collections import Counter
+from datetime import datetime, timedelta
 import json
 import os
 import uuid
+from markupsafe import escape
+from sqlalchemy import func
 from werkzeug.utils import secure_filename
 
-from .models import Chatbot, InteractionLog
+from .models import Chatbot, BotStats, InteractionLog, TrainingJob
 from .rasa_integration import RasaNLPEngine
+from .aggregates import ROLLUP_GRANULARITIES, intent_totals, intent_series
+from .dataset import EXPORT_FORMATS, export_chunks, interaction_page
+from .training_jobs import TRAINING_DATA_DIR, TrainingQueueFull
+from .metrics import stage
+from .http_cache import IMMUTABLE_MAX_AGE, not_modified, static_version
 from . import db
-from .auth_routes import login_required, current_user
+from .auth_routes import login_required, chat_auth_required, current_identity, issue_chat_token, request_chat_token
 
 bot_bp = Blueprint('bot', __name__)
 
-UPLOAD_FOLDER = 'instance/training_data'
+UPLOAD_FOLDER = TRAINING_DATA_DIR
+TRAIN_PREVIEW_PAGE = 50
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+def predict(message, personality, model_key=None):
+    """Run the NLP engine, through the micro-batcher when it is enabled"""
+    batcher = current_app.extensions.get('nlp_batcher')
+    with stage('nlp'):
+        if batcher is not None:
+            return batcher.predict_intent(message, personality, model_key)
+        return RasaNLPEngine.predict_intent(message, personality, model_key)
+
+def within_rate_limit(counts):
+    """Count {bot_id: messages} against the shared chat limits"""
+    limiter = current_app.extensions['chat_rate_limiter']
+    if not limiter.enabled:
+        return True
+    client = limiter.client_key(session.get('user_id'), request_chat_token(), request.remote_addr)
+    return limiter.hit_many(counts, client)
+
 @bot_bp.route('/')
 @login_required
 def dashboard():
-    user = current_user()
-    chatbots = Chatbot.query.all()
-    stats = {
-        cb.id: InteractionLog.query.filter_by(bot_id=cb.id).count()
-        for cb in chatbots
-    }
+    # one aggregate row changes whenever a card would: a new bot or a new interaction
+    bot_count, newest_bot, interactions, last_at, last_created = db.session.query(
+        func.count(Chatbot.id),
+        func.max(Chatbot.id),
+        func.sum(BotStats.interaction_count),
+        func.max(BotStats.last_interaction_at),
+        func.max(Chatbot.created_at),
+    ).outerjoin(BotStats, BotStats.bot_id == Chatbot.id).one()
+    cached = not_modified(bot_count, newest_bot, interactions, last_at,
+                          last_modified=max(filter(None, (last_at, last_created)), default=None))
+    if cached is not None:
+        return cached
+
+    user = current_identity()
+    rows = (
+        db.session.query(Chatbot, BotStats.interaction_count)
+        .outerjoin(BotStats, BotStats.bot_id == Chatbot.id)
+        .all()
+    )
+    chatbots = [cb for cb, _ in rows]
+    stats = {cb.id: count or 0 for cb, count in rows}
     return render_template('dashboard.html', chatbots=chatbots, stats=stats, user=user)
 
 @bot_bp.route('/create', methods=['GET', 'POST'])
 @login_required
 def create_bot():
-    user = current_user()
+    user = current_identity()
     if request.method == 'POST':
         name = request.form['name']
         template = request.form['template']
@@ -59,55 +105,203 @@ def create_bot():
 @bot_bp.route('/chat/<int:bot_id>')
 @login_required
 def chat(bot_id):
-    user = current_user()
+    user = current_identity()
     bot = Chatbot.query.get_or_404(bot_id)
-    return render_template('chat.html', bot=bot, user=user)
+    gateway_url = current_app.config['CHAT_GATEWAY_URL']
+    return render_template(
+        'chat.html',
+        bot=bot,
+        gateway_url=gateway_url,
+        chat_token=issue_chat_token(bot) if gateway_url else '',
+        user=user,
+    )
+
+def is_chat_item(item):
+    """A {bot_id: int, message: str} chat request body or batch item"""
+    return (
+        isinstance(item, dict)
+        and isinstance(item.get('bot_id'), int) and not isinstance(item['bot_id'], bool)
+        and isinstance(item.get('message'), str)
+    )
 
 @bot_bp.route('/chat_response', methods=['POST'])
-@login_required
+@chat_auth_required
 def chat_response():
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not is_chat_item(data):
+        return jsonify({'error': 'expected {"bot_id": <int>, "message": <string>}'}), 400
     bot_id = data['bot_id']
     message = data['message']
+    if not within_rate_limit({bot_id: 1}):
+        return jsonify({'error': 'rate limit exceeded'}), 429
 
-    bot = Chatbot.query.get(bot_id)
-    personality = bot.personality if bot else 'friendly'
+    token = g.get('chat_token')
+    if token is not None:
+        # embed traffic: the signed token already carries the bot's personality
+        if token['bot_id'] != bot_id:
+            return jsonify({'error': 'token is not valid for this bot'}), 403
+        personality = token['personality'] or 'friendly'
+        template = token.get('template')
+    else:
+        bot = Chatbot.query.get(bot_id)
+        personality = bot.personality if bot else 'friendly'
+        template = bot.template if bot else None
 
-    intent, response = RasaNLPEngine.predict_intent(message, personality)
+    model_key = RasaNLPEngine.model_for(bot_id, template)
+    intent, response = predict(message, personality, model_key)
 
-    log = InteractionLog(
-        bot_id=bot_id,
-        user_message=message,
-        bot_response=response,
-        intent=intent,
-    )
-    db.session.add(log)
-    db.session.commit()
+    current_app.extensions['log_writer'].log(bot_id, message, response, intent)
 
     return jsonify({'response': response})
 
+@bot_bp.after_request
+def allow_token_chat_from_other_origins(response):
+    # embed widgets call /chat_response cross-origin with a bearer token;
+    # cookies are never sent cross-origin, so sessions stay same-site
+    if request.endpoint == 'bot.chat_response':
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+        response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
+    return response
+
+@bot_bp.route('/chat_response/batch', methods=['POST'])
+@login_required
+def chat_response_batch():
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'expected a non-empty list of {bot_id, message} items'}), 400
+    if len(items) > current_app.config['CHAT_BATCH_LIMIT']:
+        return jsonify({'error': f"at most {current_app.config['CHAT_BATCH_LIMIT']} items per batch"}), 400
+    for item in items:
+        if not is_chat_item(item):
+            return jsonify({'error': 'every item needs an integer bot_id and a string message'}), 400
+
+    if not within_rate_limit(Counter(item['bot_id'] for item in items)):
+        return jsonify({'error': 'rate limit exceeded'}), 429
+
+    bot_ids = {item['bot_id'] for item in items}
+    bots = {
+        bot.id: (bot.personality, bot.template)
+        for bot in Chatbot.query.filter(Chatbot.id.in_(bot_ids)).all()
+    }
+
+    # one engine call per (personality, model), results put back in request order
+    groups = {}
+    for index, item in enumerate(items):
+        personality, template = bots.get(item['bot_id'], (None, None))
+        model_key = RasaNLPEngine.model_for(item['bot_id'], template)
+        groups.setdefault((personality or 'friendly', model_key), []).append(index)
+
+    results = [None] * len(items)
+    for (personality, model_key), indexes in groups.items():
+        with stage('nlp'):
+            predictions = RasaNLPEngine.predict_intents(
+                [items[i]['message'] for i in indexes], personality, model_key
+            )
+        for i, prediction in zip(indexes, predictions):
+            results[i] = prediction
+
+    current_app.extensions['log_writer'].log_many([
+        {
+            'bot_id': item['bot_id'],
+            'user_message': item['message'],
+            'bot_response': response,
+            'intent': intent,
+        }
+        for item, (intent, response) in zip(items, results)
+    ])
+
+    return jsonify({'responses': [
+        {'bot_id': item['bot_id'], 'intent': intent, 'response': response}
+        for item, (intent, response) in zip(items, results)
+    ]})
+
+@bot_bp.route('/nlp/status')
+@login_required
+def nlp_status():
+    stats = RasaNLPEngine.stats()
+    batcher = current_app.extensions.get('nlp_batcher')
+    if batcher is not None:
+        stats['micro_batch'] = batcher.stats()
+    stats['log_writer'] = current_app.extensions['log_writer'].stats()
+    stats['training'] = current_app.extensions['training_jobs'].stats()
+    stats['rate_limit'] = current_app.extensions['chat_rate_limiter'].stats()
+    aggregate_buffer = current_app.extensions.get('aggregate_buffer')
+    if aggregate_buffer is not None:
+        stats['aggregate_buffer'] = aggregate_buffer.stats()
+    return jsonify(stats)
+
+def _parse_day(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
 @bot_bp.route('/analytics/<int:bot_id>')
 @login_required
 def analytics(bot_id):
-    user = current_user()
+    # rollups move in step with bot_stats (same transaction, or the same aggregate
+    # flush), except when backfill-rollups rebuilds them
+    validators = (
+        db.session.query(Chatbot.rollups_rebuilt_at, BotStats.interaction_count, BotStats.last_interaction_at)
+        .outerjoin(BotStats, BotStats.bot_id == Chatbot.id)
+        .filter(Chatbot.id == bot_id)
+        .first()
+    )
+    if validators is None:
+        abort(404)
+    rebuilt_at, interactions, last_at = validators
+    cached = not_modified(bot_id, interactions, last_at, rebuilt_at,
+                          last_modified=max(filter(None, (last_at, rebuilt_at)), default=None))
+    if cached is not None:
+        return cached
+
+    user = current_identity()
     bot = Chatbot.query.get_or_404(bot_id)
-    logs = InteractionLog.query.filter_by(bot_id=bot_id).all()
-    total = len(logs)
-    intent_counts = Counter(log.intent for log in logs)
+
+    start = _parse_day(request.args.get('start'))
+    end = _parse_day(request.args.get('end'))
+    end_exclusive = end + timedelta(days=1) if end else None
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ROLLUP_GRANULARITIES:
+        granularity = 'day'
+
+    intent_counts = Counter(intent_totals(bot_id, start, end_exclusive))
+    total = sum(intent_counts.values())
     top_intent = intent_counts.most_common(1)[0][0] if intent_counts else 'None'
+    series = intent_series(bot_id, granularity, start, end_exclusive)
+
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'bot_id': bot.id,
+            'total_interactions': total,
+            'top_intent': top_intent,
+            'intent_counts': dict(intent_counts.most_common()),
+            'granularity': granularity,
+            'series': [
+                {'bucket': bucket.isoformat(), 'total': sum(counts.values()), 'intents': counts}
+                for bucket, counts in series
+            ],
+        })
+
     return render_template(
         'analytics.html',
         bot=bot,
         total_interactions=total,
         top_intent=top_intent,
-        intent_counts=dict(intent_counts),
+        intent_counts=dict(intent_counts.most_common()),
+        series=series,
+        granularity=granularity,
+        start=start.strftime('%Y-%m-%d') if start else '',
+        end=end.strftime('%Y-%m-%d') if end else '',
         user=user,
     )
 
 @bot_bp.route('/train/<int:bot_id>', methods=['GET', 'POST'])
 @login_required
 def train_bot(bot_id):
-    user = current_user()
+    user = current_identity()
     bot = Chatbot.query.get_or_404(bot_id)
 
     if request.method == 'POST':
@@ -117,82 +311,141 @@ def train_bot(bot_id):
             f = request.files['dataset']
             if f and f.filename:
                 filename = secure_filename(f.filename)
-                path = os.path.join(UPLOAD_FOLDER, f"{bot_id}_{filename}")
+                path = os.path.join(UPLOAD_FOLDER, f"{bot_id}_{uuid.uuid4().hex}_{filename}")
                 f.save(path)
-                flash(f'Dataset "{filename}" imported for {bot.name}.')
+                # parsed and deduplicated on a training worker, see ingestion.py
+                try:
+                    job = current_app.extensions['training_jobs'].submit(bot_id, 'import', path)
+                    flash(f'Dataset "{filename}" uploaded; import job #{job.id} is {job.status}.')
+                except TrainingQueueFull:
+                    os.remove(path)
+                    flash('Too many training jobs are waiting. Please try again later.')
                 return redirect(url_for('bot.train_bot', bot_id=bot_id))
 
-        recent_logs = (
-            InteractionLog.query.filter_by(bot_id=bot_id)
-            .order_by(InteractionLog.timestamp.desc())
-            .limit(50)
-            .all()
-        )
-        flash(f'Trained {bot.name} with {len(recent_logs)} recent interactions!')
-        return redirect(url_for('bot.dashboard'))
+        # training runs on a background worker; the page polls its status
+        try:
+            job = current_app.extensions['training_jobs'].submit(bot_id)
+            flash(f'Training job #{job.id} for {bot.name} is {job.status}.')
+        except TrainingQueueFull:
+            flash('Too many training jobs are waiting. Please try again later.')
+        return redirect(url_for('bot.train_bot', bot_id=bot_id))
 
-    logs = InteractionLog.query.filter_by(bot_id=bot_id).all()
-    dataset = [
-        {"message": l.user_message, "response": l.bot_response, "intent": l.intent}
-        for l in logs
-    ]
-    dataset_json = json.dumps(dataset, indent=2, ensure_ascii=False)
+    items, next_after = interaction_page(bot_id, limit=TRAIN_PREVIEW_PAGE)
+    dataset_json = json.dumps(items, indent=2, ensure_ascii=False)
 
     return render_template(
         'train.html',
         bot=bot,
         dataset_json=dataset_json,
+        next_after=next_after,
+        page_size=TRAIN_PREVIEW_PAGE,
+        jobs=_recent_jobs(bot_id),
         user=user,
     )
 
+def _recent_jobs(bot_id, limit=5):
+    return [
+        job.to_dict()
+        for job in TrainingJob.query.filter_by(bot_id=bot_id).order_by(TrainingJob.id.desc()).limit(limit)
+    ]
+
+@bot_bp.route('/train/<int:bot_id>/jobs')
+@login_required
+def training_jobs(bot_id):
+    return jsonify({'jobs': _recent_jobs(bot_id)})
+
+@bot_bp.route('/train/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_training_job(job_id):
+    job = TrainingJob.query.get_or_404(job_id)
+    current_app.extensions['training_jobs'].cancel(job)
+    return jsonify(job.to_dict())
+
+@bot_bp.route('/train/<int:bot_id>/logs')
+@login_required
+def train_logs(bot_id):
+    Chatbot.query.get_or_404(bot_id)
+    after = request.args.get('after', 0, type=int)
+    limit = min(request.args.get('limit', TRAIN_PREVIEW_PAGE, type=int), 500)
+    items, next_after = interaction_page(bot_id, after, max(limit, 1))
+    return jsonify({'items': items, 'next_after': next_after})
+
 @bot_bp.route('/train/export/<int:bot_id>')
 @login_required
 def export_dataset(bot_id):
-    bot = Chatbot.query.get_or_404(bot_id)
-    logs = InteractionLog.query.filter_by(bot_id=bot_id).all()
-    dataset = [
-        {"message": l.user_message, "response": l.bot_response, "intent": l.intent}
-        for l in logs
-    ]
-    return jsonify(dataset)
+    fmt = request.args.get('format', 'json')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    gzip = request.args.get('gzip') == '1'
+
+    # logs are append-only: the newest hot row dates new logs at once, and bot_stats
+    # (which counts archived rows too) still changes after the hot rows are archived
+    newest_hot = (
+        db.session.query(func.max(InteractionLog.id))
+        .filter(InteractionLog.bot_id == bot_id)
+        .scalar_subquery()
+    )
+    validators = (
+        db.session.query(newest_hot, BotStats.interaction_count, BotStats.last_interaction_at)
+        .select_from(Chatbot)
+        .outerjoin(BotStats, BotStats.bot_id == Chatbot.id)
+        .filter(Chatbot.id == bot_id)
+        .first()
+    )
+    if validators is None:
+        abort(404)
+    latest_id, interactions, latest_at = validators
+    cached = not_modified(bot_id, latest_id, interactions, latest_at, last_modified=latest_at)
+    if cached is not None:
+        return cached
+
+    filename = f"bot_{bot_id}_dataset.{fmt}" + ('.gz' if gzip else '')
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    return Response(
+        stream_with_context(export_chunks(bot_id, fmt, gzip)),
+        mimetype='application/gzip' if gzip else EXPORT_FORMATS[fmt],
+        headers=headers,
+    )
 
 @bot_bp.route('/deploy/<int:bot_id>')
 @login_required
 def deploy_bot(bot_id):
-    user = current_user()
+    user = current_identity()
     if not user or user.role != 'admin':
         flash('Only admins are allowed to deploy chatbots.')
         return redirect(url_for('bot.dashboard'))
 
     bot = Chatbot.query.get_or_404(bot_id)
+    chat_token = issue_chat_token(bot)
+    gateway_url = current_app.config['CHAT_GATEWAY_URL'] if request.args.get('transport') != 'http' else ''
+
+    attributes = {
+        'src': url_for('bot.embed_script', version=static_version('embed.js'), _external=True),
+        'data-bot-id': bot.id,
+        'data-bot-name': bot.name,
+        'data-token': chat_token,
+        'data-chat-url': url_for('bot.chat_response', _external=True),
+        'data-gateway-url': gateway_url,
+    }
+    script_attributes = ' '.join(f'{name}="{escape(value)}"' for name, value in attributes.items() if value)
+    embed_code = f"""<!-- {escape(bot.name)} Chatbot Embed -->
+<div id="chatbot-{bot.id}" style="cursor:pointer;padding:20px;border:2px dashed #007bff;border-radius:12px;text-align:center;font-size:16px;">
+    Click to chat with {escape(bot.name)}
+</div>
+<script {script_attributes} async></script>"""
+
+    return render_template('deploy.html', bot=bot, embed_code=embed_code, chat_token=chat_token, user=user)
 
-    embed_code = f"""<!-- {bot.name} Chatbot Embed -->
-<script>
-async function initChatbot(botId) {{
-    const container = document.getElementById('chatbot-{bot_id}');
-    container.innerHTML = '<div style="padding:15px;border:1px solid #ddd;border-radius:8px;background:#f8f9fa;">🤖 <strong>{bot.name}</strong> is ready!</div>';
-    
-    container.addEventListener('click', async () => {{
-        const message = prompt('Talk to {bot.name}:');
-        if (message) {{
-            try {{
-                const response = await fetch("/chat_response", {{
-                    method: "POST",
-                    headers: {{"Content-Type": "application/json"}},
-                    body: JSON.stringify({{bot_id: botId, message: message}})
-                }});
-                const data = await response.json();
-                alert("{bot.name}: " + data.response);
-            }} catch (e) {{
-                alert("Chatbot temporarily unavailable");
-            }}
-        }}
-    }});
-}}
-initChatbot({bot_id});
-</script>
-<div id="chatbot-{bot_id}" style="cursor:pointer;padding:20px;border:2px dashed #007bff;border-radius:12px;text-align:center;font-size:16px;">
-    Click to chat with {bot.name}
-</div>"""
-
-    return render_template('deploy.html', bot=bot, embed_code=embed_code, user=user)
+@bot_bp.route('/embed/<version>/embed.js')
+def embed_script(version):
+    """
+    The embed widget, shared by every bot. Snippets link the current
+    content hash, so that URL can be cached for a year; snippets pasted
+    before an update still load the current file, revalidated hourly.
+    """
+    current = version == static_version('embed.js')
+    max_age = IMMUTABLE_MAX_AGE if current else 3600
+    response = current_app.send_static_file('embed.js')
+    response.headers['Cache-Control'] = f"public, max-age={max_age}" + (', immutable' if current else '')
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
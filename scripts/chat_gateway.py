@@ -0,0 +1,328 @@
+"""
+Asyncio chat gateway: long-lived WebSocket conversations served from one
+event loop, with non-blocking calls to Rasa. Bot lookups and log writes
+reuse the Flask app's models on a small thread pool.
+
+Run with ``python gateway.py`` next to the Flask app.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp import web
+
+from .auth_routes import verify_chat_token
+from .metrics import RASA_REQUESTS, REGISTRY, REQUEST_STAGE, nlp_served, start_metrics_server
+from .models import Chatbot
+from .model_registry import DEFAULT_MODEL_KEY
+from .rasa_integration import (
+    RASA_SERVER_URL,
+    CircuitBreaker,
+    LeastOutstandingBalancer,
+    RasaNLPEngine,
+    RasaUnavailable,
+    model_registry,
+    prediction_cache,
+    rasa_client,
+    rasa_server_urls,
+)
+
+
+class AsyncRasaClient:
+    """aiohttp counterpart of RasaClient, with its own per-worker breakers"""
+
+    def __init__(self, base_urls, limit=100, connect_timeout=0.5, read_timeout=5):
+        if isinstance(base_urls, str):
+            base_urls = rasa_server_urls(base_urls)
+        self.limit = limit
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.balancer = LeastOutstandingBalancer(base_urls)
+        self.session = None
+        self.rejected = 0
+        self._probe_tasks = set()
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=30)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    def _maybe_probe(self):
+        for backend in self.balancer.backends:
+            if backend.breaker.state == CircuitBreaker.OPEN and backend.breaker.probe_due():
+                task = asyncio.create_task(self._probe(backend))
+                self._probe_tasks.add(task)
+                task.add_done_callback(self._probe_tasks.discard)
+
+    async def parse(self, text):
+        self._maybe_probe()
+        backend = self.balancer.acquire()
+        if backend is None:
+            self.rejected += 1
+            raise RasaUnavailable(f"no Rasa worker available among {len(self.balancer.backends)}")
+        try:
+            return await self._parse_on(backend, text)
+        except aiohttp.ClientConnectionError:
+            retry = self.balancer.acquire(exclude=backend)
+            if retry is None:
+                raise
+            return await self._parse_on(retry, text)
+
+    async def _parse_on(self, backend, text):
+        started = time.perf_counter()
+        try:
+            async with self.session.post(f"{backend.url}/model/parse", json={"text": text}) as response:
+                if response.status != 200:
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status,
+                        message="Rasa API error",
+                    )
+                data = await response.json()
+        except Exception:
+            backend.failures += 1
+            backend.breaker.record_failure()
+            RASA_REQUESTS.inc(outcome='error')
+            raise
+        finally:
+            self.balancer.release(backend)
+            REQUEST_STAGE.observe(time.perf_counter() - started, stage='rasa_http')
+        backend.breaker.record_success()
+        RASA_REQUESTS.inc(outcome='ok')
+        return data
+
+    async def _probe(self, backend):
+        try:
+            async with self.session.get(f"{backend.url}/status") as response:
+                healthy = response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            healthy = False
+        if healthy:
+            backend.breaker.record_success()
+        else:
+            backend.breaker.record_failure()
+
+    def stats(self):
+        backends = [b.stats() for b in self.balancer.backends]
+        return {
+            'urls': [b['url'] for b in backends],
+            'available': sum(b['breaker']['state'] == CircuitBreaker.CLOSED for b in backends),
+            'requests_sent': sum(b['requests_sent'] for b in backends),
+            'failures': sum(b['failures'] for b in backends),
+            'rejected': self.rejected,
+            'backends': backends,
+        }
+
+
+class ChatGateway:
+    def __init__(self, flask_app, rasa_url=RASA_SERVER_URL, db_workers=4, max_bots=10000):
+        self.flask_app = flask_app
+        self.rasa = AsyncRasaClient(rasa_url)
+        self.connections = 0
+        self.messages = 0
+        self._executor = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix='gateway-db')
+        # bots are never edited after creation, so (personality, template) can be kept;
+        # bot_id comes from the client, so it is an LRU of existing bots only
+        self._bots = OrderedDict()
+        self.max_bots = max_bots
+        self._inflight = {}  # cache key -> parse task shared by concurrent misses
+
+    async def predict(self, message, personality, model_key=None):
+        started = time.perf_counter()
+        if model_key is not None and model_key != DEFAULT_MODEL_KEY:
+            # fast once resident, but the first call lists the registry and loads the model from disk
+            prediction = (await self._in_executor(
+                RasaNLPEngine._bot_model_predictions, [message], personality, model_key))[0]
+            if prediction is not None:
+                nlp_served('bot_model', started)
+                return prediction
+
+        cache_key = RasaNLPEngine.cache_key(message)
+        if cache_key is not None:
+            intent = prediction_cache.local.get(cache_key)
+            if intent is None and prediction_cache.state is not None:
+                # the shared tier is a blocking round trip, keep it off the event loop
+                intent = (await self._in_executor(prediction_cache.get_shared, [cache_key]))[0]
+            if intent is not None:
+                nlp_served('cache', started)
+                return intent, RasaNLPEngine._get_response(intent, personality)
+        try:
+            data = await self._parse(message, cache_key)
+        except RasaUnavailable:
+            # the local classifier may have to be loaded first; keep it off the event loop
+            return await self._in_executor(RasaNLPEngine._fallback, message, personality, None, started)
+        except Exception as e:
+            print(f"Rasa error: {e}, falling back to local NLU")
+            return await self._in_executor(RasaNLPEngine._fallback, message, personality, None, started)
+
+        intent = data.get('intent', {}).get('name', 'unknown')
+        result = intent, RasaNLPEngine._get_response(intent, personality)
+        nlp_served('rasa', started)
+        return result
+
+    async def _parse(self, message, cache_key):
+        """Rasa parse; concurrent misses for one cache key await the same request"""
+        if cache_key is None:
+            return await self.rasa.parse(message)
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = asyncio.ensure_future(self._parse_and_cache(message, cache_key))
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        return await asyncio.shield(task)
+
+    async def _parse_and_cache(self, message, cache_key):
+        data = await self.rasa.parse(message)
+        intent = data.get('intent', {}).get('name', 'unknown')
+        prediction_cache.local.set(cache_key, intent)
+        if prediction_cache.state is not None:
+            self._executor.submit(prediction_cache.set, cache_key, intent)
+        return data
+
+    async def _in_executor(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def bot_profile(self, bot_id):
+        """(personality, template) for a bot, read once while it stays in the LRU"""
+        profile = self._bots.get(bot_id)
+        if profile is not None:
+            self._bots.move_to_end(bot_id)
+            return profile
+        profile = await self._in_executor(self._load_bot_profile, bot_id)
+        if profile is None:
+            return 'friendly', None  # not cached: the id may belong to a bot created later
+        self._bots[bot_id] = profile
+        if len(self._bots) > self.max_bots:
+            self._bots.popitem(last=False)
+        return profile
+
+    def _load_bot_profile(self, bot_id):
+        with self.flask_app.app_context():
+            bot = Chatbot.query.get(bot_id)
+            if bot is None:
+                return None
+            return bot.personality or 'friendly', bot.template
+
+    def _write_log(self, bot_id, message, response, intent):
+        self.flask_app.extensions['log_writer'].log(bot_id, message, response, intent)
+
+    def _verify_token(self, token):
+        with self.flask_app.app_context():
+            return verify_chat_token(token)
+
+    def _session_user_id(self, request):
+        """user_id from the Flask session cookie, for same-host pages only"""
+        origin = request.headers.get('Origin')
+        if origin and urlsplit(origin).hostname != request.url.host:
+            return None
+        cookie = request.cookies.get(self.flask_app.config['SESSION_COOKIE_NAME'])
+        if not cookie:
+            return None
+        serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+        try:
+            data = serializer.loads(
+                cookie, max_age=int(self.flask_app.permanent_session_lifetime.total_seconds())
+            )
+        except Exception:
+            return None
+        return data.get('user_id')
+
+    def _client_address(self, request):
+        """The peer, or with PROXY_FIX_HOPS the client address the trusted proxies forwarded (as ProxyFix does)"""
+        hops = self.flask_app.config['PROXY_FIX_HOPS']
+        forwarded = [a.strip() for a in ','.join(request.headers.getall('X-Forwarded-For', [])).split(',') if a.strip()]
+        if hops > 0 and len(forwarded) >= hops:
+            return forwarded[-hops]
+        return request.remote
+
+    async def websocket_handler(self, request):
+        try:
+            bot_id = int(request.query['bot_id'])
+        except (KeyError, ValueError):
+            raise web.HTTPBadRequest(text='bot_id query parameter is required')
+
+        token = request.query.get('token')
+        user_id = None if token else self._session_user_id(request)
+        if token:
+            payload = self._verify_token(token)
+            if payload is None or payload['bot_id'] != bot_id:
+                raise web.HTTPUnauthorized(text='invalid chat token')
+            personality = payload['personality'] or 'friendly'
+            template = payload.get('template')
+        elif user_id is not None:
+            personality, template = await self.bot_profile(bot_id)
+        else:
+            raise web.HTTPUnauthorized(text='login or a chat token is required')
+
+        limiter = self.flask_app.extensions['chat_rate_limiter']
+        client = limiter.client_key(user_id, token, self._client_address(request))
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        self.connections += 1
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                try:
+                    message = json.loads(msg.data).get('message', '')
+                except (ValueError, AttributeError):
+                    message = msg.data
+                message = str(message).strip()
+                if not message:
+                    continue
+                if limiter.enabled and not await self._in_executor(limiter.hit, bot_id, client):
+                    await ws.send_json({'error': 'rate limit exceeded'})
+                    continue
+
+                model_key = await self._in_executor(RasaNLPEngine.model_for, bot_id, template)
+                intent, response = await self.predict(message, personality, model_key)
+                await ws.send_json({'response': response, 'intent': intent})
+                self.messages += 1
+                await self._in_executor(self._write_log, bot_id, message, response, intent)
+        finally:
+            self.connections -= 1
+        return ws
+
+    async def status_handler(self, request):
+        return web.json_response({
+            'connections': self.connections,
+            'messages': self.messages,
+            'bots_cached': len(self._bots),
+            'rasa': self.rasa.stats(),
+            'cache': prediction_cache.stats(),
+            'models': model_registry.stats(),
+            'rate_limit': self.flask_app.extensions['chat_rate_limiter'].stats(),
+        })
+
+    async def _startup(self, app):
+        await self.rasa.start()
+        await self._in_executor(rasa_client.refresh_model)  # the shared cache keys need the model file
+
+    async def _cleanup(self, app):
+        await self.rasa.close()
+        self._executor.shutdown(wait=True)
+        self.flask_app.extensions['log_writer'].close()
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_get('/ws/chat', self.websocket_handler)
+        app.router.add_get('/status', self.status_handler)
+        app.on_startup.append(self._startup)
+        app.on_cleanup.append(self._cleanup)
+        return app
+
+
+def run_gateway(flask_app, host='0.0.0.0', port=None):
+    port = port or int(os.environ.get('CHAT_GATEWAY_PORT', '5001'))
+    gateway = ChatGateway(flask_app)
+    metrics_port = int(os.environ.get('CHAT_GATEWAY_METRICS_PORT', '9101'))  # 0 = off
+    if metrics_port:
+        start_metrics_server(metrics_port, REGISTRY.render, flask_app.config['METRICS_HOST'])
+    print(f"Chat gateway listening on ws://{host}:{port}/ws/chat")
+    web.run_app(gateway.create_app(), host=host, port=port, print=None)
@@ -0,0 +1,130 @@
+import os
+
+import click
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative = KiB, so 64 MiB
+    'busy_timeout': 5000,
+}
+
+# unique over a subset of rows; SQLite and PostgreSQL only, other databases
+# rely on the application-level check
+PARTIAL_UNIQUE_INDEXES = {
+    # one queued or running training job per bot (TrainingJobRunner.submit)
+    'uq_training_job_active': ('training_job', 'bot_id', "kind = 'train' AND status IN ('queued', 'running')"),
+}
+
+
+def parse_pragmas(value):
+    """'journal_mode=WAL,synchronous=NORMAL' -> dict"""
+    pragmas = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, setting = item.partition('=')
+        pragmas[name.strip()] = setting.strip()
+    return pragmas
+
+
+def configure_database(app):
+    """Fill in database URI, pool and SQLite settings from the environment"""
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', os.environ.get('DATABASE_URL', 'sqlite:///chatbots.db'))
+    pragmas = dict(DEFAULT_SQLITE_PRAGMAS)
+    pragmas.update(parse_pragmas(os.environ.get('SQLITE_PRAGMAS', '')))
+    app.config.setdefault('SQLITE_PRAGMAS', pragmas)
+
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        options.setdefault('pool_size', int(os.environ.get('DB_POOL_SIZE', '10')))
+        options.setdefault('max_overflow', int(os.environ.get('DB_MAX_OVERFLOW', '20')))
+        options.setdefault('pool_timeout', float(os.environ.get('DB_POOL_TIMEOUT', '30')))
+        options.setdefault('pool_recycle', int(os.environ.get('DB_POOL_RECYCLE', '1800')))
+        options.setdefault('pool_pre_ping', True)
+
+
+def install_sqlite_pragmas(engine, pragmas):
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def add_missing_columns(engine, inspector, table):
+    """
+    ALTER TABLE ADD COLUMN for columns added to a model after its table was
+    created. Only columns that are nullable or have a server default can be
+    added this way; returns their names.
+    """
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name in existing or not (column.nullable or column.server_default is not None):
+            continue
+        ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+        if column.server_default is not None:
+            ddl += f" DEFAULT '{column.server_default.arg}'"
+        if not column.nullable:
+            ddl += ' NOT NULL'
+        with engine.begin() as connection:
+            connection.exec_driver_sql(ddl)
+        added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def upgrade_schema():
+    """
+    Bring an existing database up to the current models: create missing
+    tables, add new nullable/defaulted columns, then any indexes that
+    create_all skips on existing tables.
+    Returns the names of the columns and indexes that were created.
+    """
+    db.create_all()
+    engine = db.engine
+    inspector = inspect(engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        created += add_missing_columns(engine, inspector, table)
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                created.append(index.name)
+    created += create_partial_indexes(engine, inspector)
+    if created and engine.dialect.name == 'sqlite':
+        with engine.begin() as connection:
+            connection.exec_driver_sql('ANALYZE')
+    return created
+
+
+def create_partial_indexes(engine, inspector):
+    if engine.dialect.name not in ('sqlite', 'postgresql'):
+        return []
+    created = []
+    for name, (table, columns, where) in PARTIAL_UNIQUE_INDEXES.items():
+        if name in {index['name'] for index in inspector.get_indexes(table)}:
+            continue
+        try:
+            with engine.begin() as connection:
+                connection.exec_driver_sql(f"CREATE UNIQUE INDEX {name} ON {table} ({columns}) WHERE {where}")
+        except IntegrityError as e:
+            print(f"Index {name} not created, existing rows violate it: {e.orig}")
+            continue
+        created.append(name)
+    return created
+
+
+@click.command('upgrade-db')
+def upgrade_db_command():
+    """Create missing tables and indexes in the configured database."""
+    created = upgrade_schema()
+    click.echo(f"Created columns/indexes: {', '.join(created)}" if created else "Schema is up to date.")
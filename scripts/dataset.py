@@ -0,0 +1,148 @@
+import csv
+import heapq
+import io
+import json
+import zlib
+
+from . import db
+from .archive import iter_archived
+from .models import InteractionLog
+
+EXPORT_FIELDS = ('message', 'response', 'intent')
+EXPORT_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def iter_interactions(bot_id, after_id=0, batch_size=1000):
+    """
+    Yield a bot's interactions in id order, archived and hot alike. Both
+    tiers are streamed (archive segments block by block, the table in
+    keyset pages) and merged on id, so after_id cursors work across them.
+    """
+    archived = iter_archived(bot_id, after_id)
+    hot = _iter_hot_interactions(bot_id, after_id, batch_size)
+    first = next(archived, None)
+    if first is None:
+        yield from hot
+        return
+    last_id = after_id
+    for row in heapq.merge([first], archived, hot, key=lambda row: row.id):
+        if row.id != last_id:  # archived but not yet deleted, after an interrupted archive run
+            last_id = row.id
+            yield row
+
+
+def _iter_hot_interactions(bot_id, after_id, batch_size):
+    """
+    InteractionLog rows in id order. Each page is a keyset query (id >
+    last seen id) read through a server-side cursor, so memory stays flat
+    however long the history is.
+    """
+    last_id = after_id
+    while True:
+        query = (
+            db.session.query(
+                InteractionLog.id,
+                InteractionLog.user_message,
+                InteractionLog.bot_response,
+                InteractionLog.intent,
+                InteractionLog.timestamp,
+            )
+            .filter(InteractionLog.bot_id == bot_id, InteractionLog.id > last_id)
+            .order_by(InteractionLog.id)
+            .limit(batch_size)
+            .execution_options(stream_results=True)
+        )
+        count = 0
+        for row in query:
+            count += 1
+            last_id = row.id
+            yield row
+        if count < batch_size:
+            return
+
+
+def interaction_page(bot_id, after_id=0, limit=50):
+    """One keyset page as export dicts plus the cursor for the next page"""
+    items = []
+    next_after = None
+    for row in iter_interactions(bot_id, after_id, batch_size=limit):
+        items.append(export_record(row))
+        next_after = row.id
+        if len(items) == limit:
+            break
+    return items, (next_after if len(items) == limit else None)
+
+
+def export_record(row):
+    return {"message": row.user_message, "response": row.bot_response, "intent": row.intent}
+
+
+def _json_chunks(records):
+    yield '['
+    first = True
+    for record in records:
+        yield ('' if first else ',') + json.dumps(record, ensure_ascii=False)
+        first = False
+    yield ']'
+
+
+def _ndjson_chunks(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def _csv_chunks(records, rows_per_chunk=500):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for i, record in enumerate(records, 1):
+        writer.writerow(record)
+        if i % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _coalesce(chunks, size=64 * 1024):
+    """Join small text chunks so the server writes ~64 KiB at a time"""
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= size:
+            yield ''.join(pending)
+            pending = []
+            pending_size = 0
+    if pending:
+        yield ''.join(pending)
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(bot_id, fmt='json', gzip=False):
+    """Encoded export body for a bot, produced incrementally"""
+    records = (export_record(row) for row in iter_interactions(bot_id))
+    if fmt == 'ndjson':
+        chunks = _ndjson_chunks(records)
+    elif fmt == 'csv':
+        chunks = _csv_chunks(records)
+    else:
+        chunks = _json_chunks(records)
+
+    chunks = _coalesce(chunks)
+    if gzip:
+        return _gzip_chunks(chunks)
+    return (chunk.encode('utf-8') for chunk in chunks)
@@ -0,0 +1,29 @@
+from flask import Blueprint, jsonify
+from sqlalchemy import text
+
+from . import db
+from .nlp import INTENT_INDEX
+
+health_bp = Blueprint('health', __name__)
+
+
+@health_bp.route('/healthz')
+def liveness():
+    """The process is up and serving requests; no dependencies checked"""
+    return jsonify({'status': 'ok'})
+
+
+@health_bp.route('/readyz')
+def readiness():
+    """Ready for traffic: engines loaded and the database answers"""
+    checks = {'nlp_engine': INTENT_INDEX.size > 0}
+    try:
+        db.session.execute(text('SELECT 1'))
+        checks['database'] = True
+    except Exception:
+        db.session.rollback()
+        checks['database'] = False
+
+    ready = all(checks.values())
+    return jsonify({'status': 'ready' if ready else 'not ready', 'checks': checks}), 200 if ready else 503
+
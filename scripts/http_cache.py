@@ -0,0 +1,85 @@
+"""
+HTTP caching helpers: content-hashed versions for static assets, and
+conditional GETs (ETag / Last-Modified) for pages whose inputs can be
+summarized by a cheap query, so an unchanged page is answered with 304
+before its queries run or its template renders.
+"""
+import hashlib
+import os
+import threading
+
+from flask import Response, current_app, g, request, session
+from werkzeug.http import is_resource_modified
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def _digest(paths):
+    sha = hashlib.sha256()
+    for path in paths:
+        sha.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()[:12]
+
+
+def static_version(filename):
+    """Content hash of a file under the static folder; rehashed only when its mtime changes"""
+    path = os.path.join(current_app.static_folder, filename)
+    mtime = os.stat(path).st_mtime_ns
+    with _versions_lock:
+        cached = _versions.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = _versions[path] = (mtime, _digest([path]))
+        return cached[1]
+
+
+def templates_version():
+    """Hash of every template, so a deploy that changes markup invalidates cached pages"""
+    folder = current_app.template_folder
+    key = ('templates', folder)
+    with _versions_lock:
+        if key not in _versions:
+            names = sorted(n for n in os.listdir(folder) if n.endswith('.html'))
+            _versions[key] = _digest([os.path.join(folder, n) for n in names])
+        return _versions[key]
+
+
+def not_modified(*parts, last_modified=None):
+    """
+    Compute the validators of the page being served from `parts` (what it
+    was built from) plus the viewer and the query string. Returns a 304
+    response if the client's copy is current, else None; either way the
+    validators are added to the response on the way out.
+    """
+    seed = '|'.join(str(p) for p in (
+        request.endpoint, request.query_string.decode('latin-1'),
+        session.get('user_id'), session.get('username'), session.get('role'),
+        templates_version(), *parts,
+    ))
+    etag = hashlib.sha256(seed.encode()).hexdigest()[:24]
+    g.cache_validators = (etag, last_modified)
+    if session.get('_flashes'):
+        return None  # the full page must render to consume them
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return Response(status=304)
+
+
+def init_app(app):
+    @app.after_request
+    def add_validators(response):
+        validators = g.pop('cache_validators', None)
+        if validators is None or response.status_code not in (200, 304):
+            return response
+        etag, last_modified = validators
+        response.set_etag(etag, weak=True)  # summarizes the inputs, not the bytes
+        if last_modified is not None:
+            response.last_modified = last_modified
+        # private: pages depend on the session; no-cache: always revalidate, usually for a 304
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Cookie')
+        return response
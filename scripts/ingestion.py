@@ -0,0 +1,293 @@
+"""
+Streaming import of training datasets into the training_example table.
+
+Uploads are parsed incrementally (JSON arrays, NDJSON or CSV, optionally
+gzipped - the formats /train/export produces), validated and normalized
+row by row, deduplicated by content hash and inserted in chunks, so memory
+stays bounded by the chunk size whatever the file size.
+"""
+import codecs
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+from collections import Counter
+
+from . import db
+from .models import TrainingExample
+from .prediction_cache import normalize_message
+
+MAX_TEXT_LENGTH = 500
+MAX_INTENT_LENGTH = 50
+INTENT_RE = re.compile(r'^[\w.-]+$')
+IMPORT_FORMATS = ('json', 'ndjson', 'csv')
+
+
+def _open_binary(path):
+    """The file, transparently gunzipped when it starts with the gzip magic"""
+    raw = open(path, 'rb')
+    if raw.read(2) == b'\x1f\x8b':
+        raw.seek(0)
+        return raw, gzip.GzipFile(fileobj=raw)
+    raw.seek(0)
+    return raw, raw
+
+
+def detect_format(path, head):
+    """Format from the extension (ignoring .gz), else from the first byte"""
+    name = path[:-3] if path.endswith('.gz') else path
+    ext = os.path.splitext(name)[1].lower().lstrip('.')
+    if ext in ('ndjson', 'jsonl'):
+        return 'ndjson'
+    if ext in IMPORT_FORMATS:
+        return ext
+    first = head.lstrip()[:1]
+    if first == '[':
+        return 'json'
+    if first == '{':
+        return 'ndjson'
+    return 'csv'
+
+
+def iter_json_array(stream, read_size=64 * 1024, max_element=1024 * 1024):
+    """
+    Yield the elements of a top-level JSON array one at a time, decoding
+    from a sliding text buffer instead of loading the whole document.
+    An element that cannot be decoded, or is still undecodable after
+    max_element characters, is skipped up to the next top-level comma and
+    yielded as None (a malformed row) rather than buffered indefinitely.
+    Unbalanced brackets cannot be skipped and still fail the import.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    started = False
+    eof = False
+    while True:
+        # skip whitespace and separators
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            chunk = stream.read(read_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        if pos >= len(buffer):
+            if started:
+                raise ValueError('unexpected end of JSON array')
+            return
+        if not started:
+            if buffer[pos] != '[':
+                raise ValueError('expected a JSON array')
+            started = True
+            pos += 1
+            continue
+        if buffer[pos] == ']':
+            return
+
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof or len(buffer) - pos > max_element:
+                buffer, pos, eof = _skip_element(stream, buffer, pos, read_size, eof)
+                yield None  # counted as a rejected row
+                continue
+            # the element continues in the next block
+            chunk = stream.read(read_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        # a number at the very end of the buffer may still be incomplete
+        if end == len(buffer) and not eof:
+            chunk = stream.read(read_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        pos = end
+        yield value
+
+
+def _skip_element(stream, buffer, pos, read_size, eof):
+    """
+    Scan past one array element without decoding it, tracking strings and
+    nesting, and return (buffer, pos, eof) at the ',' or ']' that ends it.
+    Scanned text is dropped as the scan moves on, so memory stays bounded.
+    """
+    depth = 0
+    in_string = escaped = False
+    while True:
+        while pos < len(buffer):
+            ch = buffer[pos]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == '\\':
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch in '[{':
+                depth += 1
+            elif ch in ']}':
+                if depth == 0:
+                    return buffer, pos, eof  # the array's own closing bracket
+                depth -= 1
+            elif ch == ',' and depth == 0:
+                return buffer, pos, eof
+            pos += 1
+        chunk = '' if eof else stream.read(read_size)
+        if not chunk:
+            return '', 0, True
+        buffer, pos = chunk, 0
+
+
+def iter_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None  # counted as a rejected row
+
+
+def iter_records(stream, fmt):
+    if fmt == 'json':
+        return iter_json_array(stream)
+    if fmt == 'ndjson':
+        return iter_ndjson(stream)
+    return csv.DictReader(stream)
+
+
+def normalize_record(record):
+    """(intent, message, response) ready to insert, or (None, reason)"""
+    if not isinstance(record, dict):
+        return None, 'malformed'
+    message = record.get('message')
+    intent = record.get('intent')
+    response = record.get('response')
+    if not isinstance(message, str) or not message.strip():
+        return None, 'missing_message'
+    if not isinstance(intent, str) or not intent.strip():
+        return None, 'missing_intent'
+    message = ' '.join(message.split())
+    intent = intent.strip()
+    if intent == 'unknown':
+        return None, 'unlabelled'
+    if len(intent) > MAX_INTENT_LENGTH or not INTENT_RE.match(intent):
+        return None, 'invalid_intent'
+    if len(message) > MAX_TEXT_LENGTH:
+        return None, 'too_long'
+    if isinstance(response, str) and response.strip():
+        response = ' '.join(response.split())[:MAX_TEXT_LENGTH]
+    else:
+        response = None
+    return (intent, message, response), None
+
+
+def content_hash(intent, message):
+    return hashlib.sha256(f"{intent}\0{normalize_message(message)}".encode('utf-8')).hexdigest()
+
+
+def _insert_chunk(bot_id, rows, source):
+    """Insert rows not already stored for the bot; returns how many were new"""
+    hashes = list(rows)
+    existing = {
+        h for (h,) in db.session.query(TrainingExample.content_hash)
+        .filter(TrainingExample.bot_id == bot_id, TrainingExample.content_hash.in_(hashes))
+    }
+    new_rows = [
+        {
+            'bot_id': bot_id,
+            'intent': intent,
+            'message': message,
+            'response': response,
+            'content_hash': h,
+            'source': source,
+        }
+        for h, (intent, message, response) in rows.items()
+        if h not in existing
+    ]
+    if new_rows:
+        db.session.execute(TrainingExample.__table__.insert(), new_rows)
+    db.session.commit()
+    return len(new_rows)
+
+
+def ingest_file(path, bot_id, fmt=None, chunk_size=1000, progress=None, source=None):
+    """
+    Import a dataset file for a bot. progress(bytes_read, total_bytes, counts)
+    is called after every chunk and may raise to stop the import; chunks
+    already committed are kept. Returns the counts.
+    """
+    source = source or os.path.basename(path)
+    total_bytes = os.path.getsize(path)
+    counts = {'read': 0, 'inserted': 0, 'duplicates': 0, 'rejected': 0}
+    reasons = Counter()
+
+    raw, binary = _open_binary(path)
+    try:
+        head = binary.peek(64)[:64] if hasattr(binary, 'peek') else b''
+        fmt = fmt or detect_format(path, codecs.decode(head, 'utf-8', 'ignore'))
+        stream = io.TextIOWrapper(binary, encoding='utf-8-sig', errors='replace', newline='')
+
+        rows = {}
+
+        def flush():
+            inserted = _insert_chunk(bot_id, rows, source)
+            counts['inserted'] += inserted
+            counts['duplicates'] += len(rows) - inserted
+            rows.clear()
+            if progress is not None:
+                progress(raw.tell(), total_bytes, dict(counts, reasons=dict(reasons)))
+
+        for record in iter_records(stream, fmt):
+            counts['read'] += 1
+            row, reason = normalize_record(record)
+            if row is None:
+                counts['rejected'] += 1
+                reasons[reason] += 1
+                continue
+            h = content_hash(row[0], row[1])
+            if h in rows:
+                counts['duplicates'] += 1
+            else:
+                rows[h] = row
+            if len(rows) >= chunk_size:
+                flush()
+        flush()
+    finally:
+        raw.close()
+
+    counts['reasons'] = dict(reasons)
+    return counts
+
+
+def iter_training_examples(bot_id, batch_size=1000):
+    """(intent, message, response) of a bot's imported examples in id order"""
+    query = (
+        db.session.query(TrainingExample.intent, TrainingExample.message, TrainingExample.response)
+        .filter(TrainingExample.bot_id == bot_id)
+        .order_by(TrainingExample.id)
+    )
+    yield from query.yield_per(batch_size)
+
+
+def describe_counts(counts):
+    text = (
+        f"Imported {counts['inserted']} of {counts['read']} rows: "
+        f"{counts['duplicates']} duplicates, {counts['rejected']} rejected"
+    )
+    reasons = counts.get('reasons')
+    if reasons:
+        text += ' (' + ', '.join(f"{reason}: {n}" for reason, n in sorted(reasons.items())) + ')'
+    return text
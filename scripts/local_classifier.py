@@ -0,0 +1,254 @@
+"""
+In-process intent classifier: hashed character n-gram TF-IDF features and
+a nearest-centroid (cosine) model, trained from rasa_project/data/nlu.yml
+plus labelled InteractionLog rows. Used as a fast first tier in front of
+Rasa and as the fallback when Rasa is down.
+"""
+import itertools
+import json
+import os
+import time
+import zlib
+from collections import Counter
+
+import click
+import numpy as np
+
+from .nlp import RASA_DIR, load_rasa_project
+from .prediction_cache import normalize_message
+
+DEFAULT_MODEL_PATH = os.path.join('instance', 'models', 'local_nlu.npz')
+
+
+def _ngrams(text, min_n=2, max_n=4):
+    """char_wb n-grams: each word padded with spaces, like Rasa's featurizer"""
+    for word in normalize_message(text).split():
+        padded = f" {word} "
+        for n in range(min_n, max_n + 1):
+            for i in range(len(padded) - n + 1):
+                yield padded[i:i + n]
+
+
+class LocalIntentClassifier:
+    def __init__(self, intents, centroids, idf, n_features, min_n=2, max_n=4, responses=None):
+        self.intents = list(intents)
+        # reply texts for intents that domain.yml does not know, e.g. from imported datasets
+        self.responses = dict(responses or {})
+        self.centroids = centroids
+        self.idf = idf
+        self.n_features = n_features
+        self.min_n = min_n
+        self.max_n = max_n
+
+    def _features(self, messages):
+        """
+        Sparse TF-IDF rows as coordinate arrays (row, column, weight),
+        each row L2-normalized. Nothing dense of size n_features per
+        message is ever built.
+        """
+        rows, cols = [], []
+        for row, message in enumerate(messages):
+            for gram in _ngrams(message, self.min_n, self.max_n):
+                rows.append(row)
+                cols.append(zlib.crc32(gram.encode('utf-8')) % self.n_features)
+        if not rows:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+
+        # merge duplicate (row, column) pairs into counts
+        keys = np.array(rows, dtype=np.int64) * self.n_features + np.array(cols, dtype=np.int64)
+        keys, counts = np.unique(keys, return_counts=True)
+        rows, cols = keys // self.n_features, keys % self.n_features
+
+        weights = (np.log1p(counts) * self.idf[cols]).astype(np.float32)
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=len(messages)))
+        norms[norms == 0] = 1.0
+        return rows, cols, weights / norms[rows]
+
+    def predict_batch(self, messages):
+        """[(intent, confidence)] for a list of messages in one batched product"""
+        if not messages:
+            return []
+        rows, cols, weights = self._features(messages)
+        scores = np.zeros((len(messages), len(self.intents)), dtype=np.float32)
+        np.add.at(scores, rows, weights[:, None] * self.centroids[:, cols].T)
+        best = scores.argmax(axis=1)
+        return [
+            (self.intents[i], float(max(scores[row, i], 0.0)))
+            for row, i in enumerate(best)
+        ]
+
+    def predict(self, message):
+        return self.predict_batch([message])[0]
+
+    @property
+    def nbytes(self):
+        return self.centroids.nbytes + self.idf.nbytes
+
+    @classmethod
+    def train(cls, examples, n_features=2 ** 14, min_n=2, max_n=4, responses=None):
+        """examples: iterable of (intent, text); responses: optional {intent: text}"""
+        examples = list(examples)
+        intents = sorted({intent for intent, _ in examples})
+        model = cls(intents, None, np.ones(n_features, dtype=np.float32), n_features, min_n, max_n, responses)
+        texts = [text for _, text in examples]
+
+        # first pass with idf=1 only to find which columns each document uses
+        rows, cols, _ = model._features(texts)
+        document_freq = np.bincount(cols, minlength=n_features)
+        model.idf = (np.log((1 + len(examples)) / (1 + document_freq)) + 1).astype(np.float32)
+
+        rows, cols, weights = model._features(texts)
+        labels = np.array([intents.index(intent) for intent, _ in examples], dtype=np.int64)
+        sums = np.zeros((len(intents), n_features), dtype=np.float32)
+        np.add.at(sums, (labels[rows], cols), weights)
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        model.centroids = sums / norms
+        return model
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # centroids are mostly zeros, so store them sparsely as float16
+        rows, cols = np.nonzero(self.centroids)
+        with open(path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                intents=np.array(self.intents),
+                rows=rows.astype(np.int32),
+                cols=cols.astype(np.int32),
+                values=self.centroids[rows, cols].astype(np.float16),
+                idf=self.idf.astype(np.float16),
+                params=np.array([self.n_features, self.min_n, self.max_n]),
+                responses=np.array(json.dumps(self.responses, ensure_ascii=False)),
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            n_features, min_n, max_n = (int(v) for v in data['params'])
+            intents = [str(i) for i in data['intents']]
+            centroids = np.zeros((len(intents), n_features), dtype=np.float32)
+            centroids[data['rows'], data['cols']] = data['values']
+            responses = json.loads(str(data['responses'])) if 'responses' in data.files else None
+            return cls(intents, centroids, data['idf'].astype(np.float32), n_features, min_n, max_n, responses)
+
+
+def nlu_examples(rasa_dir=RASA_DIR):
+    _, phrases = load_rasa_project(rasa_dir)
+    return phrases
+
+
+def log_examples(bot_ids=None, max_per_intent=5000, batch_size=10000):
+    """
+    Distinct (intent, message) pairs from InteractionLog, then from the
+    archived segments, skipping 'unknown', optionally limited to some bots
+    """
+    from . import db
+    from .archive import archived_bot_ids, iter_archived
+    from .models import InteractionLog
+
+    seen = set()
+    per_intent = {}
+    query = (
+        db.session.query(InteractionLog.intent, InteractionLog.user_message)
+        .filter(InteractionLog.intent.isnot(None), InteractionLog.intent != 'unknown')
+    )
+    if bot_ids is not None:
+        query = query.filter(InteractionLog.bot_id.in_(bot_ids))
+    archived = (
+        (row.intent, row.user_message)
+        for bot_id in (bot_ids if bot_ids is not None else archived_bot_ids())
+        for row in iter_archived(bot_id, columns=('intent', 'user_message'))
+    )
+    for intent, message in itertools.chain(query.yield_per(batch_size), archived):
+        if not message or intent is None or intent == 'unknown':
+            continue
+        key = (intent, normalize_message(message))
+        if key in seen or per_intent.get(intent, 0) >= max_per_intent:
+            continue
+        seen.add(key)
+        per_intent[intent] = per_intent.get(intent, 0) + 1
+        yield intent, message
+
+
+def log_responses(bot_ids=None):
+    """Most frequent logged reply per intent, for intents domain.yml lacks"""
+    from . import db
+    from .archive import archived_bot_ids, iter_archived
+    from .models import InteractionLog
+
+    query = (
+        db.session.query(InteractionLog.intent, InteractionLog.bot_response, db.func.count())
+        .filter(InteractionLog.intent.isnot(None), InteractionLog.intent != 'unknown')
+        .group_by(InteractionLog.intent, InteractionLog.bot_response)
+    )
+    if bot_ids is not None:
+        query = query.filter(InteractionLog.bot_id.in_(bot_ids))
+    counts = Counter({(intent, response): count for intent, response, count in query})
+    for bot_id in (bot_ids if bot_ids is not None else archived_bot_ids()):
+        for row in iter_archived(bot_id, columns=('intent', 'bot_response')):
+            if row.intent is not None and row.intent != 'unknown':
+                counts[(row.intent, row.bot_response)] += 1
+    best = {}
+    for (intent, response), count in counts.items():
+        if response and count > best.get(intent, (None, 0))[1]:
+            best[intent] = (response, count)
+    return {intent: response for intent, (response, _) in best.items()}
+
+
+_loaded = {}
+
+
+def get_local_classifier(path=None):
+    """
+    The classifier saved at path (LOCAL_NLU_MODEL), loaded once per process.
+    Without a saved model, one is trained in memory from nlu.yml alone.
+    """
+    path = path or os.environ.get('LOCAL_NLU_MODEL', DEFAULT_MODEL_PATH)
+    if path not in _loaded:
+        if os.path.exists(path):
+            _loaded[path] = LocalIntentClassifier.load(path)
+        else:
+            _loaded[path] = LocalIntentClassifier.train(nlu_examples())
+    return _loaded[path]
+
+
+@click.command('train-local-nlu')
+@click.option('--bot-id', type=int, default=None, help="Train a model for one bot from its own logs.")
+@click.option('--template', default=None, help="Train a model shared by every bot with this template.")
+@click.option('--output', default=None, help='Write to this file instead of publishing to the model registry.')
+@click.option('--no-logs', is_flag=True, help='Train from nlu.yml only.')
+def train_local_nlu_command(bot_id, template, output, no_logs):
+    """Train a local classifier from nlu.yml and logs and publish it."""
+    from .model_registry import DEFAULT_MODEL_KEY, bot_model_key, template_model_key
+    from .models import Chatbot
+    from .rasa_integration import model_registry
+
+    if bot_id is not None:
+        key, bot_ids = bot_model_key(bot_id), [bot_id]
+    elif template:
+        key = template_model_key(template)
+        bot_ids = [bot.id for bot in Chatbot.query.filter_by(template=template).with_entities(Chatbot.id)]
+    else:
+        key, bot_ids = DEFAULT_MODEL_KEY, None
+
+    examples = nlu_examples()
+    responses = {}
+    if not no_logs:
+        examples += list(log_examples(bot_ids))
+        responses = log_responses(bot_ids)
+
+    start = time.perf_counter()
+    model = LocalIntentClassifier.train(examples, responses=responses)
+    if output:
+        model.save(output)
+        target = output
+    else:
+        version = model_registry.publish(key, model)
+        target = f"{key}@{version}"
+    elapsed = time.perf_counter() - start
+    click.echo(
+        f"Trained {len(model.intents)} intents from {len(examples)} examples "
+        f"in {elapsed:.2f}s -> {target} ({model.nbytes // 1024} KiB resident)"
+    )
@@ -0,0 +1,205 @@
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, has_app_context
+
+from . import db
+from .aggregates import update_aggregates
+from .models import InteractionLog
+
+
+def persist_interactions(records):
+    """
+    Insert interaction dicts with one executemany and update the aggregate
+    tables in the same transaction, or count them in the AggregateBuffer
+    (falling back to the tables while the shared state is unreachable)
+    """
+    if not records:
+        return
+    now = datetime.utcnow()
+    for record in records:
+        record.setdefault('timestamp', now)
+    db.session.execute(InteractionLog.__table__.insert(), records)
+    buffer = current_app.extensions.get('aggregate_buffer')
+    buffered = buffer is not None and buffer.add(records)
+    if not buffered:
+        update_aggregates(records)
+    try:
+        db.session.commit()
+    except Exception:
+        if buffered:
+            buffer.discard(records)  # the rows were not stored, and a retry counts them again
+        raise
+
+
+class InteractionLogWriter:
+    """
+    Writes InteractionLog rows either synchronously (the default, and what
+    tests use) or write-behind: records go onto a bounded queue and a
+    background thread bulk-inserts them once batch_size records are
+    waiting or flush_interval seconds have passed.
+
+    When the queue is full the caller waits up to put_timeout and then
+    writes its own record synchronously, so load sheds onto the request
+    rather than dropping logs. That write is tried once: if it fails the
+    records are dropped rather than retried on the request thread. A
+    batch from the queue that fails is retried `retries` times with
+    doubling delays, then written row by row so one bad record cannot take
+    the batch with it; only rows that still fail are dropped. `failed`
+    counts records whose last attempt failed, not each retry.
+    """
+
+    def __init__(self, app, write_behind=False, max_queue=10000, batch_size=500,
+                 flush_interval=0.5, put_timeout=0.05, retries=3, retry_delay=0.1):
+        self.app = app
+        self.write_behind = write_behind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.written = 0
+        self.batches = 0
+        self.overflow = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopped = threading.Event()
+        self._thread = None
+        if write_behind:
+            self.start()
+            atexit.register(self.close)
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='interaction-log-writer', daemon=True)
+        self._thread.start()
+
+    def after_fork(self):
+        """Threads do not survive fork(); give a new worker its own queue and flusher"""
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._thread = None
+        if self.write_behind:
+            self.start()
+
+    def log(self, bot_id, user_message, bot_response, intent):
+        self.log_many([{
+            'bot_id': bot_id,
+            'user_message': user_message,
+            'bot_response': bot_response,
+            'intent': intent,
+        }])
+
+    def log_many(self, records):
+        now = datetime.utcnow()
+        for record in records:
+            record.setdefault('timestamp', now)
+
+        if not self.write_behind:
+            self._write(records, raise_errors=True)
+            return
+
+        for i, record in enumerate(records):
+            try:
+                self._queue.put(record, timeout=self.put_timeout)
+            except queue.Full:
+                self.overflow += len(records) - i
+                self._write(records[i:], retry=False)
+                return
+
+    def flush(self):
+        """Write everything queued so far on the calling thread"""
+        while True:
+            batch = self._drain(block=False)
+            if not batch:
+                return
+            self._write(batch)
+
+    def close(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        return {
+            'mode': 'write_behind' if self.write_behind else 'sync',
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'batches': self.batches,
+            'overflow_sync_writes': self.overflow,
+            'failed': self.failed,
+            'retried': self.retried,
+            'dropped': self.dropped,
+        }
+
+    def _drain(self, block=True):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if block and timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, records, raise_errors=False, retry=True):
+        if has_app_context():
+            self._persist(records, raise_errors, retry)
+        else:
+            with self.app.app_context():
+                self._persist(records, raise_errors, retry)
+
+    def _persist(self, records, raise_errors, retry=True):
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1 if retry and not raise_errors else 1):
+            if attempt:
+                self.retried += len(records)
+                time.sleep(delay)
+                delay *= 2
+            try:
+                persist_interactions(records)
+            except Exception as e:
+                db.session.rollback()
+                error = e
+                continue
+            self.written += len(records)
+            self.batches += 1
+            return
+
+        self.failed += len(records)
+        if raise_errors:
+            raise error
+        if not retry:
+            self.dropped += len(records)
+            print(f"InteractionLog overflow write failed, dropped {len(records)} records: {error}")
+            return
+
+        kept = 0
+        if len(records) > 1:
+            for record in records:
+                try:
+                    persist_interactions([record])
+                    kept += 1
+                except Exception:
+                    db.session.rollback()
+        self.written += kept
+        self.dropped += len(records) - kept
+        print(f"InteractionLog write failed for {len(records)} records after {self.retries} retries: {error}; "
+              f"dropped {len(records) - kept}")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._drain()
+            if batch:
+                self._write(batch)
@@ -0,0 +1,654 @@
+"""
+In-process counters and histograms, rendered in the Prometheus text
+format on /metrics of a separate port (METRICS_PORT), plus an opt-in
+sampling profiler for slow requests.
+
+Metrics are recorded in the process that sees the event. Under gunicorn
+each worker publishes a snapshot to a directory every few seconds and
+the master serves their merge, so a scrape covers every worker.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bisect import bisect_left
+from collections import Counter as _Tally
+from contextlib import contextmanager
+
+# seconds; fine at the low end, where cache hits and local models answer
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._samples(items))
+        return lines
+
+    def _samples(self, items):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in items]
+
+    def snapshot(self):
+        with self._lock:
+            values = [[list(key), value] for key, value in self._values.items()]
+        return {'kind': self.kind, 'help': self.help, 'labelnames': list(self.labelnames), 'values': values}
+
+    def merge(self, key, value):
+        """Fold another process's value for key into this one"""
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Counter(_Metric):
+    """Monotonic count per label set"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """
+    Current value per label set, usually refreshed by a collector at scrape
+    time. multiprocess says how the values of live worker processes combine:
+    'sum', 'max' or 'min'.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labelnames=(), multiprocess='sum'):
+        super().__init__(name, help_text, labelnames)
+        self.multiprocess = multiprocess
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def snapshot(self):
+        return {**super().snapshot(), 'multiprocess': self.multiprocess}
+
+    def merge(self, key, value):
+        with self._lock:
+            current = self._values.get(key)
+            if current is None:
+                self._values[key] = value
+            elif self.multiprocess == 'max':
+                self._values[key] = max(current, value)
+            elif self.multiprocess == 'min':
+                self._values[key] = min(current, value)
+            else:
+                self._values[key] = current + value
+
+
+class Histogram(_Metric):
+    """Bucketed observations with sum and count per label set"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)  # upper bounds are inclusive (le)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[2] if state else 0
+
+    def _samples(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            values = [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self._values.items()]
+        return {'kind': self.kind, 'help': self.help, 'labelnames': list(self.labelnames),
+                'buckets': list(self.buckets), 'values': values}
+
+    def merge(self, key, value):
+        counts, total, count = value
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0] = [a + b for a, b in zip(state[0], counts)]
+            state[1] += total
+            state[2] += count
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing  # module reloads and repeated create_app() share one metric
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=(), multiprocess='sum'):
+        return self._register(Gauge(name, help_text, labelnames, multiprocess))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def add_collector(self, name, fn):
+        """fn() runs before every render to refresh gauges from live objects; a later app replaces it"""
+        with self._lock:
+            self._collectors[name] = fn
+
+    def collect(self):
+        for name, collector in list(self._collectors.items()):
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics collector {name} failed: {e}")
+
+    def render(self):
+        self.collect()
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self, gauges=True):
+        """Every metric's values as JSON-friendly data (collectors are not run)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.snapshot() for m in metrics if gauges or m.kind != 'gauge'}
+
+    def merge(self, snapshot):
+        """Add a snapshot from another process to this registry"""
+        for name, data in snapshot.items():
+            if data['kind'] == 'histogram':
+                metric = self.histogram(name, data['help'], data['labelnames'], data['buckets'])
+            elif data['kind'] == 'gauge':
+                metric = self.gauge(name, data['help'], data['labelnames'], data.get('multiprocess', 'sum'))
+            else:
+                metric = self.counter(name, data['help'], data['labelnames'])
+            for key, value in data['values']:
+                metric.merge(tuple(key), value)
+
+
+REGISTRY = MetricsRegistry()
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)  # readers never see a partial file
+
+
+class ProcessMetricsWriter:
+    """
+    Publishes this worker's registry to directory/<pid>.json every interval
+    seconds for the master to merge (see MultiprocessMetrics). close()
+    writes a final snapshot so nothing counted after the last tick is lost.
+    """
+
+    def __init__(self, registry, directory, interval=5.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+        self._thread.start()
+
+    def after_fork(self):
+        self.start()
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        self.write(final=True)
+
+    def write(self, final=False):
+        self.registry.collect()
+        _write_json(os.path.join(self.directory, f"{os.getpid()}.json"),
+                    {'pid': os.getpid(), 'final': final, 'metrics': self.registry.snapshot()})
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                print(f"Metrics snapshot failed: {e}")
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MultiprocessMetrics:
+    """
+    The master's view: merges the workers' snapshots at scrape time.
+    Counters and histograms add up; gauges combine per their multiprocess
+    mode and only count live workers. A worker that exited has its
+    counters and histograms folded into dead.json, so totals never go
+    backwards when gunicorn replaces workers.
+    """
+
+    DEAD = 'dead.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Start from nothing; run by the master before it forks workers"""
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith('.json') or name.endswith('.tmp'):
+                os.remove(os.path.join(self.directory, name))
+
+    def _read(self, name):
+        try:
+            with open(os.path.join(self.directory, name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def render(self):
+        with self._lock:
+            dead = MetricsRegistry()
+            dead.merge(self._read(self.DEAD) or {})
+            live = []
+            exited = []
+            for name in sorted(os.listdir(self.directory)):
+                if not name.endswith('.json') or name == self.DEAD:
+                    continue
+                snapshot = self._read(name)
+                if snapshot is None:
+                    continue
+                if snapshot['final'] or not _process_alive(snapshot['pid']):
+                    dead.merge({k: v for k, v in snapshot['metrics'].items() if v['kind'] != 'gauge'})
+                    exited.append(name)
+                else:
+                    live.append(snapshot['metrics'])
+            if exited:
+                _write_json(os.path.join(self.directory, self.DEAD), dead.snapshot())
+                for name in exited:
+                    os.remove(os.path.join(self.directory, name))
+
+        merged = MetricsRegistry()
+        merged.merge(dead.snapshot())
+        for snapshot in live:
+            merged.merge(snapshot)
+        return merged.render()
+
+
+def start_metrics_server(port, render, host='0.0.0.0'):
+    """
+    Serve render() as GET /metrics on its own port, in a daemon thread.
+    Keeping it off the app port means the public Service never exposes it.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    print(f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+HTTP_REQUESTS = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Flask request latency until the response is returned.',
+    ('method', 'endpoint', 'status'))
+REQUEST_STAGE = REGISTRY.histogram(
+    'request_stage_duration_seconds',
+    'Time spent per stage: auth, nlp, rasa_http, db_query, db_commit, template_render.',
+    ('stage',))
+NLP_PREDICTIONS = REGISTRY.counter(
+    'nlp_predictions_total', 'Messages answered, by the backend that produced the answer.', ('backend',))
+NLP_LATENCY = REGISTRY.histogram(
+    'nlp_predict_duration_seconds', 'Single-message engine latency by the backend that answered.',
+    ('backend',))
+RASA_REQUESTS = REGISTRY.counter('rasa_requests_total', 'Rasa /model/parse calls by outcome.', ('outcome',))
+SLOW_REQUESTS = REGISTRY.counter(
+    'slow_requests_total', 'Requests slower than SLOW_REQUEST_PROFILE_MS.', ('endpoint',))
+
+
+@contextmanager
+def stage(name):
+    """Time a block into request_stage_duration_seconds"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        REQUEST_STAGE.observe(time.perf_counter() - start, stage=name)
+
+
+def nlp_served(backend, started=None, count=1):
+    """Count answers from an NLP backend; started (perf_counter) also records latency"""
+    NLP_PREDICTIONS.inc(count, backend=backend)
+    if started is not None:
+        NLP_LATENCY.observe(time.perf_counter() - started, backend=backend)
+
+
+class SlowRequestProfiler:
+    """
+    Samples the stacks of threads serving a request every interval_ms.
+    When a request finishes above threshold_ms its samples are written as
+    collapsed stacks ("frame;frame;frame count", the flamegraph.pl input
+    format) to output_dir; faster requests just drop theirs. The sampler
+    thread only exists in processes that serve requests and sleeps
+    while none are in flight.
+    """
+
+    def __init__(self, threshold_ms, interval_ms=5, output_dir='profiles', max_depth=64, max_files=200):
+        self.threshold = threshold_ms / 1000.0
+        self.interval = interval_ms / 1000.0
+        self.output_dir = output_dir
+        self.max_depth = max_depth
+        self.max_files = max_files
+        self.dumped = 0
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        # threads do not survive fork, so every worker starts its own
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name='slow-request-profiler', daemon=True)
+                    self._thread.start()
+
+    def begin(self):
+        self._ensure_thread()
+        with self._lock:
+            self._active[threading.get_ident()] = _Tally()
+        self._wake.set()
+
+    def end(self, label, duration):
+        """Stop sampling the current thread; True if the request was slow"""
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+            if not self._active:
+                self._wake.clear()
+        if samples is None or duration < self.threshold:
+            return False
+        if samples:  # requests shorter than one interval have nothing to show
+            try:
+                self._dump(label, duration, samples)
+            except OSError as e:
+                print(f"Could not write slow request profile: {e}")
+        return True
+
+    def _stack(self, frame):
+        frames = []
+        while frame is not None and len(frames) < self.max_depth:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(frames))
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[self._stack(frame)] += 1
+            del frames
+
+    def _dump(self, label, duration, samples):
+        with self._lock:
+            if self.dumped >= self.max_files:
+                return None
+            self.dumped += 1
+        os.makedirs(self.output_dir, exist_ok=True)
+        safe_label = ''.join(c if c.isalnum() or c in '._-' else '_' for c in label)[:80]
+        path = os.path.join(
+            self.output_dir,
+            f"{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{safe_label}_{int(duration * 1000)}ms.txt",
+        )
+        with open(path, 'w') as f:
+            f.write(f"# {label} took {duration * 1000:.1f} ms, {sum(samples.values())} samples "
+                    f"every {self.interval * 1000:g} ms\n")
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Slow request: {label} took {duration * 1000:.0f} ms, stacks written to {path}")
+        return path
+
+
+_db_listeners_installed = False
+
+
+def install_db_timing(engine):
+    """Time every statement on engine (db_query) and every session commit (db_commit)"""
+    global _db_listeners_installed
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_started'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop('query_started', None)
+        if started is not None:
+            REQUEST_STAGE.observe(time.perf_counter() - started, stage='db_query')
+
+    if _db_listeners_installed:
+        return
+    _db_listeners_installed = True
+
+    # Session events are global: they cover Flask-SQLAlchemy's scoped
+    # session as well as the sessions of background workers
+    @event.listens_for(Session, 'before_commit')
+    def before_commit(session):
+        session.info['commit_started'] = time.perf_counter()
+
+    @event.listens_for(Session, 'after_commit')
+    def after_commit(session):
+        started = session.info.pop('commit_started', None)
+        if started is not None:
+            REQUEST_STAGE.observe(time.perf_counter() - started, stage='db_commit')
+
+    @event.listens_for(Session, 'after_rollback')
+    def after_rollback(session):
+        session.info.pop('commit_started', None)
+
+
+def init_app(app):
+    """Request timing, template render timing, the optional slow-request profiler and gauges"""
+    from flask import before_render_template, g, request, template_rendered
+
+    profiler = None
+    if app.config['SLOW_REQUEST_PROFILE_MS'] > 0:
+        profiler = SlowRequestProfiler(
+            app.config['SLOW_REQUEST_PROFILE_MS'],
+            interval_ms=app.config['SLOW_REQUEST_SAMPLE_MS'],
+            output_dir=app.config['SLOW_REQUEST_PROFILE_DIR'],
+        )
+        app.extensions['slow_request_profiler'] = profiler
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        if profiler is not None:
+            profiler.begin()
+
+    @app.after_request
+    def note_status(response):
+        g.response_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(exc):
+        started = g.pop('request_started', None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        status = g.pop('response_status', 500 if exc is not None else 200)
+        HTTP_REQUESTS.observe(duration, method=request.method, endpoint=endpoint, status=status)
+        if profiler is not None and profiler.end(f"{request.method} {request.path}", duration):
+            SLOW_REQUESTS.inc(endpoint=endpoint)
+
+    def render_started(sender, template, context, **extra):
+        g.setdefault('render_started', []).append(time.perf_counter())
+
+    def render_finished(sender, template, context, **extra):
+        started = g.get('render_started')
+        if started:
+            REQUEST_STAGE.observe(time.perf_counter() - started.pop(), stage='template_render')
+
+    # blinker holds receivers weakly by default and these are closures
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+
+    with app.app_context():
+        from . import db
+        install_db_timing(db.engine)
+
+    REGISTRY.add_collector('runtime', _runtime_gauges(app))
+    # started per worker by serving.after_fork; the master serves the merge
+    app.extensions['metrics_writer'] = ProcessMetricsWriter(
+        REGISTRY, app.config['METRICS_MULTIPROC_DIR'], app.config['METRICS_WRITE_INTERVAL'])
+
+
+def _runtime_gauges(app):
+    from .rasa_integration import RasaNLPEngine
+
+    breaker_open = REGISTRY.gauge(
+        'rasa_circuit_open', '1 while no Rasa worker has a closed circuit breaker.', multiprocess='max')
+    rasa_available = REGISTRY.gauge(
+        'rasa_workers_available', 'Rasa workers whose circuit breaker is closed.', multiprocess='min')
+    rasa_outstanding = REGISTRY.gauge('rasa_worker_outstanding', 'Parse calls in flight per Rasa worker.', ('worker',))
+    cache_entries = REGISTRY.gauge('prediction_cache_entries', 'Entries in the prediction cache.')
+    cache_lookups = REGISTRY.gauge('prediction_cache_lookups', 'Prediction cache lookups since start.', ('result',))
+    resident = REGISTRY.gauge('model_registry_resident_bytes', 'Memory held by loaded models.')
+    log_queue = REGISTRY.gauge('interaction_log_queue_depth', 'Interaction logs waiting for the write-behind thread.')
+    training = REGISTRY.gauge('training_jobs_pending', 'Training jobs queued or running in this process.')
+
+    def runtime_gauges():
+        stats = RasaNLPEngine.stats()
+        breaker_open.set(0 if stats['rasa']['available'] else 1)
+        rasa_available.set(stats['rasa']['available'])
+        for backend in stats['rasa']['backends']:
+            rasa_outstanding.set(backend['outstanding'], worker=backend['url'])
+        cache_entries.set(stats['cache']['entries'])
+        cache_lookups.set(stats['cache']['hits'], result='hit')
+        cache_lookups.set(stats['cache']['misses'], result='miss')
+        resident.set(stats['models']['resident_bytes'])
+        log_queue.set(app.extensions['log_writer'].stats()['queued'])
+        training.set(app.extensions['training_jobs'].stats()['pending'])
+
+    return runtime_gauges
@@ -0,0 +1,215 @@
+"""
+Registry of trained local NLU models, one per bot or per template.
+
+Artifacts live under the registry root as ``<key>/<version>.npz`` where key
+is ``bot-<id>``, ``template-<name>`` or ``default``; a bot uses the most
+specific key that has an artifact. Loaded models stay resident in an LRU
+bounded by a byte budget. Publishing a new version replaces the resident
+entry by swapping a reference, so requests already holding the old model
+finish on it.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+
+DEFAULT_MODEL_KEY = 'default'
+_KEY_CHARS = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def bot_model_key(bot_id):
+    return f"bot-{bot_id}"
+
+
+def template_model_key(template):
+    return f"template-{_KEY_CHARS.sub('_', template)}"
+
+
+class ResidentModel:
+    __slots__ = ('key', 'version', 'model', 'nbytes')
+
+    def __init__(self, key, version, model, nbytes):
+        self.key = key
+        self.version = version
+        self.model = model
+        self.nbytes = nbytes
+
+
+class ModelRegistry:
+    """
+    Resolves bots to model keys and keeps the most recently used models in
+    memory within budget_bytes. Other processes' publishes are noticed by
+    re-listing a key's directory at most every poll_interval seconds.
+    """
+
+    def __init__(self, root, budget_bytes=256 * 1024 * 1024, poll_interval=5.0,
+                 versions_kept=3, default_loader=None):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.poll_interval = poll_interval
+        self.versions_kept = versions_kept
+        # builds the 'default' model when no artifact has been published for it
+        self.default_loader = default_loader
+        self.resident_bytes = 0
+        self._resident = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._load_locks = defaultdict(threading.Lock)
+        self._metrics = defaultdict(lambda: {
+            'hits': 0, 'loads': 0, 'load_ms': 0.0, 'evictions': 0, 'swaps': 0,
+            'predictions': 0, 'predict_ms': 0.0,
+        })
+
+    def _path(self, key, version):
+        return os.path.join(self.root, key, f"{version}.npz")
+
+    def _list_versions(self, key):
+        try:
+            names = os.listdir(os.path.join(self.root, key))
+        except OSError:
+            return []
+        return sorted(name[:-4] for name in names if name.endswith('.npz'))
+
+    def latest_version(self, key):
+        """Newest published version of key, re-read at most every poll_interval"""
+        now = time.monotonic()
+        cached = self._versions.get(key)
+        if cached is not None and now - cached[0] < self.poll_interval:
+            return cached[1]
+        versions = self._list_versions(key)
+        version = versions[-1] if versions else None
+        self._versions[key] = (now, version)
+        return version
+
+    def resolve(self, bot_id, template=None):
+        """Most specific model key with an artifact: bot, then template, then default"""
+        candidates = [bot_model_key(bot_id)] if bot_id is not None else []
+        if template:
+            candidates.append(template_model_key(template))
+        for key in candidates:
+            if self.latest_version(key) is not None:
+                return key
+        return DEFAULT_MODEL_KEY
+
+    def get(self, key):
+        """The resident model for key, loading it if needed; None if there is none"""
+        version = self.latest_version(key)
+        entry = self._lookup(key, version)
+        if entry is not None:
+            return entry
+
+        # one loader per key; other keys keep being served meanwhile
+        with self._load_locks[key]:
+            entry = self._lookup(key, version)
+            if entry is not None:
+                return entry
+            start = time.perf_counter()
+            model = self._load(key, version)
+            if model is None:
+                return None
+            elapsed = (time.perf_counter() - start) * 1000
+            metrics = self._metrics[key]
+            metrics['loads'] += 1
+            metrics['load_ms'] += elapsed
+            print(f"Loaded model {key}@{version or 'builtin'} in {elapsed:.1f} ms")
+            return self._install(key, version, model)
+
+    def _lookup(self, key, version):
+        with self._lock:
+            entry = self._resident.get(key)
+            if entry is None or (version is not None and entry.version != version):
+                return None
+            self._resident.move_to_end(key)
+            self._metrics[key]['hits'] += 1
+            return entry
+
+    def _load(self, key, version):
+        from .local_classifier import LocalIntentClassifier
+        if version is not None:
+            return LocalIntentClassifier.load(self._path(key, version))
+        if key == DEFAULT_MODEL_KEY and self.default_loader is not None:
+            return self.default_loader()
+        return None
+
+    def _install(self, key, version, model):
+        entry = ResidentModel(key, version, model, model.nbytes)
+        with self._lock:
+            previous = self._resident.pop(key, None)
+            if previous is not None:
+                self.resident_bytes -= previous.nbytes
+                self._metrics[key]['swaps'] += 1
+            self._resident[key] = entry
+            self.resident_bytes += entry.nbytes
+            # never evict the entry just installed, even if it alone is over budget
+            while self.resident_bytes > self.budget_bytes and len(self._resident) > 1:
+                evicted_key, evicted = self._resident.popitem(last=False)
+                self.resident_bytes -= evicted.nbytes
+                self._metrics[evicted_key]['evictions'] += 1
+        return entry
+
+    @staticmethod
+    def new_version():
+        return datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+
+    def publish(self, key, model, version=None):
+        """
+        Save model as a new version of key and make it the resident one.
+        The file is written under a temporary name and renamed into place,
+        so readers never see a partial artifact.
+        """
+        version = version or self.new_version()
+        path = self._path(key, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        model.save(tmp_path)
+        os.replace(tmp_path, path)
+
+        for old in self._list_versions(key)[:-self.versions_kept]:
+            try:
+                os.remove(self._path(key, old))
+            except OSError:
+                pass
+
+        self._versions[key] = (time.monotonic(), version)
+        self._install(key, version, model)
+        return version
+
+    def predict_batch(self, key, messages):
+        """
+        (model, [(intent, confidence)]) from key's current model, or None when
+        it has none. The model is returned so callers use the same version
+        for everything else they need from it.
+        """
+        entry = self.get(key)
+        if entry is None:
+            return None
+        start = time.perf_counter()
+        results = entry.model.predict_batch(messages)
+        metrics = self._metrics[key]
+        metrics['predictions'] += len(messages)
+        metrics['predict_ms'] += (time.perf_counter() - start) * 1000
+        return entry.model, results
+
+    def stats(self):
+        with self._lock:
+            resident = [
+                {'key': e.key, 'version': e.version, 'bytes': e.nbytes}
+                for e in reversed(self._resident.values())
+            ]
+            metrics = {key: dict(values) for key, values in self._metrics.items()}
+        for values in metrics.values():
+            values['avg_load_ms'] = round(values['load_ms'] / values['loads'], 3) if values['loads'] else 0
+            values['avg_predict_ms'] = (
+                round(values['predict_ms'] / values['predictions'], 4) if values['predictions'] else 0
+            )
+            values['load_ms'] = round(values['load_ms'], 3)
+            values['predict_ms'] = round(values['predict_ms'], 3)
+        return {
+            'root': self.root,
+            'budget_bytes': self.budget_bytes,
+            'resident_bytes': self.resident_bytes,
+            'resident': resident,
+            'models': metrics,
+        }
@@ -21,6 +21,7 @@ class Chatbot(db.Model):
     template = db.Column(db.String(50))
     config_file = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    rollups_rebuilt_at = db.Column(db.DateTime)  # part of the analytics page's cache validator
 
 class InteractionLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -29,3 +30,79 @@ class InteractionLog(db.Model):
     bot_response = db.Column(db.String(500))
     intent = db.Column(db.String(50))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_interaction_log_bot_id_timestamp', 'bot_id', 'timestamp'),
+        db.Index('ix_interaction_log_bot_id_id', 'bot_id', 'id'),  # keyset export/training pages
+        db.Index('ix_interaction_log_intent', 'intent'),
+    )
+
+class BotStats(db.Model):
+    """Per-bot counters kept in step with InteractionLog inserts"""
+    bot_id = db.Column(db.Integer, db.ForeignKey('chatbot.id'), primary_key=True)
+    interaction_count = db.Column(db.Integer, nullable=False, default=0)
+    last_interaction_at = db.Column(db.DateTime)
+
+class IntentRollup(db.Model):
+    """Interaction counts per bot, intent and hour/day bucket"""
+    id = db.Column(db.Integer, primary_key=True)
+    bot_id = db.Column(db.Integer, db.ForeignKey('chatbot.id'), nullable=False)
+    granularity = db.Column(db.String(4), nullable=False)  # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    intent = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('bot_id', 'granularity', 'bucket_start', 'intent', name='uq_intent_rollup_bucket'),
+    )
+
+class TrainingJob(db.Model):
+    """A background training or dataset import run for one bot; status is polled by the UI"""
+    id = db.Column(db.Integer, primary_key=True)
+    bot_id = db.Column(db.Integer, db.ForeignKey('chatbot.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False, default='train', server_default='train')  # or 'import'
+    source = db.Column(db.String(300))  # uploaded file for imports
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    progress = db.Column(db.Integer, nullable=False, default=0)  # percent
+    message = db.Column(db.String(500))
+    fingerprint = db.Column(db.String(64))  # sha256 of the training inputs
+    model_version = db.Column(db.String(40))
+    examples = db.Column(db.Integer)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_training_job_bot_id_id', 'bot_id', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'bot_id': self.bot_id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'model_version': self.model_version,
+            'examples': self.examples,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+class TrainingExample(db.Model):
+    """Labelled examples imported from uploaded datasets, unique per bot and content"""
+    id = db.Column(db.Integer, primary_key=True)
+    bot_id = db.Column(db.Integer, db.ForeignKey('chatbot.id'), nullable=False)
+    intent = db.Column(db.String(50), nullable=False)
+    message = db.Column(db.String(500), nullable=False)
+    response = db.Column(db.String(500))
+    content_hash = db.Column(db.String(64), nullable=False)  # sha256 of intent + normalized message
+    source = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('bot_id', 'content_hash', name='uq_training_example_hash'),
+    )
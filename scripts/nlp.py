@@ -1,38 +1,134 @@
+import os
+import re
+
+import yaml
+
+from .responses import WatchedResponseCatalog
+
+RASA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'rasa_project'))
+TOKEN_RE = re.compile(r"\w+")
+
+# Used when rasa_project/ cannot be read; same rules the engine always had
+DEFAULT_INTENTS = ('greet', 'goodbye', 'info', 'purchase', 'health')
+DEFAULT_KEYWORDS = {
+    'greet': ['hello', 'hi', 'hey'],
+    'goodbye': ['bye', 'goodbye'],
+    'info': ['info', 'help'],
+    'purchase': ['buy', 'purchase'],
+    'health': ['doctor', 'health'],
+}
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class KeywordIntentIndex:
+    """
+    Token trie over keyword phrases. Matching walks the trie from every
+    token position, so cost depends on message length and the longest
+    phrase only, not on how many intents or keywords are loaded.
+    The longest matching phrase wins; ties go to the earlier intent.
+    """
+    _END = object()
+
+    def __init__(self, phrases, intent_order=()):
+        self.priority = {intent: i for i, intent in enumerate(intent_order)}
+        self.root = {}
+        self.max_depth = 0
+        self.size = 0
+        for intent, phrase in phrases:
+            tokens = tokenize(phrase)
+            if not tokens:
+                continue
+            self.priority.setdefault(intent, len(self.priority))
+            node = self.root
+            for token in tokens:
+                node = node.setdefault(token, {})
+            # keep the first (highest priority) intent registered for a phrase
+            if self._END not in node or self.priority[intent] < self.priority[node[self._END]]:
+                node[self._END] = intent
+            self.max_depth = max(self.max_depth, len(tokens))
+            self.size += 1
+
+    def match(self, message):
+        tokens = tokenize(message)
+        best = None
+        best_key = None
+        for start in range(len(tokens)):
+            node = self.root
+            for offset in range(start, min(len(tokens), start + self.max_depth)):
+                node = node.get(tokens[offset])
+                if node is None:
+                    break
+                intent = node.get(self._END)
+                if intent is not None:
+                    key = (offset - start + 1, -self.priority[intent])
+                    if best_key is None or key > best_key:
+                        best, best_key = intent, key
+        return best
+
+
+def load_rasa_project(rasa_dir=RASA_DIR):
+    """Read intents and keyword phrases from domain.yml / nlu.yml"""
+    with open(os.path.join(rasa_dir, 'domain.yml'), encoding='utf-8') as f:
+        domain = yaml.safe_load(f) or {}
+    with open(os.path.join(rasa_dir, 'data', 'nlu.yml'), encoding='utf-8') as f:
+        nlu = yaml.safe_load(f) or {}
+
+    intents = [i for i in domain.get('intents', []) if isinstance(i, str)]
+
+    phrases = []
+    for block in nlu.get('nlu', []):
+        intent = block.get('intent')
+        if not intent:
+            continue
+        for line in (block.get('examples') or '').splitlines():
+            line = line.strip()
+            if line.startswith('- '):
+                phrases.append((intent, line[2:]))
+
+    return intents, phrases
+
+
+def build_engine_tables(rasa_dir=RASA_DIR):
+    """Compile the keyword index and the watched response catalog"""
+    try:
+        intents, phrases = load_rasa_project(rasa_dir)
+    except (OSError, yaml.YAMLError) as e:
+        print(f"Could not load Rasa project data ({e}), using built-in keywords")
+        intents, phrases = list(DEFAULT_INTENTS), []
+
+    # the original keyword rules stay in the index as single-word phrases
+    phrases = phrases + [(i, kw) for i, kws in DEFAULT_KEYWORDS.items() for kw in kws]
+    index = KeywordIntentIndex(phrases, intents or DEFAULT_INTENTS)
+
+    catalog = WatchedResponseCatalog(
+        os.path.join(rasa_dir, 'domain.yml'),
+        known_intents=index.priority,  # nlu.yml intents missing from the domain still split utter_ names
+        poll_interval=float(os.environ.get('RESPONSE_CATALOG_POLL', '2')),
+    )
+    return index, catalog
+
+
+INTENT_INDEX, response_catalog = build_engine_tables()
+
+
 class SimpleNLPEngine:
     @staticmethod
     def predict_intent(message, personality='friendly'):
-        message_lower = message.lower()
-
-        responses = {
-            'greet': {
-                'friendly': 'Hello! How can I help? 😊',
-                'professional': 'Hello! How may I assist you today?',
-                'casual': 'Hey! What\'s up? 😎',
-                'formal': 'Good day! How may I be of service?',
-                'humorous': 'Hello! I\'m your friendly AI overlord! 😄',
-                'empathetic': 'Hi there! I\'m here for you! ❤️',
-            },
-            'goodbye': {
-                'friendly': 'Goodbye! Have a great day! 👋',
-                'professional': 'Thank you. Goodbye.',
-                'casual': 'Catch ya later! ✌️',
-                'formal': 'Farewell. Have a pleasant day.',
-                'humorous': 'Bye! Don\'t forget to feed your robot! 🤖',
-                'empathetic': 'Take care! I\'m always here if you need me! 💕',
-            },
-            'info': 'This is a demo chatbot powered by AI Chatbot Management System.',
-            'purchase': 'You can buy products from our store! 🛒',
-            'health': 'Please consult a healthcare professional. 🩺',
-        }
-
-        if any(word in message_lower for word in ['hello', 'hi', 'hey']):
-            return 'greet', responses['greet'].get(personality, responses['greet']['friendly'])
-        elif 'bye' in message_lower:
-            return 'goodbye', responses['goodbye'].get(personality, responses['goodbye']['friendly'])
-        elif 'info' in message_lower or 'help' in message_lower:
-            return 'info', responses['info']
-        elif 'buy' in message_lower or 'purchase' in message_lower:
-            return 'purchase', responses['purchase']
-        elif 'doctor' in message_lower or 'health' in message_lower:
-            return 'health', responses['health']
-        return 'unknown', 'Sorry, I did not understand. 😅'
+        intent = INTENT_INDEX.match(message) or 'unknown'
+        return intent, response_catalog.response_for(intent, personality)
+
+    @staticmethod
+    def response_for(intent, personality='friendly'):
+        return response_catalog.response_for(intent, personality)
+
+    @staticmethod
+    def predict_intents(messages, personality='friendly'):
+        catalog = response_catalog.current()
+        results = []
+        for m in messages:
+            intent = INTENT_INDEX.match(m) or 'unknown'
+            results.append((intent, catalog.response_for(intent, personality)))
+        return results
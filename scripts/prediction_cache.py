@@ -0,0 +1,159 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_message(text):
+    """Lowercase, collapse whitespace and drop surrounding punctuation"""
+    return ' '.join(text.lower().split()).strip(' .,!?')
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache with a per-entry TTL for (intent, response) results.
+    Keys are tuples built by the caller; a max_entries of 0 disables it.
+    """
+
+    def __init__(self, max_entries=10000, ttl=3600, max_key_length=200):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_key_length = max_key_length
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cacheable(self, text):
+        return self.max_entries > 0 and len(text) <= self.max_key_length
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+class TieredPredictionCache:
+    """
+    A PredictionCache for this process in front of the shared state, so a
+    replica that just started answers from what the others already
+    learned. Lookups try the local tier, then fetch all local misses from
+    the shared tier in one round trip (filling the local tier); writes go
+    to both. Shared entries live ttl minus up to `jitter` of it, so
+    entries written together do not all expire together. Keys are
+    (normalized, kind, generation, model) and only keys with a known model
+    are shared, since generations are per process.
+    """
+
+    def __init__(self, local, state=None, prefix='pred', jitter=0.1):
+        self.local = local
+        self.state = state
+        self.prefix = prefix
+        self.jitter = jitter
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    def cacheable(self, text):
+        return self.local.cacheable(text)
+
+    def shared_key(self, key):
+        if self.state is None or key is None or key[-1] is None:
+            return None
+        normalized, kind = key[0], key[1]
+        return f"{self.prefix}:{kind}:{key[-1]}:{normalized}"
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        """Cached value per key (None for misses and None keys)"""
+        values = [self.local.get(key) if key is not None else None for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None and keys[i] is not None]
+        if missing:
+            for i, value in zip(missing, self.get_shared([keys[i] for i in missing])):
+                values[i] = value
+        return values
+
+    def get_shared(self, keys):
+        """Shared-tier lookup only; hits are copied into the local tier"""
+        shared = [(key, self.shared_key(key)) for key in keys]
+        wanted = [(key, name) for key, name in shared if name is not None]
+        if not wanted:
+            return [None] * len(keys)
+        found = dict(zip([key for key, _ in wanted], self.state.get_many([name for _, name in wanted])))
+        values = []
+        for key, _ in shared:
+            value = found.get(key)
+            if value is not None:
+                self.local.set(key, value)
+                self.shared_hits += 1
+            elif key in found:
+                self.shared_misses += 1
+            values.append(value)
+        return values
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        for key, value in items.items():
+            self.local.set(key, value)
+        shared = {self.shared_key(key): value for key, value in items.items() if self.shared_key(key)}
+        if shared:
+            ttl = self.local.ttl * (1 - self.jitter * random.random())
+            self.state.set_many(shared, ttl)
+
+    def clear(self):
+        """Local tier only: shared entries are keyed by model and age out"""
+        self.local.clear()
+
+    def stats(self):
+        stats = self.local.stats()
+        stats['shared'] = self.state is not None
+        stats['shared_hits'] = self.shared_hits
+        stats['shared_misses'] = self.shared_misses
+        return stats
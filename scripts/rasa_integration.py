@@ -1,98 +1,663 @@
 import requests
+from requests.adapters import HTTPAdapter
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import time
 import os
 
-RASA_SERVER_URL = "http://localhost:5005"
+from .metrics import RASA_REQUESTS, REQUEST_STAGE, nlp_served
+from .model_registry import DEFAULT_MODEL_KEY, ModelRegistry
+from .prediction_cache import PredictionCache, TieredPredictionCache, normalize_message
+from .shared_state import SingleFlight, shared_state
+
+# one URL, or several comma separated for a pool of Rasa workers (see rasa_supervisor.py)
+RASA_SERVER_URL = os.environ.get("RASA_SERVER_URL", "http://localhost:5005")
+
+# 'fallback': local classifier only when Rasa is down; 'first': answer locally
+# when confidence >= LOCAL_NLU_ACCEPT and escalate the rest to Rasa; 'off'
+LOCAL_NLU_TIER = os.environ.get("LOCAL_NLU_TIER", "fallback")
+LOCAL_NLU_ACCEPT = float(os.environ.get("LOCAL_NLU_ACCEPT", "0.6"))
+LOCAL_NLU_MIN_CONFIDENCE = float(os.environ.get("LOCAL_NLU_MIN_CONFIDENCE", "0.3"))
+
+
+class RasaUnavailable(Exception):
+    """Raised when the circuit breaker is open and Rasa is not called"""
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker for the Rasa server.
+    While open, calls are rejected immediately; once reset_timeout has
+    elapsed a single probe is allowed through to decide whether to close.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            self.rejected += 1
+            return False
+
+    def probe_due(self):
+        """Move to half-open and return True if the caller should probe"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return False
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state == self.CLOSED:
+                    self.trips += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = 0.0
+            if self.state == self.OPEN:
+                retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'trips': self.trips,
+                'rejected': self.rejected,
+                'retry_in': round(retry_in, 3),
+            }
+
+
+def rasa_server_urls(value):
+    """'http://a:5005,http://a:5006' -> list of base URLs"""
+    return [url.strip().rstrip('/') for url in value.split(',') if url.strip()]
+
+
+class RasaBackend:
+    """One Rasa worker as seen by a client: its breaker and in-flight count"""
+
+    def __init__(self, url, failure_threshold=3, reset_timeout=10.0):
+        self.url = url
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.outstanding = 0
+        self.requests_sent = 0
+        self.failures = 0
+        self.model_file = None  # as last reported by its /status
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'model_file': self.model_file,
+            'outstanding': self.outstanding,
+            'requests_sent': self.requests_sent,
+            'failures': self.failures,
+            'breaker': self.breaker.snapshot(),
+        }
+
+
+class LeastOutstandingBalancer:
+    """
+    Picks the backend with the fewest requests in flight among those
+    whose breaker is closed; ties rotate so idle workers share the load.
+    """
+
+    def __init__(self, urls, failure_threshold=3, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._next = 0
+        self.backends = []
+        self.set_urls(urls)
+
+    def set_urls(self, urls):
+        """Replace the backend list, keeping state for URLs already known"""
+        with self._lock:
+            known = {b.url: b for b in self.backends}
+            self.backends = [
+                known.get(url) or RasaBackend(url, self.failure_threshold, self.reset_timeout)
+                for url in urls
+            ]
+
+    def acquire(self, exclude=None):
+        """Reserve a backend for one request, or None when none is available"""
+        with self._lock:
+            candidates = [
+                b for b in self.backends
+                if b is not exclude and b.breaker.state == CircuitBreaker.CLOSED
+            ]
+            if not candidates:
+                return None
+            self._next += 1
+            n = len(candidates)
+            best = min(range(n), key=lambda i: (candidates[i].outstanding, (i - self._next) % n))
+            backend = candidates[best]
+            backend.outstanding += 1
+            backend.requests_sent += 1
+            return backend
+
+    def release(self, backend):
+        with self._lock:
+            backend.outstanding -= 1
+
+    def available(self):
+        return any(b.breaker.state == CircuitBreaker.CLOSED for b in self.backends)
+
+    def reset_outstanding(self):
+        with self._lock:
+            for backend in self.backends:
+                backend.outstanding = 0
+
+
+class RasaClient:
+    """
+    Keep-alive HTTP client for one or more Rasa workers.
+    Each /model/parse goes to the worker with the fewest requests in
+    flight. Health is learned per worker from real calls; a worker whose
+    breaker is open gets a half-open /status probe on a background thread,
+    so no chat request waits on a dead server. The loaded model is polled
+    the same way, at most every model_poll seconds, so a worker that
+    switches models is noticed even while every answer is a cache hit.
+    """
+
+    def __init__(self, base_urls, pool_size=10, connect_timeout=0.5, read_timeout=5,
+                 failure_threshold=3, reset_timeout=10.0, model_poll=10.0):
+        if isinstance(base_urls, str):
+            base_urls = rasa_server_urls(base_urls)
+        self.timeout = (connect_timeout, read_timeout)
+        self.balancer = LeastOutstandingBalancer(base_urls, failure_threshold, reset_timeout)
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=max(1, len(base_urls)), pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+        self._probe_lock = threading.Lock()
+        self.rejected = 0
+        self.model_file = None
+        self.on_model_change = None
+        self.model_poll = model_poll
+        self._model_checked = None
+        self._model_lock = threading.Lock()
+
+    @property
+    def backends(self):
+        return self.balancer.backends
+
+    def set_backends(self, urls):
+        """Point the client at a new set of workers (e.g. from RasaSupervisor)"""
+        self.balancer.set_urls([url.rstrip('/') for url in urls])
+
+    def available(self):
+        """True if at least one worker's breaker is closed"""
+        if self.balancer.available():
+            return True
+        self.rejected += 1
+        self._maybe_probe()
+        return False
+
+    def after_fork(self):
+        """Drop pooled sockets inherited from the parent process"""
+        self.session.close()
+        self.balancer.reset_outstanding()
+        self._model_lock = threading.Lock()
+
+    def status(self, timeout=2):
+        """Return the /status payload of the first worker that answers, or None"""
+        ordered = sorted(self.backends, key=lambda b: b.breaker.state != CircuitBreaker.CLOSED)
+        for backend in ordered:
+            payload = self._status(backend, timeout)
+            if payload is not None:
+                return payload
+        return None
+
+    def _status(self, backend, timeout=2):
+        try:
+            response = self.session.get(f"{backend.url}/status", timeout=(self.timeout[0], timeout))
+            if response.status_code == 200:
+                payload = response.json()
+                backend.model_file = payload.get('model_file') or backend.model_file
+                self._observe_model()
+                return payload
+        except (requests.RequestException, ValueError):
+            pass
+        return None
+
+    def _observe_model(self):
+        """The model most workers report is the client's; a change drops cached predictions"""
+        reported = [b.model_file for b in self.backends if b.model_file]
+        if not reported:
+            return
+        model_file = max(sorted(set(reported)), key=reported.count)
+        previous, self.model_file = self.model_file, model_file
+        if previous and previous != model_file and self.on_model_change:
+            self.on_model_change(previous, model_file)
+
+    def refresh_model(self, timeout=2):
+        """Ask every worker with a closed breaker which model it serves"""
+        self._model_checked = time.monotonic()
+        for backend in list(self.backends):
+            if backend.breaker.state == CircuitBreaker.CLOSED:
+                self._status(backend, timeout)
+
+    def maybe_refresh_model(self):
+        """Start a background refresh_model if the last one is model_poll seconds old"""
+        if self.model_poll <= 0:
+            return
+        now = time.monotonic()
+        checked = self._model_checked
+        if checked is not None and now - checked < self.model_poll:
+            return
+        with self._model_lock:
+            if self._model_checked is not None and now - self._model_checked < self.model_poll:
+                return
+            self._model_checked = now
+        threading.Thread(target=self.refresh_model, name='rasa-model-poll', daemon=True).start()
+
+    def parse(self, text):
+        """POST /model/parse to the least busy worker and return the JSON body"""
+        self._maybe_probe()
+        backend = self.balancer.acquire()
+        if backend is None:
+            self.rejected += 1
+            raise RasaUnavailable(f"no Rasa worker available among {len(self.backends)}")
+        try:
+            return self._parse_on(backend, text)
+        except requests.ConnectionError:
+            # refused or reset: that worker is down or restarting, so one
+            # retry on another worker costs little
+            retry = self.balancer.acquire(exclude=backend)
+            if retry is None:
+                raise
+            return self._parse_on(retry, text)
+
+    def _parse_on(self, backend, text):
+        started = time.perf_counter()
+        try:
+            response = self.session.post(
+                f"{backend.url}/model/parse",
+                json={"text": text},
+                timeout=self.timeout,
+            )
+            if response.status_code != 200:
+                raise requests.HTTPError(f"Rasa API error {response.status_code}")
+            data = response.json()
+        except Exception:
+            backend.failures += 1
+            backend.breaker.record_failure()
+            RASA_REQUESTS.inc(outcome='error')
+            raise
+        finally:
+            self.balancer.release(backend)
+            REQUEST_STAGE.observe(time.perf_counter() - started, stage='rasa_http')
+        backend.breaker.record_success()
+        RASA_REQUESTS.inc(outcome='ok')
+        return data
+
+    def _maybe_probe(self):
+        for backend in self.backends:
+            if backend.breaker.state == CircuitBreaker.OPEN and backend.breaker.probe_due():
+                threading.Thread(target=self._probe, args=(backend,), name='rasa-health-probe', daemon=True).start()
+
+    def _probe(self, backend):
+        with self._probe_lock:
+            if self._status(backend) is not None:
+                backend.breaker.record_success()
+            else:
+                backend.breaker.record_failure()
+
+    def pool_stats(self):
+        pools = []
+        manager = self._adapter.poolmanager
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                'host': f"{pool.scheme}://{pool.host}:{pool.port}",
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'maxsize': pool.pool.maxsize if pool.pool is not None else 0,
+            })
+        return pools
+
+    def stats(self):
+        backends = [b.stats() for b in self.backends]
+        return {
+            'urls': [b['url'] for b in backends],
+            'model_file': self.model_file,
+            'available': sum(b['breaker']['state'] == CircuitBreaker.CLOSED for b in backends),
+            'requests_sent': sum(b['requests_sent'] for b in backends),
+            'failures': sum(b['failures'] for b in backends),
+            'rejected': self.rejected,
+            'backends': backends,
+            'pools': self.pool_stats(),
+        }
+
+
+rasa_client = RasaClient(RASA_SERVER_URL, model_poll=float(os.environ.get('RASA_MODEL_POLL', '10')))
+
+# with a networked SHARED_STATE_URL, replicas share their cached predictions
+prediction_cache = TieredPredictionCache(
+    PredictionCache(
+        max_entries=int(os.environ.get('PREDICTION_CACHE_SIZE', '10000')),
+        ttl=float(os.environ.get('PREDICTION_CACHE_TTL', '3600')),
+    ),
+    state=shared_state if shared_state.name != 'local' else None,
+    jitter=float(os.environ.get('PREDICTION_CACHE_JITTER', '0.1')),
+)
+parse_flight = SingleFlight()
+
+def _default_local_model():
+    from .local_classifier import get_local_classifier
+    return get_local_classifier()
+
+model_registry = ModelRegistry(
+    os.environ.get('MODEL_REGISTRY_DIR', os.path.join('instance', 'models')),
+    budget_bytes=int(float(os.environ.get('MODEL_MEMORY_BUDGET_MB', '256')) * 1024 * 1024),
+    poll_interval=float(os.environ.get('MODEL_REGISTRY_POLL', '5')),
+    default_loader=_default_local_model,
+)
+
+rasa_client.on_model_change = lambda previous, current: RasaNLPEngine.invalidate_cache()
+
+# Rasa 3 has no batch parse endpoint, so batches fan out over the pool
+_parse_executor = ThreadPoolExecutor(max_workers=10, thread_name_prefix='rasa-parse')
+
 
 class RasaNLPEngine:
     """Rasa AI integration for intent prediction"""
+
+    # bumped whenever a new model is trained or the server reports one
+    model_generation = 0
     
     @staticmethod
     def is_rasa_running():
         """Check if Rasa server is running"""
-        try:
-            response = requests.get(f"{RASA_SERVER_URL}/status", timeout=2)
-            return response.status_code == 200
-        except:
-            return False
+        return rasa_client.status() is not None
+
+    @staticmethod
+    def stats():
+        """Breaker state and connection pool counters for /nlp/status"""
+        return {
+            'rasa': rasa_client.stats(),
+            'model_generation': RasaNLPEngine.model_generation,
+            'cache': prediction_cache.stats(),
+            'coalesced_parses': parse_flight.shared,
+            'shared_state': shared_state.stats(),
+            'models': model_registry.stats(),
+            'responses': RasaNLPEngine._response_catalog().stats(),
+        }
+
+    @staticmethod
+    def _response_catalog():
+        from .nlp import response_catalog
+        return response_catalog
+
+    @staticmethod
+    def invalidate_cache():
+        """Drop cached predictions made by the previous model"""
+        RasaNLPEngine.model_generation += 1
+        prediction_cache.clear()
     
     @staticmethod
-    def predict_intent(message, personality='friendly'):
+    def cache_key(message):
         """
-        Send message to Rasa and get intent + response
-        Falls back to simple NLP if Rasa is not running
+        Prediction cache key, or None when the message is not cacheable.
+        Only the intent is cached, so one entry serves every personality
+        and response texts always come from the current catalog. The model
+        file, once Rasa has reported it, lets other replicas share the entry.
         """
-        if not RasaNLPEngine.is_rasa_running():
-            # Fallback to simple NLP
-            from .nlp import SimpleNLPEngine
-            return SimpleNLPEngine.predict_intent(message, personality)
-        
-        try:
-            # Call Rasa REST API
-            response = requests.post(
-                f"{RASA_SERVER_URL}/model/parse",
-                json={"text": message},
-                timeout=5
-            )
-            
-            if response.status_code != 200:
-                raise Exception("Rasa API error")
-            
-            data = response.json()
+        rasa_client.maybe_refresh_model()
+        normalized = normalize_message(message)
+        if prediction_cache.cacheable(normalized):
+            return (normalized, 'rasa', RasaNLPEngine.model_generation, rasa_client.model_file)
+        return None
+
+    @staticmethod
+    def _rasa_intent(message, cache_key=None, remember=True):
+        """
+        Rasa's intent for message, or None when Rasa is unavailable or failed.
+        Concurrent calls for the same cache key share one parse, whose
+        answer is cached unless remember is False (the caller batches it).
+        """
+        def parse():
+            try:
+                # Call Rasa REST API (raises RasaUnavailable while the breaker is open)
+                data = rasa_client.parse(message)
+            except RasaUnavailable:
+                return None
+            except Exception as e:
+                print(f"Rasa error: {e}, falling back to local NLU")
+                return None
             intent = data.get('intent', {}).get('name', 'unknown')
-            confidence = data.get('intent', {}).get('confidence', 0)
-            
-            # Map intent to personality-specific response
-            response_key = f"utter_{intent}_{personality}"
-            
-            # Get response from Rasa (if available) or use default
-            bot_response = RasaNLPEngine._get_response(intent, personality)
-            
-            return intent, bot_response
-            
-        except Exception as e:
-            print(f"Rasa error: {e}, falling back to SimpleNLP")
-            from .nlp import SimpleNLPEngine
-            return SimpleNLPEngine.predict_intent(message, personality)
+            if cache_key is not None and remember:
+                prediction_cache.set(cache_key, intent)
+            return intent
+
+        if cache_key is None:
+            return parse()
+        return parse_flight.do(cache_key, parse)
     
+    @staticmethod
+    def model_for(bot_id, template=None):
+        """Registry key of the model serving a bot ('default' means Rasa)"""
+        return model_registry.resolve(bot_id, template)
+
+    @staticmethod
+    def local_classifier():
+        """The default in-process classifier, or None when disabled or numpy is missing"""
+        if LOCAL_NLU_TIER == 'off':
+            return None
+        try:
+            entry = model_registry.get(DEFAULT_MODEL_KEY)
+        except ImportError:
+            return None
+        return entry.model if entry is not None else None
+
+    @staticmethod
+    def _bot_model_predictions(messages, personality, model_key):
+        """
+        (intent, response) per message from a bot's or template's own model,
+        None where it is not confident enough and the default path should answer
+        """
+        from .nlp import response_catalog
+        try:
+            predicted = model_registry.predict_batch(model_key, messages)
+        except ImportError:
+            predicted = None
+        if predicted is None:
+            return [None] * len(messages)
+
+        model, results = predicted
+        catalog = response_catalog.current()
+        predictions = []
+        for intent, confidence in results:
+            if confidence < LOCAL_NLU_MIN_CONFIDENCE:
+                predictions.append(None)
+            elif intent not in catalog and intent in model.responses:
+                predictions.append((intent, model.responses[intent]))
+            else:
+                predictions.append((intent, catalog.response_for(intent, personality)))
+        return predictions
+
+    @staticmethod
+    def _fallback(message, personality, local=None, started=None):
+        """Local classifier answer when confident enough, else keyword rules"""
+        from .nlp import SimpleNLPEngine
+        classifier = RasaNLPEngine.local_classifier()
+        if classifier is not None:
+            intent, confidence = local or classifier.predict(message)
+            if confidence >= LOCAL_NLU_MIN_CONFIDENCE:
+                nlp_served('local', started)
+                return intent, SimpleNLPEngine.response_for(intent, personality)
+        prediction = SimpleNLPEngine.predict_intent(message, personality)
+        nlp_served('keyword', started)
+        return prediction
+
+    @staticmethod
+    def predict_intent(message, personality='friendly', model_key=None):
+        """
+        Send message to Rasa and get intent + response
+        Bots with their own model (model_key) are answered by it first
+        Falls back to the local classifier / simple NLP if Rasa is not running
+        Only Rasa answers are cached, so fallbacks never outlive an outage
+        """
+        started = time.perf_counter()
+        if model_key is not None and model_key != DEFAULT_MODEL_KEY:
+            prediction = RasaNLPEngine._bot_model_predictions([message], personality, model_key)[0]
+            if prediction is not None:
+                nlp_served('bot_model', started)
+                return prediction
+
+        local = None
+        if LOCAL_NLU_TIER == 'first':
+            classifier = RasaNLPEngine.local_classifier()
+            if classifier is not None:
+                local = classifier.predict(message)
+                if local[1] >= LOCAL_NLU_ACCEPT:
+                    from .nlp import SimpleNLPEngine
+                    nlp_served('local', started)
+                    return local[0], SimpleNLPEngine.response_for(local[0], personality)
+
+        cache_key = RasaNLPEngine.cache_key(message)
+        if cache_key is not None:
+            intent = prediction_cache.get(cache_key)
+            if intent is not None:
+                nlp_served('cache', started)
+                return intent, RasaNLPEngine._get_response(intent, personality)
+
+        intent = RasaNLPEngine._rasa_intent(message, cache_key)
+        if intent is None:
+            return RasaNLPEngine._fallback(message, personality, local, started)
+
+        # Map intent to personality-specific response (utter_<intent>_<personality>)
+        nlp_served('rasa', started)
+        return intent, RasaNLPEngine._get_response(intent, personality)
+    
+    @staticmethod
+    def predict_intents(messages, personality='friendly', model_key=None):
+        """
+        Predict a list of messages, returning (intent, response) tuples
+        in the same order. The cache is read and written once for the whole
+        list and the misses are parsed concurrently over the keep-alive pool.
+        While the breaker is open the local classifier scores the whole list
+        in one batched pass.
+        """
+        if not messages:
+            return []
+        if model_key is not None and model_key != DEFAULT_MODEL_KEY:
+            results = RasaNLPEngine._bot_model_predictions(messages, personality, model_key)
+            pending = [i for i, result in enumerate(results) if result is None]
+            nlp_served('bot_model', count=len(messages) - len(pending))
+            if pending:
+                rest = RasaNLPEngine.predict_intents([messages[i] for i in pending], personality)
+                for i, result in zip(pending, rest):
+                    results[i] = result
+            return results
+        if not rasa_client.available():
+            classifier = RasaNLPEngine.local_classifier()
+            if classifier is None:
+                from .nlp import SimpleNLPEngine
+                nlp_served('keyword', count=len(messages))
+                return SimpleNLPEngine.predict_intents(messages, personality)
+            return [
+                RasaNLPEngine._fallback(message, personality, local)
+                for message, local in zip(messages, classifier.predict_batch(messages))
+            ]
+        results = [None] * len(messages)
+        local = [None] * len(messages)
+        if LOCAL_NLU_TIER == 'first':
+            classifier = RasaNLPEngine.local_classifier()
+            if classifier is not None:
+                from .nlp import SimpleNLPEngine
+                local = classifier.predict_batch(messages)
+                for i, (intent, confidence) in enumerate(local):
+                    if confidence >= LOCAL_NLU_ACCEPT:
+                        results[i] = intent, SimpleNLPEngine.response_for(intent, personality)
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        nlp_served('local', count=len(messages) - len(pending))
+        keys = [RasaNLPEngine.cache_key(messages[i]) for i in pending]
+        groups = {}  # cache key -> indexes, so repeated messages are parsed once
+        uncacheable = []
+        for i, key, intent in zip(pending, keys, prediction_cache.get_many(keys)):
+            if intent is not None:
+                results[i] = intent, RasaNLPEngine._get_response(intent, personality)
+            elif key is None:
+                uncacheable.append((None, [i]))
+            else:
+                groups.setdefault(key, []).append(i)
+        to_parse = list(groups.items()) + uncacheable
+        nlp_served('cache', count=len(pending) - sum(len(indexes) for _, indexes in to_parse))
+
+        intents = _parse_executor.map(
+            lambda item: RasaNLPEngine._rasa_intent(messages[item[1][0]], item[0], remember=False), to_parse
+        )
+        learned = {}
+        parsed = 0
+        for (key, indexes), intent in zip(to_parse, intents):
+            for i in indexes:
+                if intent is None:
+                    results[i] = RasaNLPEngine._fallback(messages[i], personality, local[i])
+                else:
+                    parsed += 1
+                    results[i] = intent, RasaNLPEngine._get_response(intent, personality)
+            if intent is not None and key is not None:
+                learned[key] = intent
+        prediction_cache.set_many(learned)
+        nlp_served('rasa', count=parsed)
+        return results
+
     @staticmethod
     def _get_response(intent, personality):
-        """Get personality-specific response for intent"""
-        responses = {
-            'greet': {
-                'friendly': 'Hello! How can I help? 😊',
-                'professional': 'Hello! How may I assist you today?',
-                'casual': 'Hey! What\'s up? 😎',
-                'formal': 'Good day! How may I be of service?',
-                'humorous': 'Hello! I\'m your friendly AI overlord! 😄',
-                'empathetic': 'Hi there! I\'m here for you! ❤️',
-            },
-            'goodbye': {
-                'friendly': 'Goodbye! Have a great day! 👋',
-                'professional': 'Thank you. Goodbye.',
-                'casual': 'Catch ya later! ✌️',
-                'formal': 'Farewell. Have a pleasant day.',
-                'humorous': 'Bye! Don\'t forget to feed your robot! 🤖',
-                'empathetic': 'Take care! I\'m always here if you need me! 💕',
-            },
-            'info': 'This is a demo chatbot powered by AI Chatbot Management System with Rasa AI.',
-            'purchase': 'You can buy products from our store! 🛒',
-            'health': 'Please consult a healthcare professional. 🩺',
-            'unknown': 'Sorry, I did not understand. 😅'
-        }
-        
-        if intent in ['greet', 'goodbye']:
-            return responses[intent].get(personality, responses[intent]['friendly'])
-        else:
-            return responses.get(intent, responses['unknown'])
+        """Get personality-specific response for intent from the domain.yml catalog"""
+        return RasaNLPEngine._response_catalog().response_for(intent, personality)
 
 
-def train_rasa_model():
-    """Train Rasa model (run this once after setup)"""
+def train_rasa_model(force=False):
+    """
+    Train Rasa model (run this once after setup)
+    Skipped when the project files are unchanged since the last successful
+    run and a model exists, unless force is set
+    """
     import sys
+    import glob
+    from .training_jobs import file_fingerprint
     rasa_dir = os.path.join(os.path.dirname(__file__), '..', 'rasa_project')
     rasa_dir = os.path.abspath(rasa_dir)
+
+    inputs = sorted(glob.glob(os.path.join(rasa_dir, 'data', '*.yml')))
+    inputs += [os.path.join(rasa_dir, name) for name in ('config.yml', 'domain.yml')]
+    fingerprint = file_fingerprint(inputs)
+    stamp_path = os.path.join(rasa_dir, 'models', '.fingerprint')
+    if not force and glob.glob(os.path.join(rasa_dir, 'models', '*.tar.gz')):
+        try:
+            with open(stamp_path) as f:
+                if f.read().strip() == fingerprint:
+                    print("✅ Rasa project unchanged since the last training, keeping the current model.")
+                    return True
+        except OSError:
+            pass
     
     print("Training Rasa model... (this may take 2-5 minutes)")
     print(f"Using Rasa project directory: {rasa_dir}")
@@ -108,6 +673,9 @@ def train_rasa_model():
     if result.returncode == 0:
         print("✅ Rasa model trained successfully!")
         print(result.stdout)
+        with open(stamp_path, 'w') as f:
+            f.write(fingerprint)
+        RasaNLPEngine.invalidate_cache()
         return True
     else:
         print(f"❌ Rasa training failed:")
@@ -115,26 +683,24 @@ def train_rasa_model():
         return False
 
 
-def start_rasa_server():
-    """Start Rasa server in background (for development)"""
-    import sys
-    rasa_dir = os.path.join(os.path.dirname(__file__), '..', 'rasa_project')
-    rasa_dir = os.path.abspath(rasa_dir)
-    
-    print("Starting Rasa server on port 5005...")
-    subprocess.Popen(
-        [sys.executable, '-m', 'rasa', 'run', '--enable-api', '--cors', '*', '--port', '5005'],
-        cwd=rasa_dir,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL
-    )
-    
-    # Wait for server to start
-    for i in range(30):
-        time.sleep(1)
-        if RasaNLPEngine.is_rasa_running():
-            print("✅ Rasa server started successfully!")
-            return True
-    
+def start_rasa_server(workers=None, base_port=5005, timeout=300):
+    """
+    Start a pool of Rasa workers in the background (for development) and
+    point rasa_client at whichever of them are ready. Returns the
+    RasaSupervisor once the first worker is up, or None if none came up
+    """
+    from .rasa_supervisor import RasaSupervisor
+    workers = workers or int(os.environ.get('RASA_WORKERS', '1'))
+
+    print(f"Starting {workers} Rasa worker(s) from port {base_port}...")
+    supervisor = RasaSupervisor(workers, base_port, on_change=rasa_client.set_backends)
+    supervisor.start()
+
+    # readiness is signalled by the workers themselves, no fixed sleep
+    if supervisor.wait_ready(count=1, timeout=timeout):
+        print(f"✅ Rasa server started successfully! Ready: {', '.join(supervisor.ready_urls())}")
+        return supervisor
+
     print("❌ Rasa server failed to start")
-    return False
+    supervisor.stop()
+    return None
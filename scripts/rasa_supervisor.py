@@ -0,0 +1,242 @@
+"""
+Runs a pool of ``rasa run`` workers on consecutive ports so NLU parsing
+uses more than one core. Readiness comes from each worker's own
+"server is up" line, with a /status probe as a backstop. Crashed or
+hung workers are restarted with exponential backoff. Clients spread
+calls over the ready workers (see LeastOutstandingBalancer).
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+RASA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'rasa_project'))
+READY_MARKER = 'Rasa server is up and running'
+
+STARTING = 'starting'
+READY = 'ready'
+BACKOFF = 'backoff'
+STOPPED = 'stopped'
+
+
+class RasaWorker:
+    def __init__(self, index, port, host):
+        self.index = index
+        self.port = port
+        self.url = f"http://{host}:{port}"
+        self.state = STOPPED
+        self.process = None
+        self.started_at = None
+        self.ready_at = None
+        self.restart_at = None
+        self.restarts = 0
+        self.crashes = 0  # consecutive, reset once a worker stays up for a while
+        self.health_failures = 0
+        self.last_exit = None
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'state': self.state,
+            'pid': self.process.pid if self.process is not None else None,
+            'restarts': self.restarts,
+            'last_exit': self.last_exit,
+            'uptime': round(time.monotonic() - self.ready_at, 1) if self.state == READY else 0,
+        }
+
+
+class RasaSupervisor:
+    """
+    Starts `workers` Rasa servers on base_port, base_port + 1, ... and
+    keeps them running. on_change(ready_urls) is called whenever the set
+    of ready workers changes.
+    """
+
+    def __init__(self, workers, base_port=5005, host='127.0.0.1', rasa_dir=RASA_DIR, command=None,
+                 startup_timeout=300, health_interval=5.0, health_failures=3, max_backoff=60.0,
+                 stable_after=60.0, log_dir=None, on_change=None):
+        self.workers = [RasaWorker(i, base_port + i, host) for i in range(workers)]
+        self.rasa_dir = rasa_dir
+        self.command = command or [sys.executable, '-m', 'rasa', 'run', '--enable-api', '--cors', '*']
+        self.startup_timeout = startup_timeout
+        self.health_interval = health_interval
+        self.health_failures = health_failures
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.log_dir = log_dir or os.path.join(rasa_dir, 'logs')
+        self.on_change = on_change
+        self.session = requests.Session()
+        self._changed = threading.Condition()
+        self._stopping = threading.Event()
+        self._monitor = None
+
+    @property
+    def urls(self):
+        return [w.url for w in self.workers]
+
+    def ready_urls(self):
+        return [w.url for w in self.workers if w.state == READY]
+
+    def start(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        for worker in self.workers:
+            self._spawn(worker)
+        self._monitor = threading.Thread(target=self._run_monitor, name='rasa-supervisor', daemon=True)
+        self._monitor.start()
+
+    def wait_ready(self, count=None, timeout=None):
+        """Block until `count` workers (default all) are ready; False on timeout or stop"""
+        count = len(self.workers) if count is None else count
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while len(self.ready_urls()) < count:
+                if self._stopping.is_set():
+                    return False
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+        return True
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        for worker in self.workers:
+            if worker.process is not None and worker.process.poll() is None:
+                worker.process.terminate()
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            try:
+                worker.process.wait(max(0.1, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+                worker.process.wait()
+            worker.state = STOPPED
+        self._notify()
+
+    def stats(self):
+        return {
+            'workers': [w.stats() for w in self.workers],
+            'ready': len(self.ready_urls()),
+        }
+
+    def _spawn(self, worker):
+        log = open(os.path.join(self.log_dir, f"rasa_worker_{worker.index}.log"), 'a', buffering=1)
+        worker.process = subprocess.Popen(
+            self.command + ['--port', str(worker.port)],
+            cwd=self.rasa_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            text=True,
+            errors='replace',
+        )
+        worker.state = STARTING
+        worker.started_at = time.monotonic()
+        worker.health_failures = 0
+        print(f"Rasa worker {worker.index} starting on port {worker.port} (pid {worker.process.pid})")
+        threading.Thread(
+            target=self._watch_output, args=(worker, worker.process, log),
+            name=f'rasa-worker-{worker.index}', daemon=True,
+        ).start()
+
+    def _watch_output(self, worker, process, log):
+        """Tee the worker's output to its log; readiness and exit are events, not polls"""
+        with log:
+            for line in process.stdout:
+                log.write(line)
+                if worker.state == STARTING and READY_MARKER in line and worker.process is process:
+                    self._mark_ready(worker)
+        code = process.wait()
+        if worker.process is process:
+            self._exited(worker, code)
+
+    def _mark_ready(self, worker):
+        with self._changed:  # the output watcher and the monitor may both get here
+            if worker.state != STARTING:
+                return
+            worker.state = READY
+            worker.ready_at = time.monotonic()
+        print(f"Rasa worker {worker.index} ready at {worker.url} "
+              f"after {worker.ready_at - worker.started_at:.1f}s")
+        self._notify()
+
+    def _exited(self, worker, code):
+        worker.last_exit = code
+        if self._stopping.is_set():
+            worker.state = STOPPED
+            self._notify()
+            return
+        stable = worker.ready_at is not None and worker.state == READY and \
+            time.monotonic() - worker.ready_at >= self.stable_after
+        worker.crashes = 0 if stable else worker.crashes + 1
+        delay = min(self.max_backoff, 2 ** max(0, worker.crashes - 1))
+        worker.state = BACKOFF
+        worker.ready_at = None
+        worker.restart_at = time.monotonic() + delay
+        print(f"Rasa worker {worker.index} exited with {code}, restarting in {delay:.0f}s")
+        self._notify()
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+        if self.on_change is not None:
+            self.on_change(self.ready_urls())
+
+    def _healthy(self, worker):
+        try:
+            return self.session.get(f"{worker.url}/status", timeout=2).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def _run_monitor(self):
+        while not self._stopping.is_set():
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.state == BACKOFF and now >= worker.restart_at:
+                    worker.restarts += 1
+                    self._spawn(worker)
+                elif worker.state == STARTING:
+                    if self._healthy(worker):
+                        self._mark_ready(worker)  # a Rasa version that prints no marker
+                    elif now - worker.started_at > self.startup_timeout:
+                        print(f"Rasa worker {worker.index} not ready after {self.startup_timeout}s, killing it")
+                        worker.process.kill()
+                elif worker.state == READY:
+                    if self._healthy(worker):
+                        worker.health_failures = 0
+                    else:
+                        worker.health_failures += 1
+                        if worker.health_failures >= self.health_failures:
+                            print(f"Rasa worker {worker.index} failed {worker.health_failures} health checks, "
+                                  f"restarting it")
+                            worker.process.kill()
+            restarts = [w.restart_at for w in self.workers if w.state == BACKOFF]
+            wait = self.health_interval
+            if restarts:
+                wait = max(0.05, min(wait, min(restarts) - time.monotonic()))
+            self._stopping.wait(wait)
+
+
+def run_supervisor(workers=None, base_port=None, host=None):
+    """Foreground pool for `python rasa_workers.py`; stops the workers on Ctrl-C / SIGTERM"""
+    import signal
+    # one worker unless asked for more: each holds a full model in memory, which the core count says nothing about
+    workers = workers or int(os.environ.get('RASA_WORKERS', '1'))
+    base_port = base_port or int(os.environ.get('RASA_BASE_PORT', '5005'))
+    host = host or os.environ.get('RASA_WORKER_HOST', '127.0.0.1')
+    supervisor = RasaSupervisor(workers, base_port, host)
+    done = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: done.set())
+    supervisor.start()
+    print(f"Set RASA_SERVER_URL={','.join(supervisor.urls)} on the Flask app and gateway")
+    try:
+        while not done.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    supervisor.stop()
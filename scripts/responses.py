@@ -0,0 +1,194 @@
+"""
+Response catalog: every reply text keyed by (intent, personality),
+compiled once from rasa_project/domain.yml and replaced as a whole when
+the file changes, so a lookup is one dict access and edits need no restart.
+"""
+import os
+import threading
+import time
+
+import yaml
+
+DOMAIN_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'rasa_project', 'domain.yml'))
+
+PERSONALITIES = ('friendly', 'professional', 'casual', 'formal', 'humorous', 'empathetic')
+
+# Used when domain.yml cannot be read or lacks an intent; the texts the engine always had
+DEFAULT_RESPONSES = {
+    'greet': {
+        'friendly': 'Hello! How can I help? 😊',
+        'professional': 'Hello! How may I assist you today?',
+        'casual': 'Hey! What\'s up? 😎',
+        'formal': 'Good day! How may I be of service?',
+        'humorous': 'Hello! I\'m your friendly AI overlord! 😄',
+        'empathetic': 'Hi there! I\'m here for you! ❤️',
+    },
+    'goodbye': {
+        'friendly': 'Goodbye! Have a great day! 👋',
+        'professional': 'Thank you. Goodbye.',
+        'casual': 'Catch ya later! ✌️',
+        'formal': 'Farewell. Have a pleasant day.',
+        'humorous': 'Bye! Don\'t forget to feed your robot! 🤖',
+        'empathetic': 'Take care! I\'m always here if you need me! 💕',
+    },
+    'info': {None: 'This is a demo chatbot powered by AI Chatbot Management System.'},
+    'purchase': {None: 'You can buy products from our store! 🛒'},
+    'health': {None: 'Please consult a healthcare professional. 🩺'},
+    'unknown': {None: 'Sorry, I did not understand. 😅'},
+}
+
+
+def domain_responses(domain, known_intents=()):
+    """
+    {intent: {personality or None: text}} from a parsed domain.yml, where
+    utter_<intent> is the generic text and utter_<intent>_<personality>
+    a personality's own
+    """
+    intents = {i for i in domain.get('intents', []) if isinstance(i, str)} | set(known_intents)
+    # longest intent name first so 'utter_greet_x' never matches a shorter prefix
+    known = sorted(intents, key=len, reverse=True)
+    responses = {}
+    for name, variants in (domain.get('responses') or {}).items():
+        if not name.startswith('utter_') or not variants:
+            continue
+        text = variants[0].get('text')
+        if text is None:
+            continue
+        key = name[len('utter_'):]
+        for intent in known:
+            if key == intent:
+                responses.setdefault(intent, {})[None] = text
+                break
+            if key.startswith(intent + '_'):
+                responses.setdefault(intent, {})[key[len(intent) + 1:]] = text
+                break
+    return responses
+
+
+class ResponseCatalog:
+    """
+    Immutable (intent, personality) -> text table. Fallbacks are resolved
+    at build time: a personality without its own text gets the intent's
+    generic one, an intent with only per-personality texts uses the
+    friendly one as generic, and unknown intents get 'unknown'.
+    """
+
+    def __init__(self, responses, personalities=PERSONALITIES, version=None):
+        merged = {}
+        for intent, texts in DEFAULT_RESPONSES.items():
+            merged[intent] = dict(texts)
+        for intent, texts in responses.items():
+            merged.setdefault(intent, {}).update(texts)
+
+        self.version = version
+        self._generic = {}
+        self._flat = {}
+        seen = set(personalities)
+        for texts in merged.values():
+            seen.update(p for p in texts if p is not None)
+        for intent, texts in merged.items():
+            generic = texts.get(None) or texts.get('friendly') or next(iter(texts.values()))
+            self._generic[intent] = generic
+            for personality in seen:
+                self._flat[(intent, personality)] = texts.get(personality) or generic
+
+    def __contains__(self, intent):
+        return intent in self._generic
+
+    def __len__(self):
+        return len(self._flat)
+
+    @property
+    def intents(self):
+        return tuple(self._generic)
+
+    def response_for(self, intent, personality='friendly'):
+        text = self._flat.get((intent, personality))
+        if text is None:  # personality or intent the catalog has never seen
+            text = self._generic.get(intent) or self._flat.get(('unknown', personality)) or self._generic['unknown']
+        return text
+
+    @classmethod
+    def from_domain(cls, path, known_intents=()):
+        with open(path, encoding='utf-8') as f:
+            domain = yaml.safe_load(f) or {}
+        return cls(domain_responses(domain, known_intents), version=os.stat(path).st_mtime_ns)
+
+
+class WatchedResponseCatalog:
+    """
+    Holds the current ResponseCatalog for one domain.yml. At most every
+    poll_interval seconds a lookup stats the file; when it changed, the
+    first caller to notice compiles a new catalog and swaps the reference
+    while everyone else keeps answering from the old one. A file that does
+    not parse leaves the previous catalog in place.
+    """
+
+    def __init__(self, path=DOMAIN_PATH, known_intents=(), poll_interval=2.0):
+        self.path = path
+        self.known_intents = tuple(known_intents)
+        self.poll_interval = poll_interval
+        self.reloads = 0
+        self.failures = 0
+        self._checked = time.monotonic()
+        self._reload_lock = threading.Lock()
+        self._signature = self._stat()
+        try:
+            self.catalog = ResponseCatalog.from_domain(path, self.known_intents)
+        except (OSError, yaml.YAMLError, AttributeError) as e:
+            print(f"Could not load responses from {path} ({e}), using built-in responses")
+            self.catalog = ResponseCatalog({})
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def current(self):
+        """The catalog to answer from, reloaded first if domain.yml changed"""
+        if self.poll_interval > 0:
+            now = time.monotonic()
+            if now - self._checked >= self.poll_interval:
+                self._checked = now
+                self.reload()
+        return self.catalog
+
+    def response_for(self, intent, personality='friendly'):
+        return self.current().response_for(intent, personality)
+
+    def reload(self, force=False):
+        """Recompile if the file changed (or force); returns True when a new catalog was installed"""
+        if not self._reload_lock.acquire(blocking=False):
+            return False  # another thread is already compiling it
+        try:
+            signature = self._stat()
+            if signature is None or (signature == self._signature and not force):
+                return False
+            try:
+                catalog = ResponseCatalog.from_domain(self.path, self.known_intents)
+            except (OSError, yaml.YAMLError, AttributeError) as e:
+                self.failures += 1
+                self._signature = signature  # do not retry until the file changes again
+                print(f"Keeping the current responses, {self.path} did not load: {e}")
+                return False
+            self._signature = signature
+            self.catalog = catalog
+            self.reloads += 1
+        finally:
+            self._reload_lock.release()
+        print(f"Reloaded {len(catalog)} responses from {self.path}")
+        return True
+
+    def stats(self):
+        catalog = self.catalog
+        return {
+            'path': self.path,
+            'version': catalog.version,
+            'intents': len(catalog.intents),
+            'entries': len(catalog),
+            'reloads': self.reloads,
+            'failures': self.failures,
+            'poll_interval': self.poll_interval,
+        }
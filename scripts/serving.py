@@ -0,0 +1,65 @@
+"""
+Process lifecycle helpers for running the app under a pre-fork server
+(see gunicorn.conf.py).
+"""
+from . import db
+from .metrics import MultiprocessMetrics, start_metrics_server
+from .nlp import INTENT_INDEX, response_catalog
+from .rasa_integration import RasaNLPEngine, rasa_client
+
+
+def warm_up(app):
+    """
+    Load everything that is expensive to build once, in the master, so
+    forked workers share it copy-on-write: the compiled keyword index and
+    response catalog, the local classifier, the Rasa client (and the model
+    it serves, which the shared prediction cache keys on) and the database
+    engine.
+    """
+    with app.app_context():
+        engine = db.engine
+        engine.dispose()  # connections must not be shared across fork
+    rasa_client.refresh_model()
+    RasaNLPEngine.cache_key('warm up')
+    RasaNLPEngine.local_classifier()
+    print(f"Warmed up: {INTENT_INDEX.size} keyword phrases, {len(response_catalog.catalog)} responses, "
+          f"Rasa model {rasa_client.model_file}, database {engine.url!r}")
+
+
+def serve_metrics(app):
+    """
+    Serve /metrics on METRICS_PORT from the master, merging the snapshots
+    every worker publishes, so each scrape covers the whole server
+    """
+    if not app.config['METRICS_PORT']:
+        return
+    merged = MultiprocessMetrics(app.config['METRICS_MULTIPROC_DIR'])
+    merged.reset()
+    start_metrics_server(app.config['METRICS_PORT'], merged.render, app.config['METRICS_HOST'])
+
+
+def after_fork(app):
+    """Re-create per-process resources in a freshly forked worker"""
+    with app.app_context():
+        db.engine.dispose()
+    rasa_client.after_fork()
+    app.extensions['log_writer'].after_fork()
+    app.extensions['training_jobs'].after_fork()
+    app.extensions['training_jobs'].recover()
+    batcher = app.extensions.get('nlp_batcher')
+    if batcher is not None:
+        batcher.after_fork()
+    aggregate_buffer = app.extensions.get('aggregate_buffer')
+    if aggregate_buffer is not None:
+        aggregate_buffer.after_fork()
+    if app.config['METRICS_PORT']:
+        app.extensions['metrics_writer'].after_fork()
+
+
+def before_exit(app):
+    """Flush queued interaction logs, buffered aggregates and metrics before a worker goes away"""
+    app.extensions['log_writer'].close()
+    aggregate_buffer = app.extensions.get('aggregate_buffer')
+    if aggregate_buffer is not None:
+        aggregate_buffer.close()
+    app.extensions['metrics_writer'].close()
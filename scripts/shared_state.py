@@ -0,0 +1,341 @@
+"""
+State shared by every replica: prediction-cache entries, rate and usage
+counters, and pending rollup increments. SHARED_STATE_URL picks the
+backend: empty (the default) keeps it in this process, redis://host:port/db
+uses Redis or anything that speaks its protocol (benchmarks/stub_kv.py
+for local runs). Each method is a single round trip that batches its
+keys in one pipeline. A backend that cannot be reached behaves like an
+empty one, so callers fall back to computing the answer themselves.
+"""
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+
+
+class LocalState:
+    """
+    In-process backend: a dict with per-key expiry, for a single replica.
+    Expired keys are dropped when read, and by a sweep at most every
+    sweep_interval seconds on writes, since keys such as per-minute rate
+    counters are never read again once their window has passed.
+    """
+
+    name = 'local'
+
+    def __init__(self, sweep_interval=60.0):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+        self.errors = 0
+        self.sweep_interval = sweep_interval
+        self._swept = time.monotonic()
+
+    def _live(self, key, now):
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= now:
+            self._data.pop(key, None)
+            del self._expires[key]
+        return self._data.get(key)
+
+    def _sweep(self, now):
+        """Drop every expired key; called with the lock held"""
+        if now - self._swept < self.sweep_interval:
+            return
+        self._swept = now
+        for key in [k for k, expires_at in self._expires.items() if expires_at <= now]:
+            self._data.pop(key, None)
+            del self._expires[key]
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            return [self._live(key, now) for key in keys]
+
+    def set_many(self, mapping, ttl):
+        now = time.monotonic()
+        expires_at = now + ttl
+        with self._lock:
+            self._sweep(now)
+            for key, value in mapping.items():
+                self._data[key] = value
+                self._expires[key] = expires_at
+
+    def add(self, key, value, ttl):
+        """Set key only if absent; True when this call set it"""
+        now = time.monotonic()
+        with self._lock:
+            if self._live(key, now) is not None:
+                return False
+            self._data[key] = value
+            self._expires[key] = now + ttl
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+
+    def incr_many(self, increments):
+        """[(key, amount, ttl)] -> new totals; ttl starts when a key is created (fixed windows)"""
+        now = time.monotonic()
+        totals = []
+        with self._lock:
+            self._sweep(now)
+            for key, amount, ttl in increments:
+                value = self._live(key, now)
+                if value is None:
+                    value = 0
+                    if ttl:
+                        self._expires[key] = now + ttl
+                self._data[key] = value + amount
+                totals.append(value + amount)
+        return totals
+
+    def update_hashes(self, increments=None, values=None):
+        """
+        {key: {field: amount}} added to and {key: {field: value}} stored in
+        hashes; True once applied, False if the backend could not be reached
+        """
+        with self._lock:
+            for key, fields in (increments or {}).items():
+                table = self._data.setdefault(key, {})
+                for field, amount in fields.items():
+                    table[field] = table.get(field, 0) + amount
+            for key, fields in (values or {}).items():
+                self._data.setdefault(key, {}).update(fields)
+        return True
+
+    def take_hashes(self, *keys):
+        """Read and delete hashes in one atomic step; [{field: value}] as strings"""
+        with self._lock:
+            return [{f: str(v) for f, v in (self._data.pop(key, None) or {}).items()} for key in keys]
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self.name, 'keys': len(self._data), 'errors': self.errors}
+
+
+class RedisState:
+    """Redis backend (redis-py); a pipeline per call, errors count as misses"""
+
+    name = 'redis'
+
+    def __init__(self, url, timeout=0.5):
+        import redis
+        self._redis_error = redis.RedisError
+        self.url = url
+        # RESP2: spoken by every Redis version and by benchmarks/stub_kv.py
+        self.client = redis.Redis.from_url(
+            url, socket_timeout=timeout, socket_connect_timeout=timeout, decode_responses=True, protocol=2)
+        self.errors = 0
+        self._last_report = 0.0
+
+    def _failed(self, e):
+        self.errors += 1
+        now = time.monotonic()
+        if now - self._last_report > 10:  # one line per 10 s, not one per request
+            self._last_report = now
+            print(f"Shared state {self.url} unavailable ({e}), serving without it")
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        try:
+            return self.client.mget(keys)
+        except self._redis_error as e:
+            self._failed(e)
+            return [None] * len(keys)
+
+    def set_many(self, mapping, ttl):
+        if not mapping:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(key, value, px=max(1, int(ttl * 1000)))
+        try:
+            pipe.execute()
+        except self._redis_error as e:
+            self._failed(e)
+
+    def add(self, key, value, ttl):
+        try:
+            return bool(self.client.set(key, value, px=max(1, int(ttl * 1000)), nx=True))
+        except self._redis_error as e:
+            self._failed(e)
+            return False
+
+    def delete(self, *keys):
+        try:
+            self.client.delete(*keys)
+        except self._redis_error as e:
+            self._failed(e)
+
+    def incr_many(self, increments):
+        if not increments:
+            return []
+        pipe = self.client.pipeline(transaction=False)
+        for key, amount, ttl in increments:
+            if ttl:
+                # creates the key with its TTL in the same round trip; a no-op once it exists
+                pipe.set(key, 0, ex=max(1, int(ttl)), nx=True)
+            pipe.incrby(key, amount)
+        try:
+            replies = pipe.execute()
+        except self._redis_error as e:
+            self._failed(e)
+            return [0] * len(increments)
+        replies = iter(replies)
+        totals = []
+        for _, _, ttl in increments:
+            if ttl:
+                next(replies)  # the SET NX reply
+            totals.append(next(replies))
+        return totals
+
+    def update_hashes(self, increments=None, values=None):
+        pipe = self.client.pipeline(transaction=False)
+        for key, fields in (increments or {}).items():
+            for field, amount in fields.items():
+                pipe.hincrby(key, field, amount)
+        for key, fields in (values or {}).items():
+            if fields:
+                pipe.hset(key, mapping=fields)
+        if not len(pipe):
+            return True
+        try:
+            pipe.execute()
+        except self._redis_error as e:
+            self._failed(e)
+            return False
+        return True
+
+    def take_hashes(self, *keys):
+        pipe = self.client.pipeline(transaction=True)  # MULTI/EXEC: nothing lands in between
+        for key in keys:
+            pipe.hgetall(key)
+        pipe.delete(*keys)
+        try:
+            return pipe.execute()[:-1]
+        except self._redis_error as e:
+            self._failed(e)
+            return [{} for _ in keys]
+
+    def stats(self):
+        stats = {'backend': self.name, 'url': self.url, 'errors': self.errors}
+        try:
+            stats['keys'] = self.client.dbsize()
+        except self._redis_error:
+            stats['keys'] = None
+        return stats
+
+
+def connect(url):
+    """Backend for a SHARED_STATE_URL value"""
+    if not url or url == 'local':
+        return LocalState()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            return RedisState(url)
+        except ImportError:
+            raise RuntimeError("SHARED_STATE_URL needs the redis package (pip install redis)")
+    raise ValueError(f"Unsupported SHARED_STATE_URL {url!r}")
+
+
+shared_state = connect(os.environ.get('SHARED_STATE_URL', ''))
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key in this process into one:
+    the first caller runs fn, the others wait for and share its result.
+    Keeps a cold cache (new replica, new model) from sending N identical
+    parses to Rasa at once.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event()}
+            else:
+                self.shared += 1
+        if not leader:
+            call['done'].wait()
+            if 'error' in call:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+
+class ChatRateLimiter:
+    """
+    Fixed-window counters in the shared state: requests per client and bot
+    per minute, and requests per bot per day (its usage). Both are counted
+    in one round trip; a limit of 0 disables it.
+    """
+
+    def __init__(self, state, per_minute=0, per_bot_day=0):
+        self.state = state
+        self.per_minute = per_minute
+        self.per_bot_day = per_bot_day
+        self.rejected = 0
+
+    @property
+    def enabled(self):
+        return self.per_minute > 0 or self.per_bot_day > 0
+
+    @staticmethod
+    def client_key(user_id, token, address):
+        """
+        Who the per-minute limit counts: the logged-in user, else the chat
+        token from this address (one embed's visitors do not share a
+        budget), else the address
+        """
+        if user_id is not None:
+            return f"user-{user_id}"
+        if token:
+            return f"token-{hashlib.sha256(token.encode()).hexdigest()[:16]}-{address}"
+        return address
+
+    def hit(self, bot_id, client, count=1):
+        """True when the request may proceed"""
+        return self.hit_many({bot_id: count}, client)
+
+    def hit_many(self, counts, client):
+        """Count {bot_id: requests} for one client; False if any bot is over a limit"""
+        now = datetime.utcnow()
+        increments = []
+        limits = []
+        for bot_id, count in counts.items():
+            if self.per_minute > 0:
+                increments.append((f"rate:{bot_id}:{client}:{now:%Y%m%d%H%M}", count, 120))
+                limits.append(self.per_minute)
+            if self.per_bot_day > 0:
+                increments.append((f"usage:{bot_id}:{now:%Y%m%d}", count, 2 * 86400))
+                limits.append(self.per_bot_day)
+        totals = self.state.incr_many(increments)
+        if any(total > limit for total, limit in zip(totals, limits)):
+            self.rejected += 1
+            return False
+        return True
+
+    def stats(self):
+        return {'per_minute': self.per_minute, 'per_bot_day': self.per_bot_day, 'rejected': self.rejected}
@@ -0,0 +1,330 @@
+"""
+Background training jobs. A job gathers a bot's NLU data (nlu.yml, its chat
+logs and imported datasets), fingerprints it, and trains only when the
+fingerprint differs from the last successful run. Jobs run on a small
+bounded thread pool; a web request only inserts the TrainingJob row.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import TrainingJob
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+TRAINING_DATA_DIR = os.path.join('instance', 'training_data')
+
+# bump when the training code changes in a way that should retrain unchanged data
+FINGERPRINT_VERSION = b'local-nlu-1'
+
+
+class TrainingQueueFull(Exception):
+    """Raised when max_pending jobs are already waiting in this process"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def file_fingerprint(paths):
+    """sha256 over the names and contents of files, in the given order"""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode('utf-8') + b'\0')
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def bot_training_data(bot_id):
+    """(examples, responses) for a bot: nlu.yml, its logs, then imported data"""
+    from .ingestion import iter_training_examples
+    from .local_classifier import log_examples, log_responses, nlu_examples
+
+    examples = nlu_examples()
+    examples += log_examples([bot_id])
+    responses = log_responses([bot_id])
+    for intent, message, response in iter_training_examples(bot_id):
+        examples.append((intent, message))
+        if response:
+            responses.setdefault(intent, response)
+    return examples, responses
+
+
+def training_fingerprint(examples, responses):
+    digest = hashlib.sha256(FINGERPRINT_VERSION)
+    for intent, text in examples:
+        digest.update(f"{intent}\t{text}\n".encode('utf-8'))
+    for intent in sorted(responses):
+        digest.update(f"{intent}\t{responses[intent]}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class JobContext:
+    """Progress reporting and cancellation checks for a running job"""
+
+    def __init__(self, job, cancel_event):
+        self.job = job
+        self.cancel_event = cancel_event
+
+    def cancelled(self):
+        # the commit in progress() expired the row, so this re-reads the flag
+        return self.cancel_event.is_set() or self.job.cancel_requested
+
+    def progress(self, percent, message):
+        self.job.progress = percent
+        self.job.message = message
+        self.job.updated_at = datetime.utcnow()
+        db.session.commit()
+        if self.cancelled():
+            raise JobCancelled()
+
+
+def run_training_job(ctx):
+    from .local_classifier import LocalIntentClassifier
+    from .model_registry import bot_model_key
+    from .rasa_integration import model_registry
+
+    job = ctx.job
+    key = bot_model_key(job.bot_id)
+
+    ctx.progress(5, 'Collecting training data')
+    examples, responses = bot_training_data(job.bot_id)
+    job.examples = len(examples)
+
+    ctx.progress(30, f"Fingerprinting {len(examples)} examples")
+    job.fingerprint = training_fingerprint(examples, responses)
+    previous = (
+        TrainingJob.query
+        .filter(
+            TrainingJob.bot_id == job.bot_id,
+            TrainingJob.id != job.id,
+            TrainingJob.status.in_((SUCCEEDED, SKIPPED)),
+        )
+        .order_by(TrainingJob.id.desc())
+        .first()
+    )
+    if (previous is not None and previous.fingerprint == job.fingerprint
+            and model_registry.latest_version(key) is not None):
+        job.model_version = previous.model_version
+        return SKIPPED, f"Nothing changed since job #{previous.id}; kept model {previous.model_version}"
+
+    ctx.progress(40, 'Training local model')
+    model = LocalIntentClassifier.train(examples, responses=responses)
+
+    # published last, so a cancelled or failed job leaves the serving model alone
+    ctx.progress(95, 'Publishing model')
+    job.model_version = model_registry.publish(key, model)
+
+    return SUCCEEDED, f"Trained {len(model.intents)} intents from {len(examples)} examples"
+
+
+def run_import_job(ctx):
+    """Stream an uploaded dataset into training_example; the upload is removed however the job ends"""
+    from .ingestion import describe_counts, ingest_file
+
+    job = ctx.job
+
+    def report(bytes_read, total_bytes, counts):
+        percent = min(99, int(bytes_read * 100 / total_bytes)) if total_bytes else 99
+        job.examples = counts['inserted']
+        ctx.progress(percent, describe_counts(counts))
+
+    try:
+        ctx.progress(1, 'Reading dataset')
+        counts = ingest_file(job.source, job.bot_id, progress=report,
+                             source=os.path.basename(job.source).split('_', 2)[-1])
+    finally:
+        try:
+            os.remove(job.source)
+        except OSError:
+            pass
+    job.examples = counts['inserted']
+    return SUCCEEDED, describe_counts(counts)
+
+
+class TrainingJobRunner:
+    """
+    Runs TrainingJob rows (trainings and dataset imports) on max_workers
+    background threads. At most max_pending jobs wait per process; one bot
+    never has two active training jobs.
+    Cancelling sets a flag on the row, so it works from any worker process.
+    A job is claimed with a conditional UPDATE before it runs, so when a
+    worker starts, recover() can resubmit every queued job, including those
+    of processes that went away, without a job running twice.
+    """
+
+    def __init__(self, app, max_workers=1, max_pending=10, stale_after=3600):
+        self.app = app
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.stale_after = timedelta(seconds=stale_after)
+        self.completed = 0
+        self._lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='training-job')
+        self._pending = 0
+        self._cancel_events = {}
+
+    def after_fork(self):
+        """Threads do not survive fork(); give a new worker its own pool"""
+        self._start()
+
+    def recover(self):
+        """
+        Take over jobs left behind by processes that exited: queued jobs
+        are resubmitted here, and jobs running with no progress for
+        stale_after are failed (an import's upload is deleted)
+        """
+        now = datetime.utcnow()
+        with self.app.app_context():
+            stale = (
+                db.session.query(TrainingJob.id, TrainingJob.kind, TrainingJob.source)
+                .filter(TrainingJob.status == RUNNING, TrainingJob.updated_at < now - self.stale_after)
+                .all()
+            )
+            for job_id, kind, source in stale:
+                failed = (
+                    TrainingJob.query.filter_by(id=job_id, status=RUNNING)
+                    .update({TrainingJob.status: FAILED, TrainingJob.message: 'Abandoned: no progress reported',
+                             TrainingJob.finished_at: now, TrainingJob.updated_at: now}, synchronize_session=False)
+                )
+                db.session.commit()
+                if failed and kind == 'import' and source:
+                    try:
+                        os.remove(source)
+                    except OSError:
+                        pass
+            queued = [job_id for (job_id,) in
+                      db.session.query(TrainingJob.id).filter(TrainingJob.status == QUEUED).order_by(TrainingJob.id)]
+            db.session.remove()
+        for job_id in queued:
+            with self._lock:
+                self._pending += 1
+            self._cancel_events.setdefault(job_id, threading.Event())
+            self._executor.submit(self._run, job_id)
+        if stale or queued:
+            print(f"Training jobs: resubmitted {len(queued)} queued, failed {len(stale)} abandoned")
+        return len(queued), len(stale)
+
+    def active_job(self, bot_id, kind='train'):
+        return (
+            TrainingJob.query
+            .filter(
+                TrainingJob.bot_id == bot_id,
+                TrainingJob.kind == kind,
+                TrainingJob.status.in_(ACTIVE_STATUSES),
+            )
+            .order_by(TrainingJob.id.desc())
+            .first()
+        )
+
+    def submit(self, bot_id, kind='train', source=None):
+        """
+        Queue a job for bot_id. A training job already queued or running for
+        the bot is returned instead; every import gets its own job. A unique
+        partial index on training_job settles races between processes.
+        """
+        active = self.active_job(bot_id) if kind == 'train' else None
+        if active is not None:
+            if datetime.utcnow() - (active.updated_at or active.created_at) < self.stale_after:
+                return active
+            # its process died mid-run
+            self._finish(active, FAILED, 'Abandoned: no progress reported')
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise TrainingQueueFull(f"{self._pending} training jobs are already waiting")
+            self._pending += 1
+
+        job = TrainingJob(bot_id=bot_id, kind=kind, source=source, status=QUEUED,
+                          message='Waiting for a training worker')
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # another worker or replica queued one for this bot since the check
+            db.session.rollback()
+            with self._lock:
+                self._pending -= 1
+            return self.active_job(bot_id) or self.submit(bot_id, kind, source)
+        self._cancel_events[job.id] = threading.Event()
+        self._executor.submit(self._run, job.id)
+        return job
+
+    def cancel(self, job):
+        if job.status == QUEUED:
+            self._finish(job, CANCELLED, 'Cancelled before it started')
+        elif job.status == RUNNING:
+            job.cancel_requested = True
+            job.message = 'Cancelling'
+            db.session.commit()
+        event = self._cancel_events.get(job.id)
+        if event is not None:
+            event.set()
+
+    def stats(self):
+        return {
+            'workers': self.max_workers,
+            'pending': self._pending,
+            'completed': self.completed,
+        }
+
+    def _finish(self, job, status, message):
+        job.status = status
+        job.message = message
+        job.finished_at = job.updated_at = datetime.utcnow()
+        if status in (SUCCEEDED, SKIPPED):
+            job.progress = 100
+        db.session.commit()
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            try:
+                now = datetime.utcnow()
+                claimed = (
+                    TrainingJob.query.filter_by(id=job_id, status=QUEUED)
+                    .update({TrainingJob.status: RUNNING, TrainingJob.started_at: now, TrainingJob.updated_at: now},
+                            synchronize_session=False)
+                )
+                db.session.commit()
+                if not claimed:
+                    return  # cancelled, or another process took it
+                job = TrainingJob.query.get(job_id)
+
+                ctx = JobContext(job, self._cancel_events.get(job_id) or threading.Event())
+                try:
+                    if job.kind == 'import':
+                        status, message = run_import_job(ctx)
+                    else:
+                        status, message = run_training_job(ctx)
+                except JobCancelled:
+                    db.session.rollback()
+                    status, message = CANCELLED, 'Cancelled'
+                    if job.kind == 'import' and job.examples:
+                        message += f" after importing {job.examples} examples"
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Training job {job_id} failed: {e}")
+                    status, message = FAILED, str(e)[:500]
+                self._finish(job, status, message)
+                self.completed += 1
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                self._cancel_events.pop(job_id, None)
+                db.session.remove()
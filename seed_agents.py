@@ -1,6 +1,7 @@
 from scripts import create_app, db
-from scripts.models import Chatbot, InteractionLog
+from scripts.models import Chatbot
 from scripts.nlp import SimpleNLPEngine
+from scripts.log_writer import persist_interactions
 
 TEMPLATES = [
     "general",
@@ -22,6 +23,7 @@ def seed_agents():
     app = create_app()
     with app.app_context():
         bots_created = 0
+        logs = []
 
         for template in TEMPLATES:
             for personality in PERSONALITIES:
@@ -55,17 +57,17 @@ def seed_agents():
                 ]
                 for msg in sample_messages:
                     intent, response = SimpleNLPEngine.predict_intent(msg, personality)
-                    log = InteractionLog(
-                        bot_id=bot.id,
-                        user_message=msg,
-                        bot_response=response,
-                        intent=intent,
-                    )
-                    db.session.add(log)
+                    logs.append({
+                        'bot_id': bot.id,
+                        'user_message': msg,
+                        'bot_response': response,
+                        'intent': intent,
+                    })
 
                 bots_created += 1
                 print(f"Created and trained: {name}")
 
+        persist_interactions(logs)
         db.session.commit()
         print(f"\nDone. Total new bots created: {bots_created}")
 
@@ -0,0 +1,61 @@
+/*
+ * Chatbot embed widget. One copy serves every bot: each <script> tag that
+ * loads it configures its own widget through data- attributes:
+ *
+ *   data-bot-id       bot to chat with (required)
+ *   data-bot-name     name shown on the widget
+ *   data-token        the bot's chat token, sent as a Bearer token
+ *   data-chat-url     absolute URL of POST /chat_response
+ *   data-gateway-url  optional WebSocket gateway, tried before HTTP
+ *   data-container    id of the element to turn into the widget
+ *                     (default chatbot-<bot id>, created if missing)
+ */
+(function () {
+    const script = document.currentScript;
+    if (!script) return;
+    const config = script.dataset;
+    const botId = parseInt(config.botId, 10);
+    const botName = config.botName || 'Chatbot';
+    const token = config.token || '';
+    const chatUrl = config.chatUrl || new URL('/chat_response', script.src).href;
+
+    let container = document.getElementById(config.container || 'chatbot-' + botId);
+    if (!container) {
+        container = document.createElement('div');
+        container.id = 'chatbot-' + botId;
+        container.style.cssText = 'cursor:pointer;padding:20px;border:2px dashed #007bff;border-radius:12px;text-align:center;font-size:16px;';
+        script.parentNode.insertBefore(container, script.nextSibling);
+    }
+    const ready = document.createElement('div');
+    ready.style.cssText = 'padding:15px;border:1px solid #ddd;border-radius:8px;background:#f8f9fa;';
+    const name = document.createElement('strong');
+    name.textContent = botName;
+    ready.append('🤖 ', name, ' is ready!');
+    container.replaceChildren(ready);
+
+    let socket = null;
+    if (config.gatewayUrl) {
+        socket = new WebSocket(config.gatewayUrl + '?bot_id=' + botId + '&token=' + encodeURIComponent(token));
+        socket.onmessage = (event) => alert(botName + ': ' + JSON.parse(event.data).response);
+    }
+
+    container.addEventListener('click', async () => {
+        const message = prompt('Talk to ' + botName + ':');
+        if (!message) return;
+        if (socket && socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({message: message}));
+            return;
+        }
+        try {
+            const response = await fetch(chatUrl, {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json', 'Authorization': 'Bearer ' + token},
+                body: JSON.stringify({bot_id: botId, message: message})
+            });
+            const data = await response.json();
+            alert(botName + ': ' + (data.response || data.error));
+        } catch (e) {
+            alert('Chatbot temporarily unavailable');
+        }
+    });
+})();
@@ -1,5 +1,7 @@
+import sys
+
 from scripts.rasa_integration import train_rasa_model
 
 if __name__ == "__main__":
     print("Training Rasa AI Model")
-    train_rasa_model()
+    train_rasa_model(force='--force' in sys.argv)